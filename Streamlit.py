@@ -1,15 +1,19 @@
 import streamlit as st
 import pickle
 import pandas as pd
-from utils import get_recommendations_gensim, get_recommendations_surprise
+from utils import CatalogIndex
+from artifacts import has_columnar_catalog, ColumnarCatalog, CORE_CATALOG_COLUMNS
+from images import ImageFetcher, ShopeeImageResolver
+from service import RecommendationService, ServiceClient
+from metrics import TRACER
 from PIL import Image
 import requests
 from io import BytesIO
 import re
-from bs4 import BeautifulSoup
 import sys
 import traceback
 import os
+import time
 
 # Set page config
 st.set_page_config(
@@ -36,21 +40,15 @@ st.markdown(
 # st.write(f"Python version: {sys.version}")
 # st.write(f"Streamlit version: {st.__version__}")
 
-# Load models
-@st.cache_resource
-def load_models():
+# Recommendations come from the service (service.py). With RECOMMENDER_URL set Streamlit is only
+# a client; otherwise the same service runs in-process and owns the models
+@st.cache_resource(show_spinner="Loading models...")
+def load_recommender():
+    url = os.environ.get('RECOMMENDER_URL')
+    if url:
+        return ServiceClient(url)
     try:
-        with open('models/dictionary.pkl', 'rb') as f1:
-            dictionary = pickle.load(f1)
-        with open('models/tfidf_model.pkl', 'rb') as f2:
-            tfidf = pickle.load(f2)
-        with open('models/lsi_model.pkl', 'rb') as f3:
-            lsi_model = pickle.load(f3)
-        with open('models/similarity_index.pkl', 'rb') as f4:
-            similarity_index = pickle.load(f4)
-        with open('models/surprise_svd_model.pkl', 'rb') as f5:
-            surprise = pickle.load(f5)
-        return dictionary, tfidf, lsi_model, similarity_index, surprise
+        return RecommendationService.load()
     except Exception as e:
         st.error(f"Error loading models: {str(e)}")
         st.error("Please check if all model files exist in the models/ directory")
@@ -70,6 +68,20 @@ def load_data():
         st.error("Please check if processed_data.pkl exists in the data/ directory")
         raise e
 
+# Build the product_id -> row position index once per data load
+@st.cache_resource(ttl="1h")
+def load_catalog_index():
+    # Columnar catalog (python build_artifacts.py export-catalog): only the ranking columns are
+    # loaded up front, descriptions, links, images and token lists are read per row on demand
+    recommender = load_recommender()
+    if isinstance(recommender, RecommendationService):
+        # In-process service: share its catalog instead of loading a second copy
+        return recommender.catalog
+    if has_columnar_catalog():
+        store = ColumnarCatalog()
+        return CatalogIndex(store.frame(CORE_CATALOG_COLUMNS), store=store, deleted=store.tombstones)
+    return CatalogIndex(load_data())
+
 # def load_user_rating_data():
 #     with open('data/user_rating_df.pkl', 'rb') as f:
 #         data = pickle.load(f)
@@ -80,50 +92,24 @@ def load_sample_products():
     sample_df = pd.read_csv('sample_products.csv')
     return sample_df
 
+# One pooled, cached image fetcher per process
+@st.cache_resource
+def load_image_fetcher():
+    return ImageFetcher()
+
 def load_image_from_url(url):
-    try:
-        response = requests.get(url)
-        if response.status_code == 200:
-            img = Image.open(BytesIO(response.content))
-            return img
-    except:
-        return None
-    return None
+    return load_image_fetcher().fetch(url)
+
+# Image URLs of product pages are resolved offline (python build_artifacts.py resolve-images);
+# requests served to users only read the resolver cache and never scrape a page
+@st.cache_resource
+def load_image_resolver():
+    return ShopeeImageResolver()
 
 def extract_shopee_image_url(product_url):
-    try:
-        # Add headers to mimic a browser request
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        
-        # Get the product page
-        response = requests.get(product_url, headers=headers)
-        if response.status_code == 200:
-            # Parse the HTML
-            soup = BeautifulSoup(response.text, 'html.parser')
-            
-            # Find the picture element with class UkIsx8
-            picture = soup.find('picture', {'class': 'UkIsx8'})
-            if picture:
-                # Find the img tag within the picture
-                img_tag = picture.find('img')
-                if img_tag and 'src' in img_tag.attrs:
-                    # Get the full resolution image URL by removing the resize parameters
-                    image_url = img_tag['src']
-                    # Remove any resize parameters from the URL
-                    image_url = image_url.split('@')[0] if '@' in image_url else image_url
-                    return image_url
-            
-            # Fallback: Look for meta tags with image information
-            meta_img = soup.find('meta', {'property': 'og:image'})
-            if meta_img and 'content' in meta_img.attrs:
-                return meta_img['content']
-    except:
-        return None
-    return None
+    return load_image_resolver().lookup(product_url)
 
-def display_recommendation(row, df, search_type):
+def display_recommendation(row, catalog, search_type):
     """Display a single recommendation in a card format"""
     st.markdown("""
         <div style="
@@ -197,8 +183,8 @@ def display_recommendation(row, df, search_type):
         
         # Get the product link from the original DataFrame
         try:
-            if 'link' in df.columns:
-                product_link = df[df['product_id'] == row['product_id']]['link'].iloc[0]
+            if 'link' in catalog.columns:
+                product_link = catalog.get(row['product_id'], 'link')
                 st.markdown(f"""
                     <a href="{product_link}" target="_blank" style="
                         display: inline-block;
@@ -315,8 +301,8 @@ def show_recommendations():
     st.title("🛍️ Product Recommendation System")
     
     # Load models and data
-    dictionary, tfidf, lsi_model, similarity_index, surprise = load_models()
-    df = load_data()
+    recommender = load_recommender()
+    catalog = load_catalog_index()
     sample_products = load_sample_products()
     
     # Create two columns for search options
@@ -326,13 +312,25 @@ def show_recommendations():
     with search_col1:
         search_type = st.radio(
             "Choose search type:",
-            ["Product Selection", "Text Search", "User Rating"]
+            ["Product Selection", "Text Search", "User Rating", "Hybrid"]
+        )
+        engines = recommender.info().get('engines', ['gensim'])
+        engine = 'gensim'
+        if search_type not in ("User Rating", "Hybrid") and len(engines) > 1:
+            engine = st.radio(
+                "Similarity engine:",
+                engines,
+                format_func={'gensim': "Gensim (LSI)", 'cosine': "Cosine (TF-IDF)"}.get,
+                horizontal=True
+            )
+        approximate = engine == 'gensim' and recommender.info()['approximate'] and st.checkbox(
+            "Approximate search (faster, may miss a few matches)", value=False
         )
         
         if search_type == "Product Selection":
             # Create a dropdown with product names and IDs
             product_options = {f"{row['product_name']} (ID: {row['product_id']})": row['product_id'] 
-                             for _, row in sample_products.iterrows()}
+                             for _, row in sample_products.iterrows() if row['product_id'] in catalog}
             
             selected_product_name = st.selectbox(
                 "Select a product:",
@@ -342,7 +340,7 @@ def show_recommendations():
             product_id = product_options[selected_product_name]
             
             # Show selected product
-            selected_product = df[df['product_id'] == product_id].iloc[0]
+            selected_product = catalog.row(product_id)
             st.markdown("**Selected Product:**")
             st.write(f"Name: {selected_product['product_name']}")
             st.write(f"Category: {selected_product['sub_category']}")
@@ -350,17 +348,17 @@ def show_recommendations():
                 st.write(f"Rating: {selected_product['rating']}")
             st.write(f"Price: {selected_product['price']}")
             st.markdown(f'<a href="{selected_product["link"]}" target="_blank" style="display: inline-block; padding: 0.5rem 1rem; background-color: #FF4B4B; color: white; text-decoration: none; border-radius: 0.25rem;">View Product</a>', unsafe_allow_html=True)
+            same_sub_category = st.checkbox("Only recommend products from the same category", value=False)
             
             # Get recommendations automatically
-            recommendations = get_recommendations_gensim(
-                similarity_index=similarity_index,
-                df=df,
-                tfidf=tfidf,
-                lsi_model=lsi_model,
-                dictionary=dictionary,
-                product_id=product_id,
-                nums=4  # Increased to show more recommendations
-            )
+            with TRACER.stage('ui.recommend'):
+                recommendations = recommender.recommend_product(
+                    product_id,
+                    nums=4,  # Increased to show more recommendations
+                    approximate=approximate,
+                    same_category=same_sub_category,
+                    engine=engine
+                )
         elif search_type == "User Rating":
             # User rating
             user_id = st.text_input("Enter your user id (number in range 0-650636):")
@@ -377,26 +375,54 @@ def show_recommendations():
                 if user_id not in range(0,650636):
                     st.error("User ID not found in the dataset")
                 else:
-                    recommendations = get_recommendations_surprise(
-                        df_productid=df[['product_id']],  # Pass DataFrame with product_ids
-                        full_product_df=df,
-                        surprise=surprise,
-                        user_id=user_id,
-                        nums=4  # Increased to show more recommendations
-                )
+                    with TRACER.stage('ui.recommend'):
+                        recommendations = recommender.recommend_user(
+                            user_id,
+                            nums=4  # Increased to show more recommendations
+                        )
+        elif search_type == "Hybrid":
+            # Personalized re-ranking of the products similar to a seed product or query
+            user_id = st.text_input("Enter your user id (number in range 0-650636):")
+            seed_type = st.radio("Seed:", ["Product", "Text query", "None (ratings only)"], horizontal=True)
+            seed_product_id = seed_query = None
+            if seed_type == "Product":
+                product_options = {f"{row['product_name']} (ID: {row['product_id']})": row['product_id']
+                                 for _, row in sample_products.iterrows() if row['product_id'] in catalog}
+                seed_product_id = product_options[st.selectbox("Select a seed product:", options=list(product_options.keys()))]
+            elif seed_type == "Text query":
+                seed_query = st.text_input("Enter your search query:") or None
+            content_weight = st.slider(
+                "Weight of content similarity (the rest goes to the predicted rating):",
+                min_value=0.0, max_value=1.0, value=0.5, step=0.05
+            )
+            if user_id:
+                if not user_id.isdigit() or user_id.strip('0') == '':
+                    st.error("Please enter a valid numeric user ID")
+                    return
+                if int(user_id) not in range(0,650636):
+                    st.error("User ID not found in the dataset")
+                elif seed_type != "Text query" or seed_query:
+                    with TRACER.stage('ui.recommend'):
+                        recommendations = recommender.recommend_hybrid(
+                            int(user_id),
+                            product_id=seed_product_id,
+                            query=seed_query,
+                            nums=4,
+                            content_weight=content_weight,
+                            rating_weight=1.0 - content_weight,
+                            approximate=approximate
+                        )
         else:
             # Text search
             query = st.text_input("Enter your search query:")
             if query:
-                recommendations = get_recommendations_gensim(
-                    similarity_index=similarity_index,
-                    df=df,
-                    tfidf=tfidf,
-                    lsi_model=lsi_model,
-                    dictionary=dictionary,
-                    query=query,
-                    nums=4  # Increased to show more recommendations
-                )
+                with TRACER.stage('ui.recommend'):
+                    recommendations = recommender.recommend_query(
+                        query,
+                        nums=4,  # Increased to show more recommendations
+                        approximate=approximate,
+                        engine=engine
+                    )
     
     with search_col2:
         st.markdown("""
@@ -406,6 +432,7 @@ def show_recommendations():
                 <li>Product Selection: Choose from our curated list of products</li>
                 <li>Text Search: Use natural language to describe what you're looking for</li>
                 <li>User Rating: Get personalized recommendations based on your preferences</li>
+                <li>Hybrid: Products similar to a seed product or query, re-ranked for your ratings</li>
             </ul>
         </div>
         """, unsafe_allow_html=True)
@@ -415,18 +442,34 @@ def show_recommendations():
         st.markdown("---")
         st.markdown("<h3 style='text-align: center; font-size: 1.5em;'>Recommended Products</h3>", unsafe_allow_html=True)
         
+        # Gather image, price, description and link for every card in one lookup
+        with TRACER.stage('ui.card_details'):
+            card_details = catalog.lookup(recommendations['product_id'], ['image', 'price', 'description', 'link'])
+            
+            # Fall back to the resolver cache for products without an image URL
+            card_image_urls = [
+                image if isinstance(image, str) and image.strip() else extract_shopee_image_url(link)
+                for image, link in zip(card_details['image'], card_details['link'])
+            ]
+        
+        # Download all card images in parallel (cached thumbnails are served without a request)
+        with TRACER.stage('ui.image_fetch'):
+            card_images = load_image_fetcher().fetch_many(card_image_urls)
+        
         # Create a grid of 4 columns for recommendations
+        render_start = time.perf_counter()
         cols = st.columns(4)
         for idx, (_, row) in enumerate(recommendations.iterrows()):
+            details = card_details.iloc[idx]
             with cols[idx % 4]:
                 
-                # Get the product image from the original DataFrame
-                product_image = df[df['product_id'] == row['product_id']]['image'].iloc[0]
+                # Get the product image from the catalog
+                product_image = card_image_urls[idx]
                 
                 # Display product image
                 try:
                     if product_image:
-                        img = load_image_from_url(product_image)
+                        img = card_images[idx]
                         if img:
                             st.image(img, use_container_width=True)
                         else:
@@ -473,8 +516,8 @@ def show_recommendations():
                         """, unsafe_allow_html=True)
                                 
                 # Display product details
-                price = df[df['product_id'] == row.product_id]['price'].iloc[0]
-                des = df[df['product_id'] == row.product_id]['description'].iloc[0]
+                price = details['price']
+                des = details['description']
 
                 st.markdown(f"""
                     <div style='
@@ -486,7 +529,7 @@ def show_recommendations():
                     '>
                         <div>
                             <h4 style='color: #FF4B4B; margin-top: 10px; white-space: nowrap; overflow: hidden; text-overflow: ellipsis;'>{row['product_name']}</h4>
-                            <p style='color: #FFD700;'>{'Predicted Rating' if search_type == 'User Rating' else 'Similarity Score'}: {row.get('Score_Prediction', row.get('similarity_score', 0)):.2f}</p>
+                            <p style='color: #FFD700;'>{'Hybrid Score' if 'hybrid_score' in row else 'Predicted Rating' if 'Score_Prediction' in row else 'Similarity Score'}: {row.get('hybrid_score', row.get('Score_Prediction', row.get('similarity_score', 0))):.2f}</p>
                             <p style='color: white; font-size: 0.9em;'><strong>Category:</strong> {row.get('sub_category', '')}</p>
                             <p style='color: white; font-size: 0.9em;'><strong>Price:</strong> {price}</p>
                             <p style='color: white; font-size: 0.9em;'><strong>Description:</strong> {des}</p>
@@ -494,9 +537,9 @@ def show_recommendations():
                         
                 """, unsafe_allow_html=True)
                 
-                # Get the product link from the original DataFrame
+                # Get the product link from the catalog
                 try:
-                    product_link = df[df['product_id'] == row['product_id']]['link'].iloc[0]
+                    product_link = details['link']
                     st.markdown(f"""
                         <a href="{product_link}" target="_blank" style="
                             display: inline-block;
@@ -512,6 +555,22 @@ def show_recommendations():
                     """, unsafe_allow_html=True)
                 except:
                     st.markdown("<p style='color: #666;'>Product link not available</p>", unsafe_allow_html=True)
+        
+        if TRACER.enabled:
+            TRACER.observe('ui.render', (time.perf_counter() - render_start) * 1000)
+
+# Hiển thị bảng độ trễ từng giai đoạn ở thanh bên (chế độ debug)
+def show_trace_panel():
+    stages = TRACER.snapshot()
+    st.sidebar.markdown(f"**Stage latency (last {TRACER.window_s // 60:.0f} min, ms)**")
+    if not stages:
+        st.sidebar.caption("No stages recorded yet - run a search.")
+        return
+    table = pd.DataFrame(stages).set_index('stage')[['count', 'p50_ms', 'p95_ms', 'p99_ms']]
+    table.columns = ['n', 'p50', 'p95', 'p99']
+    st.sidebar.dataframe(table, use_container_width=True)
+    if st.sidebar.button("Reset timings"):
+        TRACER.reset()
 
 def main():
     try:
@@ -539,12 +598,22 @@ def main():
         if 'page' not in st.session_state:
             st.session_state.page = "Home"
         
+        # Stage timers are switched on before the page runs so this run is measured too.
+        # TRACER is shared by every session (and /metrics): the checkbox can turn it on but
+        # never off, so tracing enabled by RECOMMENDER_TRACE stays on
+        debug_panel = st.sidebar.checkbox("🐞 Latency debug panel", value=False)
+        if debug_panel and not TRACER.enabled:
+            TRACER.enable()
+        
         # Show the selected page
         if st.session_state.page == "Home":
             show_homepage()
         else:
             show_recommendations()
         
+        if debug_panel:
+            show_trace_panel()
+        
             # Add empty space to push footer to bottom
         st.sidebar.markdown("<br>" * 13, unsafe_allow_html=True)
 
@@ -562,14 +631,3 @@ def main():
 
 if __name__ == "__main__":
     main()
-
-#    # Cosine in Streamlit
-#    @st.cache_data
-#    def load_cosine_models():
-#        with open('models/vectorizer.pkl', 'rb') as f:
-#            vectorizer = pickle.load(f)
-#        with open('models/tfidf_matrix.pkl', 'rb') as f:
-#            tfidf_matrix = pickle.load(f)
-#        return vectorizer, tfidf_matrix
-
-
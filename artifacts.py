@@ -0,0 +1,821 @@
+"""
+Memory-mapped model and catalog artifacts
+
+The pickled Gensim / Surprise models are exported once into a directory of raw
+`.npy` arrays (similarity index, LSI projection, IDF weights, SVD factors) plus
+a small JSON manifest. Loading maps the arrays with `mmap_mode='r'`, so cold
+start does not deserialize anything large and every worker process on a host
+shares the same pages through the OS page cache.
+
+The product catalog gets the same treatment column by column: numeric columns
+are plain arrays, `category` / `sub_category` are stored as categorical codes
+and text columns (including the tokenized `content_processed`) as one UTF-8
+buffer plus row offsets, so single rows can be decoded without loading the rest.
+
+Both stores grow in place: `append_rows` writes new rows at the end of a
+saved array and then rewrites its header, and the manifests record how many
+rows are committed, so a crash mid-append never exposes a torn row (see
+ingest.py). Deleted products are tombstoned in `tombstones.npy` next to the
+catalog instead of being removed.
+
+The sklearn cosine engine is exported the same way (`export_cosine_models`):
+the TfidfVectorizer vocabulary as one sorted UTF-8 buffer, its IDF weights and
+the L2-normalized TF-IDF matrix as the three CSR arrays, so a search is a
+sparse matrix-vector product over mapped pages.
+"""
+import json
+import os
+import re
+from collections import Counter
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.preprocessing import normalize
+
+from indexes import unit_query_vector
+from utils import SVDScorer
+
+MMAP_MODELS_DIR = 'models/mmap'
+COSINE_MODELS_DIR = 'models/cosine'
+CATALOG_DIR = 'data/catalog'
+MANIFEST_FILE = 'manifest.json'
+
+# Columns kept in memory for ranking; the others are decoded row by row on demand
+CORE_CATALOG_COLUMNS = ['product_id', 'product_name', 'category', 'sub_category', 'price', 'rating']
+CATEGORICAL_COLUMNS = ['category', 'sub_category']
+TOKEN_SEPARATOR = '\x1f'
+
+
+def _save_array(out_dir, name, array):
+    np.save(os.path.join(out_dir, f'{name}.npy'), np.ascontiguousarray(array), allow_pickle=False)
+
+
+def _load_array(model_dir, name, mmap_mode='r'):
+    return np.load(os.path.join(model_dir, f'{name}.npy'), mmap_mode=mmap_mode, allow_pickle=False)
+
+
+# Ghi thêm dòng vào cuối một file .npy mà không ghi lại toàn bộ mảng
+def append_rows(path, rows, at_row=None):
+    """
+    Append rows along the first axis of a saved C-order .npy array, in place
+
+    The rows are written first and the header (which holds the shape) last,
+    so an interrupted append leaves the old array readable. `np.save` pads the
+    header for exactly this kind of growth; if the new shape still does not
+    fit, the file is rewritten.
+
+    Args:
+        path: .npy file (created when missing)
+        rows: Array whose trailing dimensions match the saved array
+        at_row: Write from this row on, dropping anything after it (default: the end)
+
+    Returns:
+        Number of rows in the file afterwards
+    """
+    rows = np.asarray(rows)
+    if not os.path.exists(path):
+        np.save(path, np.ascontiguousarray(rows), allow_pickle=False)
+        return len(rows)
+    with open(path, 'r+b') as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        data_offset = f.tell()
+        if fortran_order or tuple(rows.shape[1:]) != tuple(shape[1:]):
+            raise ValueError(f"Cannot append rows of shape {rows.shape} to {path} {shape}")
+        start = shape[0] if at_row is None else min(at_row, shape[0])
+        new_shape = (start + len(rows),) + tuple(shape[1:])
+        header_offset = 10 if version == (1, 0) else 12
+        header = "{'descr': %r, 'fortran_order': False, 'shape': %r, }" % (np.lib.format.dtype_to_descr(dtype), new_shape)
+        header_size = data_offset - header_offset
+        if len(header) + 1 <= header_size and np.can_cast(rows.dtype, dtype, casting='safe'):
+            row_bytes = dtype.itemsize * int(np.prod(shape[1:], dtype=np.int64))
+            f.seek(data_offset + start * row_bytes)
+            f.write(np.ascontiguousarray(rows, dtype=dtype).tobytes())
+            f.truncate()
+            f.seek(header_offset)
+            f.write((header.ljust(header_size - 1) + '\n').encode('latin1'))
+            return new_shape[0]
+    # No room in the header or a wider dtype is needed: rewrite the whole file
+    existing = np.load(path, allow_pickle=False)[:start]
+    tmp_path = path + '.tmp.npy'
+    np.save(tmp_path, np.concatenate([existing, rows.astype(np.result_type(existing, rows), copy=False)]), allow_pickle=False)
+    os.replace(tmp_path, path)
+    return new_shape[0]
+
+
+def _write_manifest(out_dir, manifest):
+    """Replace a manifest atomically; it is the commit point of every append"""
+    tmp_path = os.path.join(out_dir, MANIFEST_FILE + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, os.path.join(out_dir, MANIFEST_FILE))
+
+
+# Từ điển Gensim rút gọn: chỉ giữ token2id để chạy doc2bow
+class MmapDictionary:
+    """Drop-in for `corpora.Dictionary.doc2bow` backed by a plain token2id map"""
+
+    def __init__(self, token2id):
+        self.token2id = token2id
+
+    def __len__(self):
+        return len(self.token2id)
+
+    def doc2bow(self, document):
+        if isinstance(document, str):
+            raise TypeError("doc2bow expects an array of unicode tokens on input, not a single string")
+        counts = Counter(document)
+        token2id = self.token2id
+        return sorted((token2id[token], freq) for token, freq in counts.items() if token in token2id)
+
+
+# Mô hình TF-IDF dùng vector IDF dạng mảng
+class MmapTfidf:
+    """
+    Drop-in for `models.TfidfModel[bow]` using a dense IDF array
+
+    Only the default weighting (raw term frequency, L2 normalization) that the
+    notebook trains is supported.
+    """
+
+    def __init__(self, idf, eps=1e-12):
+        self.idf = idf
+        self.eps = eps
+
+    def __getitem__(self, bow):
+        if not bow:
+            return []
+        term_ids = np.fromiter((termid for termid, _ in bow), dtype=np.int64, count=len(bow))
+        tfs = np.fromiter((tf for _, tf in bow), dtype=np.float64, count=len(bow))
+        in_vocab = term_ids < len(self.idf)
+        term_ids, tfs = term_ids[in_vocab], tfs[in_vocab]
+        idfs = np.asarray(self.idf[term_ids], dtype=np.float64)
+        keep = np.abs(idfs) > self.eps
+        term_ids, weights = term_ids[keep], tfs[keep] * idfs[keep]
+        norm = np.sqrt(np.dot(weights, weights))
+        if norm > 0:
+            weights = weights / norm
+        keep = np.abs(weights) > self.eps
+        return list(zip(term_ids[keep].tolist(), weights[keep].tolist()))
+
+
+# Mô hình LSI dùng ma trận chiếu ánh xạ bộ nhớ
+class MmapLsi:
+    """
+    Drop-in for `models.LsiModel[tfidf_vector]` backed by the projection matrix
+
+    Returns a dense topic vector (a NumPy array) instead of a list of tuples;
+    Gensim's MatrixSimilarity and `MmapSimilarity` both accept it.
+    """
+
+    def __init__(self, u, s, num_topics):
+        self.projection = SimpleNamespace(u=u, s=s)
+        self.num_topics = num_topics
+        self.num_terms = u.shape[0]
+
+    def __getitem__(self, tfidf_vector, scaled=False):
+        topic_dist = np.zeros(self.num_topics, dtype=self.projection.u.dtype)
+        if tfidf_vector:
+            term_ids = np.fromiter((termid for termid, _ in tfidf_vector), dtype=np.int64, count=len(tfidf_vector))
+            weights = np.fromiter((w for _, w in tfidf_vector), dtype=np.float64, count=len(tfidf_vector))
+            # Only the rows of the query terms are touched, so the mapped matrix stays mostly on disk
+            topic_dist = weights @ self.projection.u[term_ids, :self.num_topics]
+        if scaled:
+            topic_dist = (1.0 / self.projection.s[:self.num_topics]) * topic_dist
+        return topic_dist
+
+
+# Chỉ mục tương đồng dùng ma trận vector LSI đã chuẩn hóa
+class MmapSimilarity:
+    """
+    Drop-in for `similarities.MatrixSimilarity[lsi_vector]` over a mapped matrix
+
+    Args:
+        index: (n_products x num_features) matrix of L2-normalized LSI vectors
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self.num_features = index.shape[1]
+
+    def __len__(self):
+        return self.index.shape[0]
+
+    def query_vector(self, lsi_vector):
+        """Convert a Gensim sparse or dense LSI vector into a unit-length dense vector"""
+        return unit_query_vector(lsi_vector, self.num_features, dtype=self.index.dtype)
+
+    def __getitem__(self, lsi_vector):
+        return self.index @ self.query_vector(lsi_vector)
+
+
+# Xuất các mô hình pickle sang định dạng .npy
+def export_mmap_models(dictionary, tfidf, lsi_model, similarity_index, surprise, out_dir=MMAP_MODELS_DIR):
+    """
+    Export the trained models into the memory-mapped artifact format
+
+    Args:
+        dictionary: Gensim Dictionary
+        tfidf: Gensim TfidfModel (default smartirs)
+        lsi_model: Gensim LsiModel
+        similarity_index: Gensim MatrixSimilarity over the LSI corpus
+        surprise: Fitted surprise.SVD or SVDScorer
+        out_dir: Target directory
+    """
+    if getattr(tfidf, 'smartirs', None) or getattr(tfidf, 'pivot', None) is not None:
+        raise ValueError("Only the default TF-IDF weighting can be exported")
+    os.makedirs(out_dir, exist_ok=True)
+
+    # TF-IDF: dense IDF weights indexed by term id
+    num_terms = max(len(dictionary), max(tfidf.idfs, default=-1) + 1)
+    idf = np.zeros(num_terms, dtype=np.float64)
+    for termid, weight in tfidf.idfs.items():
+        idf[termid] = weight
+    _save_array(out_dir, 'tfidf_idf', idf)
+
+    # LSI projection and singular values
+    num_topics = lsi_model.num_topics
+    _save_array(out_dir, 'lsi_u', lsi_model.projection.u[:, :num_topics])
+    _save_array(out_dir, 'lsi_s', lsi_model.projection.s[:num_topics])
+
+    # Similarity index matrix (rows are already unit length)
+    _save_array(out_dir, 'similarity_index', similarity_index.index)
+
+    # SVD factors, biases and raw ids
+    scorer = surprise if isinstance(surprise, SVDScorer) else SVDScorer.from_algo(surprise)
+    _save_array(out_dir, 'svd_pu', scorer.pu)
+    _save_array(out_dir, 'svd_qi', scorer.qi)
+    _save_array(out_dir, 'svd_bu', scorer.bu)
+    _save_array(out_dir, 'svd_bi', scorer.bi)
+    _save_array(out_dir, 'svd_user_ids', np.asarray(scorer.raw_user_ids))
+    _save_array(out_dir, 'svd_item_ids', np.asarray(scorer.raw_item_ids))
+
+    manifest = {
+        'version': 1,
+        'num_rows': int(similarity_index.index.shape[0]),
+        'num_topics': int(num_topics),
+        'num_terms': int(num_terms),
+        'tfidf_eps': float(getattr(tfidf, 'eps', 1e-12)),
+        'svd': {
+            'global_mean': scorer.global_mean,
+            'rating_scale': list(scorer.rating_scale),
+            'biased': bool(scorer.biased),
+        },
+    }
+    vocabulary_path = os.path.join(out_dir, 'vocabulary.json')
+    with open(vocabulary_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(dictionary.token2id, f, ensure_ascii=False)
+    os.replace(vocabulary_path + '.tmp', vocabulary_path)
+    _write_manifest(out_dir, manifest)
+
+
+def has_mmap_models(model_dir=MMAP_MODELS_DIR):
+    return os.path.exists(os.path.join(model_dir, MANIFEST_FILE))
+
+
+# Nạp mô hình dạng ánh xạ bộ nhớ (gần như tức thì)
+def load_mmap_models(model_dir=MMAP_MODELS_DIR):
+    """
+    Load the exported artifacts with memory-mapped arrays
+
+    Returns:
+        Tuple (dictionary, tfidf, lsi_model, similarity_index, svd_scorer) with the
+        same call interface as the pickled models used by utils.py
+    """
+    with open(os.path.join(model_dir, MANIFEST_FILE), encoding='utf-8') as f:
+        manifest = json.load(f)
+    with open(os.path.join(model_dir, 'vocabulary.json'), encoding='utf-8') as f:
+        token2id = json.load(f)
+
+    dictionary = MmapDictionary(token2id)
+    tfidf = MmapTfidf(_load_array(model_dir, 'tfidf_idf'), eps=manifest['tfidf_eps'])
+    lsi_model = MmapLsi(_load_array(model_dir, 'lsi_u'), _load_array(model_dir, 'lsi_s'), manifest['num_topics'])
+    index = _load_array(model_dir, 'similarity_index')
+    # Rows past num_rows belong to an ingest that has not committed yet
+    similarity_index = MmapSimilarity(index[:manifest.get('num_rows', len(index))])
+
+    svd = manifest['svd']
+    scorer = SVDScorer(
+        pu=_load_array(model_dir, 'svd_pu'),
+        qi=_load_array(model_dir, 'svd_qi'),
+        bu=_load_array(model_dir, 'svd_bu'),
+        bi=_load_array(model_dir, 'svd_bi'),
+        global_mean=svd['global_mean'],
+        rating_scale=svd['rating_scale'],
+        raw_user_ids=_load_array(model_dir, 'svd_user_ids', mmap_mode=None),
+        raw_item_ids=_load_array(model_dir, 'svd_item_ids', mmap_mode=None),
+        biased=svd['biased'],
+    )
+    return dictionary, tfidf, lsi_model, similarity_index, scorer
+
+
+# Từ vựng TfidfVectorizer dạng mảng: tra cứu token bằng tìm kiếm nhị phân
+class MmapVocabulary:
+    """
+    Drop-in for `TfidfVectorizer.vocabulary_` lookups over a mapped, sorted term buffer
+
+    Terms are stored in UTF-8 byte order (the same order as Python strings),
+    so a lookup is a binary search over the offsets and nothing is decoded or
+    hashed when the vocabulary is loaded.
+
+    Args:
+        data: uint8 buffer of the concatenated UTF-8 terms, in sorted order
+        offsets: Start of every term in data, plus the end (n_terms + 1,)
+        columns: Matrix column of every sorted term
+    """
+
+    def __init__(self, data, offsets, columns):
+        self.data = data
+        self.offsets = offsets
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.columns)
+
+    def __contains__(self, term):
+        return self.get(term) is not None
+
+    def __getitem__(self, term):
+        column = self.get(term)
+        if column is None:
+            raise KeyError(term)
+        return column
+
+    def _term(self, rank):
+        return self.data[self.offsets[rank]:self.offsets[rank + 1]].tobytes()
+
+    def get(self, term, default=None):
+        key = term.encode('utf-8')
+        low, high = 0, len(self.columns)
+        while low < high:
+            middle = (low + high) // 2
+            if self._term(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(self.columns) and self._term(low) == key:
+            return int(self.columns[low])
+        return default
+
+
+# Bộ vector hóa TF-IDF dùng từ vựng và trọng số IDF đã xuất
+class MmapVectorizer:
+    """
+    Drop-in for `TfidfVectorizer.transform` with the exported vocabulary and IDF weights
+
+    Reproduces the default word analyzer (lowercasing, token_pattern, stop
+    words, word n-grams) and the weighting options of the fitted vectorizer.
+
+    Args:
+        vocabulary: MmapVocabulary
+        idf: IDF weight of every column (None when the vectorizer had use_idf=False)
+        token_pattern, lowercase, stop_words, ngram_range, binary, sublinear_tf, norm:
+            Settings of the fitted TfidfVectorizer
+        dtype: dtype of the returned matrix
+    """
+
+    def __init__(self, vocabulary, idf=None, token_pattern=r"(?u)\b\w\w+\b", lowercase=True, stop_words=None,
+                 ngram_range=(1, 1), binary=False, sublinear_tf=False, norm='l2', dtype=np.float32):
+        self.vocabulary_ = vocabulary
+        self.idf_ = idf
+        self.token_pattern = token_pattern
+        self.lowercase = lowercase
+        self.stop_words = frozenset(stop_words) if stop_words else None
+        self.ngram_range = tuple(ngram_range)
+        self.binary = binary
+        self.sublinear_tf = sublinear_tf
+        self.norm = norm
+        self.dtype = dtype
+        self._token_re = re.compile(token_pattern)
+
+    def analyze(self, document):
+        """Terms of a document, as TfidfVectorizer.build_analyzer() would return them"""
+        if self.lowercase:
+            document = document.lower()
+        tokens = self._token_re.findall(document)
+        if self.stop_words is not None:
+            tokens = [token for token in tokens if token not in self.stop_words]
+        min_n, max_n = self.ngram_range
+        if max_n == 1:
+            return tokens
+        terms = list(tokens) if min_n == 1 else []
+        for n in range(max(min_n, 2), min(max_n, len(tokens)) + 1):
+            terms.extend(' '.join(tokens[i:i + n]) for i in range(len(tokens) - n + 1))
+        return terms
+
+    def transform(self, raw_documents):
+        """
+        TF-IDF rows of raw documents
+
+        Returns:
+            scipy.sparse CSR matrix (len(raw_documents) x n_terms)
+        """
+        if isinstance(raw_documents, str):
+            raise ValueError("Iterable over raw text documents expected, string object received.")
+        indptr, indices, values = [0], [], []
+        for document in raw_documents:
+            counts = Counter()
+            for term in self.analyze(document):
+                column = self.vocabulary_.get(term)
+                if column is not None:
+                    counts[column] += 1
+            columns = np.fromiter(sorted(counts), dtype=np.int64, count=len(counts))
+            weights = np.fromiter((counts[c] for c in columns), dtype=np.float64, count=len(counts))
+            if self.binary:
+                weights = np.minimum(weights, 1.0)
+            if self.sublinear_tf:
+                weights = 1.0 + np.log(weights)
+            if self.idf_ is not None:
+                weights = weights * self.idf_[columns]
+            if self.norm == 'l2':
+                norm = np.sqrt(np.dot(weights, weights))
+            elif self.norm == 'l1':
+                norm = np.abs(weights).sum()
+            else:
+                norm = 0.0
+            if norm > 0:
+                weights = weights / norm
+            indices.extend(columns.tolist())
+            values.extend(weights.tolist())
+            indptr.append(len(indices))
+        return sparse.csr_matrix(
+            (np.asarray(values, dtype=self.dtype), np.asarray(indices, dtype=np.int32), np.asarray(indptr, dtype=np.int64)),
+            shape=(len(indptr) - 1, len(self.vocabulary_)),
+        )
+
+
+# Xuất TfidfVectorizer và ma trận TF-IDF (chuẩn hóa L2) sang định dạng .npy
+def export_cosine_models(vectorizer, tfidf_matrix, out_dir=COSINE_MODELS_DIR):
+    """
+    Export the sklearn cosine engine into the memory-mapped artifact format
+
+    The rows are L2-normalized once here, so the cosine similarity at query
+    time is a plain sparse matrix-vector product. The files are written next
+    to the old ones and moved over them, so services mapping the previous
+    export keep valid pages.
+
+    Args:
+        vectorizer: Fitted TfidfVectorizer (word analyzer, no custom preprocessor or tokenizer)
+        tfidf_matrix: TF-IDF matrix of the catalog, one row per product
+        out_dir: Target directory
+    """
+    if vectorizer.analyzer != 'word' or vectorizer.preprocessor is not None \
+            or vectorizer.tokenizer is not None or vectorizer.strip_accents is not None:
+        raise ValueError("Only the default word analyzer of TfidfVectorizer can be exported")
+    matrix = normalize(sparse.csr_matrix(tfidf_matrix, dtype=np.float32), norm='l2')
+    matrix.sort_indices()
+    index_dtype = np.int32 if max(matrix.nnz, matrix.shape[1]) < np.iinfo(np.int32).max else np.int64
+
+    tmp_dir = out_dir.rstrip('/') + '.tmp'
+    os.makedirs(tmp_dir, exist_ok=True)
+    # Vocabulary sorted by term, with the matrix column of every term
+    terms = sorted(vectorizer.vocabulary_.items())
+    encoded = [term.encode('utf-8') for term, _ in terms]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    _save_array(tmp_dir, 'vocabulary.data', np.frombuffer(b''.join(encoded), dtype=np.uint8))
+    _save_array(tmp_dir, 'vocabulary.offsets', offsets)
+    _save_array(tmp_dir, 'vocabulary.columns', np.asarray([column for _, column in terms], dtype=index_dtype))
+    if vectorizer.use_idf:
+        _save_array(tmp_dir, 'idf', vectorizer.idf_)
+    _save_array(tmp_dir, 'matrix.data', matrix.data)
+    _save_array(tmp_dir, 'matrix.indices', matrix.indices.astype(index_dtype))
+    _save_array(tmp_dir, 'matrix.indptr', matrix.indptr.astype(index_dtype))
+
+    stop_words = vectorizer.get_stop_words()
+    manifest = {
+        'version': 1,
+        'num_rows': int(matrix.shape[0]),
+        'num_terms': int(matrix.shape[1]),
+        'vectorizer': {
+            'token_pattern': vectorizer.token_pattern,
+            'lowercase': bool(vectorizer.lowercase),
+            'stop_words': sorted(stop_words) if stop_words else None,
+            'ngram_range': list(vectorizer.ngram_range),
+            'binary': bool(vectorizer.binary),
+            'sublinear_tf': bool(vectorizer.sublinear_tf),
+            'norm': vectorizer.norm,
+        },
+    }
+    os.makedirs(out_dir, exist_ok=True)
+    for name in os.listdir(tmp_dir):
+        os.replace(os.path.join(tmp_dir, name), os.path.join(out_dir, name))
+    os.rmdir(tmp_dir)
+    if not vectorizer.use_idf and os.path.exists(os.path.join(out_dir, 'idf.npy')):
+        os.remove(os.path.join(out_dir, 'idf.npy'))
+    _write_manifest(out_dir, manifest)
+
+
+def has_cosine_models(model_dir=COSINE_MODELS_DIR):
+    return os.path.exists(os.path.join(model_dir, MANIFEST_FILE))
+
+
+# Nạp bộ vector hóa và ma trận TF-IDF dạng ánh xạ bộ nhớ
+def load_cosine_models(model_dir=COSINE_MODELS_DIR):
+    """
+    Load the exported cosine engine with memory-mapped arrays
+
+    Returns:
+        Tuple (vectorizer, tfidf_matrix): an MmapVectorizer and a scipy CSR matrix
+        whose arrays stay mapped, as taken by utils.get_recommendations_cosine
+    """
+    with open(os.path.join(model_dir, MANIFEST_FILE), encoding='utf-8') as f:
+        manifest = json.load(f)
+    settings = manifest['vectorizer']
+    vocabulary = MmapVocabulary(
+        _load_array(model_dir, 'vocabulary.data'),
+        _load_array(model_dir, 'vocabulary.offsets'),
+        _load_array(model_dir, 'vocabulary.columns'),
+    )
+    idf_path = os.path.join(model_dir, 'idf.npy')
+    idf = np.load(idf_path, mmap_mode='r') if os.path.exists(idf_path) else None
+    vectorizer = MmapVectorizer(vocabulary, idf, **settings)
+
+    # Rows past num_rows belong to an ingest that has not committed yet
+    num_rows = manifest['num_rows']
+    indptr = _load_array(model_dir, 'matrix.indptr')[:num_rows + 1]
+    nnz = int(indptr[-1])
+    tfidf_matrix = sparse.csr_matrix(
+        (_load_array(model_dir, 'matrix.data')[:nnz], _load_array(model_dir, 'matrix.indices')[:nnz], indptr),
+        shape=(num_rows, manifest['num_terms']), copy=False,
+    )
+    return vectorizer, tfidf_matrix
+
+
+# Ghi thêm dòng TF-IDF của sản phẩm mới vào ma trận cosine đã xuất
+def append_cosine_rows(documents, model_dir=COSINE_MODELS_DIR, at_row=None, commit=True):
+    """
+    Vectorize documents with the frozen vocabulary and append them to the exported matrix
+
+    Args:
+        documents: Raw text of the new products (the joined content_processed tokens)
+        model_dir: Directory written by `export_cosine_models`
+        at_row: Write from this row on, dropping anything after it (default: the end)
+        commit: Update num_rows in the manifest; False leaves the new rows unserved
+            until the caller commits them with `commit_cosine_rows`
+
+    Returns:
+        Number of rows written, committed or not
+    """
+    with open(os.path.join(model_dir, MANIFEST_FILE), encoding='utf-8') as f:
+        manifest = json.load(f)
+    start = manifest['num_rows'] if at_row is None else min(at_row, manifest['num_rows'])
+    vectorizer, _ = load_cosine_models(model_dir)
+    rows = vectorizer.transform(documents)
+    if rows.shape[0]:
+        rows = normalize(rows, norm='l2')
+
+    indptr_path = os.path.join(model_dir, 'matrix.indptr.npy')
+    indptr = np.load(indptr_path, mmap_mode='r')
+    base = int(indptr[start])
+    # indices and indptr share one dtype, or scipy would copy them at load time
+    index_dtype = indptr.dtype if base + rows.nnz < np.iinfo(indptr.dtype).max else np.int64
+    append_rows(os.path.join(model_dir, 'matrix.data.npy'), rows.data.astype(np.float32), at_row=base)
+    append_rows(os.path.join(model_dir, 'matrix.indices.npy'), rows.indices.astype(index_dtype), at_row=base)
+    append_rows(indptr_path, (base + rows.indptr[1:]).astype(index_dtype), at_row=start + 1)
+
+    num_rows = start + rows.shape[0]
+    if commit:
+        commit_cosine_rows(num_rows, model_dir)
+    return num_rows
+
+
+# Công bố các dòng cosine đã ghi (cập nhật num_rows trong manifest)
+def commit_cosine_rows(num_rows, model_dir=COSINE_MODELS_DIR):
+    """
+    Serve the first num_rows rows of the exported cosine matrix
+
+    Args:
+        num_rows: Committed row count, at most the rows written by `append_cosine_rows`
+        model_dir: Directory written by `export_cosine_models`
+    """
+    with open(os.path.join(model_dir, MANIFEST_FILE), encoding='utf-8') as f:
+        manifest = json.load(f)
+    manifest['num_rows'] = num_rows
+    _write_manifest(model_dir, manifest)
+
+
+# Hàm lưu danh mục sản phẩm theo từng cột
+def save_columnar_catalog(df, out_dir=CATALOG_DIR, categorical_columns=CATEGORICAL_COLUMNS):
+    """
+    Save the catalog DataFrame in the per-column format read by ColumnarCatalog
+
+    Args:
+        df: DataFrame containing product information
+        out_dir: Target directory
+        categorical_columns: Columns stored as categorical codes
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    columns = {}
+    for name in df.columns:
+        values = df[name]
+        if name in categorical_columns:
+            categorical = pd.Categorical(values)
+            _save_array(out_dir, f'{name}.codes', categorical.codes)
+            columns[name] = {'kind': 'category', 'categories': categorical.categories.tolist()}
+        elif pd.api.types.is_numeric_dtype(values) or pd.api.types.is_bool_dtype(values):
+            _save_array(out_dir, name, values.to_numpy())
+            columns[name] = {'kind': 'numeric'}
+        else:
+            first = next((v for v in values if isinstance(v, (list, tuple, str))), None)
+            kind = 'tokens' if isinstance(first, (list, tuple)) else 'text'
+            _save_text_column(out_dir, name, values, kind)
+            columns[name] = {'kind': kind}
+
+    # A fresh export has no deleted rows
+    tombstones_path = os.path.join(out_dir, 'tombstones.npy')
+    if os.path.exists(tombstones_path):
+        os.remove(tombstones_path)
+
+    manifest = {'version': 1, 'num_rows': len(df), 'columns': columns}
+    _write_manifest(out_dir, manifest)
+
+
+def _save_text_column(out_dir, name, values, kind):
+    nulls = np.zeros(len(values), dtype=bool)
+    encoded = []
+    for i, value in enumerate(values):
+        if kind == 'tokens' and isinstance(value, (list, tuple)):
+            value = TOKEN_SEPARATOR.join(value)
+        elif not isinstance(value, str):
+            nulls[i] = value is None or (isinstance(value, float) and np.isnan(value))
+            value = '' if nulls[i] else str(value)
+        encoded.append(value.encode('utf-8'))
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    _save_array(out_dir, f'{name}.data', np.frombuffer(b''.join(encoded), dtype=np.uint8))
+    _save_array(out_dir, f'{name}.offsets', offsets)
+    if nulls.any():
+        _save_array(out_dir, f'{name}.nulls', nulls)
+
+
+# Ghi thêm sản phẩm mới vào cuối danh mục dạng cột
+def append_columnar_catalog(df, catalog_dir=CATALOG_DIR):
+    """
+    Append products to a catalog saved by `save_columnar_catalog`
+
+    Every column file grows in place; the manifest (row count and categories)
+    is rewritten last, so readers only see the new rows once all of them are
+    written. Columns missing from df are stored as null / NaN / no category,
+    columns unknown to the catalog are ignored.
+
+    Args:
+        df: DataFrame of the new products
+        catalog_dir: Catalog directory
+
+    Returns:
+        Tuple (start, stop) of the row positions of the new products
+    """
+    with open(os.path.join(catalog_dir, MANIFEST_FILE), encoding='utf-8') as f:
+        manifest = json.load(f)
+    start = manifest['num_rows']
+    n = len(df)
+
+    def path(name):
+        return os.path.join(catalog_dir, f'{name}.npy')
+
+    for name, spec in manifest['columns'].items():
+        values = df[name] if name in df.columns else pd.Series([None] * n, dtype=object)
+        if spec['kind'] == 'category':
+            categories = spec['categories']
+            for value in pd.unique(values.dropna()):
+                if value not in categories:
+                    categories.append(value)
+            codes = pd.Categorical(values, categories=categories).codes
+            append_rows(path(f'{name}.codes'), codes.astype(np.min_scalar_type(-len(categories))), at_row=start)
+        elif spec['kind'] == 'numeric':
+            dtype = np.load(path(name), mmap_mode='r').dtype
+            values = pd.to_numeric(values, errors='coerce')
+            if values.isna().any() and dtype.kind in 'iub':
+                raise ValueError(f"Column {name} ({dtype}) cannot store missing values")
+            append_rows(path(name), values.to_numpy().astype(dtype), at_row=start)
+        else:
+            _append_text_column(catalog_dir, name, values, spec['kind'], start)
+
+    manifest['num_rows'] = start + n
+    _write_manifest(catalog_dir, manifest)
+    return start, start + n
+
+
+def _append_text_column(out_dir, name, values, kind, start):
+    offsets = np.load(os.path.join(out_dir, f'{name}.offsets.npy'), mmap_mode='r')
+    base = int(offsets[start])
+    nulls = np.zeros(len(values), dtype=bool)
+    encoded = []
+    for i, value in enumerate(values):
+        if kind == 'tokens' and isinstance(value, (list, tuple)):
+            value = TOKEN_SEPARATOR.join(value)
+        elif not isinstance(value, str):
+            nulls[i] = value is None or (isinstance(value, float) and np.isnan(value))
+            value = '' if nulls[i] else str(value)
+        encoded.append(value.encode('utf-8'))
+    new_offsets = base + np.cumsum([len(b) for b in encoded], dtype=np.int64)
+    append_rows(os.path.join(out_dir, f'{name}.data.npy'), np.frombuffer(b''.join(encoded), dtype=np.uint8), at_row=base)
+    append_rows(os.path.join(out_dir, f'{name}.offsets.npy'), new_offsets, at_row=start + 1)
+    nulls_path = os.path.join(out_dir, f'{name}.nulls.npy')
+    if os.path.exists(nulls_path):
+        append_rows(nulls_path, nulls, at_row=start)
+    elif nulls.any():
+        append_rows(nulls_path, np.concatenate([np.zeros(start, dtype=bool), nulls]))
+
+
+# Đánh dấu xóa (tombstone) sản phẩm trong danh mục dạng cột
+def save_tombstones(deleted, catalog_dir=CATALOG_DIR):
+    """Save the boolean deleted-row mask of the catalog (atomically replaced)"""
+    tmp_path = os.path.join(catalog_dir, 'tombstones.tmp.npy')
+    np.save(tmp_path, np.asarray(deleted, dtype=bool), allow_pickle=False)
+    os.replace(tmp_path, os.path.join(catalog_dir, 'tombstones.npy'))
+
+
+def has_columnar_catalog(catalog_dir=CATALOG_DIR):
+    return os.path.exists(os.path.join(catalog_dir, MANIFEST_FILE))
+
+
+# Danh mục sản phẩm dạng cột, đọc lười theo cột và theo dòng
+class ColumnarCatalog:
+    """
+    Read-only, memory-mapped view of a catalog saved by `save_columnar_catalog`
+
+    Nothing is read when the object is created; each column is mapped the first
+    time it is used and `take` decodes only the requested rows.
+
+    Args:
+        catalog_dir: Directory written by `save_columnar_catalog`
+    """
+
+    def __init__(self, catalog_dir=CATALOG_DIR):
+        self.catalog_dir = catalog_dir
+        with open(os.path.join(catalog_dir, MANIFEST_FILE), encoding='utf-8') as f:
+            manifest = json.load(f)
+        self.num_rows = manifest['num_rows']
+        self._specs = manifest['columns']
+        self._arrays = {}
+
+    def __len__(self):
+        return self.num_rows
+
+    @property
+    def columns(self):
+        return list(self._specs)
+
+    def _array(self, name):
+        if name not in self._arrays:
+            path = os.path.join(self.catalog_dir, f'{name}.npy')
+            self._arrays[name] = np.load(path, mmap_mode='r') if os.path.exists(path) else None
+        return self._arrays[name]
+
+    @property
+    def tombstones(self):
+        """Boolean mask of the deleted rows, or None when nothing was deleted"""
+        deleted = self._array('tombstones')
+        if deleted is None:
+            return None
+        mask = np.zeros(self.num_rows, dtype=bool)
+        mask[:min(len(deleted), self.num_rows)] = deleted[:self.num_rows]
+        return mask if mask.any() else None
+
+    def _decode(self, name, positions):
+        spec = self._specs[name]
+        data, offsets, nulls = self._array(f'{name}.data'), self._array(f'{name}.offsets'), self._array(f'{name}.nulls')
+        values = np.empty(len(positions), dtype=object)
+        for i, pos in enumerate(positions):
+            if nulls is not None and nulls[pos]:
+                values[i] = None
+                continue
+            text = data[offsets[pos]:offsets[pos + 1]].tobytes().decode('utf-8')
+            if spec['kind'] == 'tokens':
+                values[i] = text.split(TOKEN_SEPARATOR) if text else []
+            else:
+                values[i] = text
+        return values
+
+    def take(self, name, positions):
+        """Return the values of one column for the given row positions"""
+        positions = np.asarray(positions, dtype=np.int64)
+        spec = self._specs[name]
+        if spec['kind'] == 'numeric':
+            return np.asarray(self._array(name)[positions])
+        if spec['kind'] == 'category':
+            codes = np.asarray(self._array(f'{name}.codes')[positions])
+            return pd.Categorical.from_codes(codes, categories=spec['categories'])
+        return self._decode(name, positions)
+
+    def column(self, name):
+        """Return a whole column (numeric columns stay memory-mapped)"""
+        spec = self._specs[name]
+        # Rows past num_rows belong to an append that has not committed yet
+        if spec['kind'] == 'numeric':
+            return self._array(name)[:self.num_rows]
+        if spec['kind'] == 'category':
+            return pd.Categorical.from_codes(np.asarray(self._array(f'{name}.codes')[:self.num_rows]), categories=spec['categories'])
+        return self._decode(name, np.arange(self.num_rows))
+
+    def frame(self, columns=None):
+        """Materialize the given columns as a DataFrame (all columns if None)"""
+        columns = self.columns if columns is None else [c for c in columns if c in self._specs]
+        return pd.DataFrame({name: self.column(name) for name in columns})
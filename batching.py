@@ -0,0 +1,221 @@
+"""
+Asyncio micro-batching of concurrent recommendation requests
+
+Concurrent text searches and user recommendations each run a small
+matrix-vector product, which leaves BLAS mostly idle. `MicroBatcher` collects
+the requests that arrive within a few milliseconds (or until the batch is
+full), runs them as one matrix-matrix product in a worker thread and fans the
+results back out to the waiting coroutines.
+
+`QueryBatchScorer` and `UserBatchScorer` are the batch functions for the LSI
+and SVD scorers; `BatchedRecommender` puts them behind two batchers and turns
+the results into the same DataFrames as the utils.py recommenders. For the
+threaded HTTP server, `BackgroundLoop` runs the event loop in its own thread.
+"""
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from utils import SVDScorer, default_ranking_keys, rerank_candidates, search_gensim_batch, select_top_k_rows
+
+
+# Bộ gom lô động: gom các yêu cầu đồng thời thành một lần tính toán
+class MicroBatcher:
+    """
+    Dynamic batcher for an expensive batch function
+
+    Args:
+        batch_fn: Callable(list of items) -> list of results (same order), run in a thread
+        max_batch_size: Maximum number of items per batch
+        max_wait_ms: Longest time the first item of a batch waits for more items
+        executor: Executor running batch_fn (a single thread by default, so batches do not overlap)
+    """
+
+    def __init__(self, batch_fn, max_batch_size=32, max_wait_ms=5.0, executor=None):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.executor = executor or ThreadPoolExecutor(max_workers=1, thread_name_prefix='micro-batch')
+        self.batches = 0
+        self.items = 0
+        self._queue = None
+        self._worker = None
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def start(self):
+        """Start the batching task on the running event loop"""
+        if self._worker is None:
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def close(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    @property
+    def mean_batch_size(self):
+        return self.items / self.batches if self.batches else 0.0
+
+    async def submit(self, item):
+        """Queue one item and wait for its result"""
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future))
+        return await future
+
+    async def _collect(self):
+        """Wait for a first item, then gather more until the batch is full or max_wait_ms passed"""
+        batch = [await self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait_ms / 1000
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        # Take whatever is already queued without waiting any longer
+        while len(batch) < self.max_batch_size and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            items = [item for item, _ in batch]
+            try:
+                results = await loop.run_in_executor(self.executor, self.batch_fn, items)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.batches += 1
+            self.items += len(batch)
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+
+# Hàm chấm điểm theo lô cho truy vấn văn bản (LSI)
+class QueryBatchScorer:
+    """
+    Batch function for text queries: items are (query, k), results (positions, scores)
+
+    The whole batch goes through `search_gensim_batch`: one sparse TF-IDF
+    matrix, one LSI projection and one (batch x catalog) product (or one
+    `top_k` call per query for sharded and int8 indexes).
+    """
+
+    def __init__(self, similarity_index, tfidf, lsi_model, dictionary, catalog, stop_words=None):
+        self.similarity_index = similarity_index
+        self.tfidf = tfidf
+        self.lsi_model = lsi_model
+        self.dictionary = dictionary
+        self.catalog = catalog
+        self.stop_words = stop_words
+
+    def __call__(self, items):
+        k = max(nums for _, nums in items)
+        indices, scores = search_gensim_batch(
+            self.similarity_index, self.catalog.df, self.tfidf, self.lsi_model, self.dictionary,
+            queries=[query for query, _ in items], nums=k, stop_words=self.stop_words, catalog=self.catalog,
+        )
+        results = []
+        for row, (_, nums) in enumerate(items):
+            # Padding and tombstoned rows score -inf and are never returned
+            keep = np.isfinite(scores[row, :nums])
+            results.append((indices[row, :nums][keep], scores[row, :nums][keep]))
+        return results
+
+
+# Hàm chấm điểm theo lô cho người dùng (SVD)
+class UserBatchScorer:
+    """
+    Batch function for users: items are (user_id, k), results (positions, scores)
+
+    Scores the whole batch of users against every product as one dense
+    (users x products) matrix product. Positions are catalog rows; products
+    listed more than once are scored once (first live row).
+    """
+
+    def __init__(self, surprise, catalog):
+        self.scorer = surprise if isinstance(surprise, SVDScorer) else SVDScorer.from_algo(surprise)
+        self.catalog = catalog
+        product_ids = pd.unique(catalog.live_frame()['product_id'].to_numpy())
+        self.positions = catalog.positions(product_ids)
+        self.factors = self.scorer.catalog_factors(product_ids)
+
+    def __call__(self, items):
+        k = max(nums for _, nums in items)
+        scores = self.scorer.score_users([int(user_id) for user_id, _ in items], self.factors)
+        top, values = select_top_k_rows(scores, k)
+        return [(self.positions[top[row, :nums]], values[row, :nums]) for row, (_, nums) in enumerate(items)]
+
+
+# Bộ đề xuất dùng gom lô cho tìm kiếm văn bản và đề xuất người dùng
+class BatchedRecommender:
+    """
+    Micro-batched text search and user recommendations over a RecommendationService
+
+    Args:
+        service: service.RecommendationService with the loaded models
+        max_batch_size: Maximum requests per batch
+        max_wait_ms: Longest time a request waits for its batch to fill
+    """
+
+    def __init__(self, service, max_batch_size=32, max_wait_ms=5.0):
+        self.catalog = service.catalog
+        self.queries = MicroBatcher(
+            QueryBatchScorer(service.similarity_index, service.tfidf, service.lsi_model, service.dictionary, service.catalog),
+            max_batch_size=max_batch_size, max_wait_ms=max_wait_ms,
+        )
+        self.users = MicroBatcher(UserBatchScorer(service.svd_scorer, service.catalog), max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+
+    async def recommend_query(self, query, nums=4):
+        """Same result as get_recommendations_gensim(query=...) without cache, ANN or filters"""
+        positions, scores = await self.queries.submit((query, nums * 2))
+        keys = default_ranking_keys(self.catalog, by_query=True)
+        return rerank_candidates(self.catalog, positions, scores, keys, nums)
+
+    async def recommend_user(self, user_id, nums=4):
+        """Top predicted ratings of a user, with the columns of get_recommendations_surprise"""
+        positions, scores = await self.users.submit((user_id, nums))
+        recommendations = pd.DataFrame(
+            {'product_id': self.catalog.column('product_id')[positions], 'Score_Prediction': scores},
+            index=self.catalog.df.index[positions],
+        )
+        for column in ['product_name', 'sub_category', 'rating']:
+            recommendations[column] = self.catalog.column(column)[positions]
+        return recommendations
+
+
+# Vòng lặp sự kiện chạy nền cho máy chủ HTTP đa luồng
+class BackgroundLoop:
+    """Event loop in a daemon thread, so synchronous request threads can await coroutines"""
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name='micro-batch-loop', daemon=True)
+        self._thread.start()
+
+    def run(self, coroutine, timeout=None):
+        """Run a coroutine on the background loop and block until it finishes"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result(timeout)
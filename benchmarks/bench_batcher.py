@@ -0,0 +1,127 @@
+"""
+Throughput and tail latency of micro-batched scoring under concurrent load
+
+A local load generator runs --clients coroutines in a closed loop (each sends
+its next request as soon as the previous one is answered) for --seconds
+against a `MicroBatcher`, first unbatched (batch size 1, no wait) and then
+for every combination of --batch-sizes and --waits-ms. Two synthetic
+workloads are available:
+
+    user  SVD user recommendations (UserBatchScorer on random factors)
+    lsi   LSI similarity search (query vectors x unit document vectors, top-k)
+
+    python benchmarks/bench_batcher.py --workload user --products 50000 --clients 64
+    python benchmarks/bench_batcher.py --workload lsi --batch-sizes 8,32,64 --waits-ms 1,2,5
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from batching import MicroBatcher, UserBatchScorer  # noqa: E402
+from indexes import _unit_rows  # noqa: E402
+from utils import CatalogIndex, SVDScorer, select_top_k_rows  # noqa: E402
+
+
+def synthetic_svd(n_users, n_products, n_factors=100, seed=0):
+    """Random SVD scorer and a matching catalog"""
+    rng = np.random.default_rng(seed)
+    scorer = SVDScorer(
+        pu=rng.normal(0, 0.1, (n_users, n_factors)),
+        qi=rng.normal(0, 0.1, (n_products, n_factors)),
+        bu=rng.normal(0, 0.3, n_users),
+        bi=rng.normal(0, 0.3, n_products),
+        global_mean=4.0,
+        rating_scale=(1, 5),
+        raw_user_ids=list(range(n_users)),
+        raw_item_ids=list(range(n_products)),
+    )
+    df = pd.DataFrame({
+        'product_id': np.arange(n_products),
+        'product_name': [f"Sản phẩm {i}" for i in range(n_products)],
+        'sub_category': [f"Loại {i % 50}" for i in range(n_products)],
+        'rating': rng.uniform(1, 5, n_products).round(1),
+    })
+    return scorer, CatalogIndex(df)
+
+
+# Hàm tìm kiếm LSI theo lô trên vector truy vấn có sẵn
+class VectorBatchScorer:
+    """Batch function for the lsi workload: items are (query vector, k)"""
+
+    def __init__(self, vectors):
+        self.vectors = vectors
+
+    def __call__(self, items):
+        k = max(nums for _, nums in items)
+        scores = np.stack([query for query, _ in items]) @ self.vectors.T
+        top, values = select_top_k_rows(scores, k)
+        return [(top[row, :nums], values[row, :nums]) for row, (_, nums) in enumerate(items)]
+
+
+async def run_load(batcher, make_item, clients, seconds):
+    """Closed-loop load; returns (requests per second, latencies in ms)"""
+    latencies = []
+    stop_at = time.perf_counter() + seconds
+
+    async def client(seed):
+        rng = np.random.default_rng(seed)
+        while time.perf_counter() < stop_at:
+            start = time.perf_counter()
+            await batcher.submit(make_item(rng))
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    async with batcher:
+        start = time.perf_counter()
+        await asyncio.gather(*(client(seed) for seed in range(clients)))
+        elapsed = time.perf_counter() - start
+    return len(latencies) / elapsed, np.asarray(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workload', choices=['user', 'lsi'], default='user')
+    parser.add_argument('--products', type=int, default=50000)
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--features', type=int, default=300, help='LSI topics of the lsi workload')
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--clients', type=int, default=64, help='Concurrent closed-loop clients')
+    parser.add_argument('--seconds', type=float, default=5.0, help='Duration of each run')
+    parser.add_argument('--batch-sizes', default='8,16,32,64')
+    parser.add_argument('--waits-ms', default='1,2,5')
+    args = parser.parse_args()
+
+    if args.workload == 'user':
+        scorer, catalog = synthetic_svd(args.users, args.products)
+        batch_fn = UserBatchScorer(scorer, catalog)
+
+        def make_item(rng):
+            return int(rng.integers(args.users)), args.top
+    else:
+        rng = np.random.default_rng(0)
+        vectors = _unit_rows(rng.standard_normal((args.products, args.features)).astype(np.float32))
+        batch_fn = VectorBatchScorer(vectors)
+
+        def make_item(rng):
+            return vectors[rng.integers(args.products)], args.top
+
+    configs = [(1, 0.0)] + [
+        (int(size), float(wait)) for size in args.batch_sizes.split(',') for wait in args.waits_ms.split(',')
+    ]
+    print(f"{args.workload} workload, {args.products} products, {args.clients} clients, {args.seconds:g}s per run")
+    print(f"{'batch':>6} {'wait ms':>8} {'req/s':>10} {'p50 ms':>10} {'p99 ms':>10} {'mean batch':>11}")
+    for size, wait in configs:
+        batcher = MicroBatcher(batch_fn, max_batch_size=size, max_wait_ms=wait)
+        throughput, latencies = asyncio.run(run_load(batcher, make_item, args.clients, args.seconds))
+        print(f"{size:>6} {wait:>8.1f} {throughput:>10.0f} {np.percentile(latencies, 50):>10.2f} "
+              f"{np.percentile(latencies, 99):>10.2f} {batcher.mean_batch_size:>11.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""
+Recall@N, latency and memory of the LSI indexes against the exact index
+
+Scores the same queries with exact brute-force cosine (what
+`MatrixSimilarity` does), with `IVFIndex` at several probe counts and with
+`QuantizedIndex` (int8 with and without the exact re-rank), and prints
+recall@N, the share of queries whose top-N is identical to the exact one,
+per-query latency and the size of the stored vectors (the int8 index with
+re-rank also keeps the float32 vectors). Runs on a synthetic
+clustered catalog by default, or on the real index with --similarity-index.
+
+    python benchmarks/bench_indexes.py --products 100000 --nprobe 1,4,8,16,32
+    python benchmarks/bench_indexes.py --similarity-index models/similarity_index.pkl
+"""
+import argparse
+import os
+import pickle
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from indexes import IVFIndex, QuantizedIndex, _unit_rows  # noqa: E402
+from utils import select_top_k  # noqa: E402
+
+
+def synthetic_vectors(n_products, num_features, n_topics=200, seed=0):
+    """Clustered unit vectors, roughly shaped like LSI document vectors"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((n_topics, num_features)).astype(np.float32)
+    labels = rng.integers(0, n_topics, n_products)
+    noise = rng.standard_normal((n_products, num_features)).astype(np.float32)
+    return _unit_rows(centers[labels] + 0.8 * noise)
+
+
+def sample_queries(vectors, n_queries, seed=1):
+    """Perturbed catalog vectors, like product-selection and short text queries"""
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(vectors), n_queries, replace=False)
+    noise = rng.standard_normal((n_queries, vectors.shape[1])).astype(np.float32)
+    return _unit_rows(vectors[rows] + 0.3 * noise)
+
+
+def exact_top_k(vectors, query, k):
+    return select_top_k(vectors @ query, k)
+
+
+def measure(search, queries):
+    """Run search(query) over all queries; return results and per-query latencies in ms"""
+    results, latencies = [], []
+    for query in queries:
+        start = time.perf_counter()
+        results.append(search(query))
+        latencies.append((time.perf_counter() - start) * 1000)
+    return results, np.asarray(latencies)
+
+
+def recall_at_n(exact, approx):
+    """Mean fraction of the exact top-N found by the approximate top-N"""
+    hits = [len(np.intersect1d(e[0], a[0])) / max(1, len(e[0])) for e, a in zip(exact, approx)]
+    return float(np.mean(hits))
+
+
+def same_ranking(exact, approx):
+    """Fraction of queries whose top-N list is identical, order included"""
+    return float(np.mean([np.array_equal(e[0], a[0]) for e, a in zip(exact, approx)]))
+
+
+def report_row(name, results, latencies, exact, nbytes):
+    print(f"{name:<24} {recall_at_n(exact, results):>10.3f} {same_ranking(exact, results):>10.3f} "
+          f"{np.percentile(latencies, 50):>10.3f} {np.percentile(latencies, 95):>10.3f} {nbytes / 2**20:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--products', type=int, default=50000)
+    parser.add_argument('--features', type=int, default=300)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--top', type=int, default=10, help='N of recall@N')
+    parser.add_argument('--lists', type=int, default=None, help='IVF lists (default sqrt(products))')
+    parser.add_argument('--nprobe', default='1,2,4,8,16,32')
+    parser.add_argument('--rerank', type=int, default=200, help='Candidates re-scored exactly by the int8 index')
+    parser.add_argument('--similarity-index', default=None, help='Pickled MatrixSimilarity to use instead of synthetic data')
+    args = parser.parse_args()
+
+    if args.similarity_index:
+        with open(args.similarity_index, 'rb') as f:
+            vectors = _unit_rows(pickle.load(f).index)
+    else:
+        vectors = synthetic_vectors(args.products, args.features)
+    queries = sample_queries(vectors, min(args.queries, len(vectors)))
+
+    start = time.perf_counter()
+    ivf = IVFIndex.build(vectors, n_lists=args.lists)
+    build_seconds = time.perf_counter() - start
+    print(f"{len(vectors)} products x {vectors.shape[1]} features, {len(queries)} queries, "
+          f"IVF {ivf.n_lists} lists built in {build_seconds:.1f}s")
+    print(f"{'index':<24} {'recall@' + str(args.top):>10} {'same top':>10} {'p50 ms':>10} {'p95 ms':>10} {'MB':>10}")
+
+    exact, latencies = measure(lambda q: exact_top_k(vectors, q, args.top), queries)
+    report_row('exact float32', exact, latencies, exact, vectors.nbytes)
+    for nprobe in (int(value) for value in args.nprobe.split(',')):
+        results, latencies = measure(lambda q: ivf.top_k(q, args.top, nprobe=nprobe), queries)
+        report_row(f'ivf nprobe={nprobe}', results, latencies, exact, ivf.vectors.nbytes + ivf.centroids.nbytes)
+
+    quantized = QuantizedIndex.build(vectors, dtype='int8', rerank=args.rerank)
+    for rerank in (0, args.rerank):
+        quantized.rerank = rerank
+        results, latencies = measure(lambda q: quantized.top_k(q, args.top), queries)
+        # Without the re-rank the float32 vectors need not be kept at all
+        report_row(f'int8 rerank={rerank}', results, latencies, exact, quantized.nbytes if rerank else quantized.scored_nbytes)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,280 @@
+"""
+End-to-end latency, throughput and memory of every recommender
+
+Generates a synthetic catalog and rating set (synthetic_catalog.py), trains
+small models on it the way the notebooks do (Gensim dictionary, TF-IDF, LSI
+and MatrixSimilarity; sklearn TfidfVectorizer exported like
+build_artifacts.py export-cosine; Surprise SVD) and times, one call at a
+time after a short warm-up:
+
+    preprocess_text            text query normalization
+    gensim_product / _query    get_recommendations_gensim
+    cosine_product / _query    get_recommendations_cosine
+    surprise_user              get_recommendations_surprise
+
+For each one it reports p50/p90/p99/max latency, throughput and the peak RSS
+of the process so far; build times and peak RSS after every training stage
+are recorded too. The result is written as JSON (default
+benchmarks/results/recommenders-<commit>-<products>.json) together with the
+commit, library versions and arguments, so two runs can be compared:
+
+    python benchmarks/bench_recommenders.py --products 10000
+    python benchmarks/bench_recommenders.py --products 1000000 --users 200000 --ratings 3000000 --topics 100
+    python benchmarks/bench_recommenders.py --products 10000 --compare benchmarks/results/recommenders-ef4546b-10000.json
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from artifacts import export_cosine_models, load_cosine_models  # noqa: E402
+from synthetic_catalog import generate, make_queries  # noqa: E402
+from utils import (  # noqa: E402
+    CatalogIndex, SVDScorer, get_recommendations_cosine, get_recommendations_gensim, get_recommendations_surprise,
+    preprocess_text,
+)
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(peak / (2**20 if sys.platform == 'darwin' else 2**10), 1)
+
+
+def git_revision():
+    """Short commit hash and whether the tree has uncommitted changes (None outside git)"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=REPO_DIR, capture_output=True, text=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, dirty
+
+
+def versions():
+    import gensim
+    import pandas
+    import scipy
+    import sklearn
+    result = {'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pandas.__version__,
+              'scipy': scipy.__version__, 'gensim': gensim.__version__, 'sklearn': sklearn.__version__}
+    try:
+        import surprise
+        result['surprise'] = surprise.__version__
+    except ImportError:
+        pass
+    return result
+
+
+# Đo thời gian theo từng giai đoạn dựng mô hình
+class StageTimer:
+    """Records the duration and the peak RSS after each build stage"""
+
+    def __init__(self):
+        self.stages = {}
+
+    def __call__(self, name, fn, *args, **kwargs):
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        self.stages[name] = {'seconds': round(time.perf_counter() - start, 3), 'peak_rss_mb': peak_rss_mb()}
+        print(f"  {name:<18} {self.stages[name]['seconds']:>9.2f}s  peak RSS {self.stages[name]['peak_rss_mb']:>8.0f} MB", flush=True)
+        return result
+
+
+# Kho ngữ liệu bag-of-words đọc lại được nhiều lần (không giữ toàn bộ trong bộ nhớ)
+class BowCorpus:
+    def __init__(self, documents, dictionary):
+        self.documents = documents
+        self.dictionary = dictionary
+
+    def __iter__(self):
+        for document in self.documents:
+            yield self.dictionary.doc2bow(document)
+
+    def __len__(self):
+        return len(self.documents)
+
+
+def train_gensim(documents, num_topics, timer):
+    """Dictionary, TF-IDF, LSI and MatrixSimilarity as in ContentBased.ipynb, with a streamed corpus"""
+    from gensim import corpora, models, similarities
+    dictionary = timer('dictionary', corpora.Dictionary, documents)
+    corpus = BowCorpus(documents, dictionary)
+    tfidf = timer('tfidf', models.TfidfModel, corpus)
+    lsi_model = timer('lsi', models.LsiModel, tfidf[corpus], id2word=dictionary, num_topics=num_topics, chunksize=20000)
+    similarity_index = timer(
+        'similarity_index', similarities.MatrixSimilarity, lsi_model[tfidf[corpus]], num_features=num_topics,
+    )
+    return dictionary, tfidf, lsi_model, similarity_index
+
+
+def train_cosine(documents, out_dir, timer):
+    """TfidfVectorizer over the joined tokens, exported and mapped back like the service loads it"""
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    vectorizer = TfidfVectorizer(analyzer='word')
+    tfidf_matrix = timer('vectorizer', vectorizer.fit_transform, [' '.join(tokens) for tokens in documents])
+    timer('export_cosine', export_cosine_models, vectorizer, tfidf_matrix, out_dir=out_dir)
+    return load_cosine_models(out_dir)
+
+
+def train_surprise(ratings, n_factors, n_epochs, timer):
+    """Surprise SVD as in SurPRISE.ipynb (fewer factors and epochs)"""
+    from surprise import SVD, Dataset, Reader
+    reader = Reader(rating_scale=(ratings.rating.min(), ratings.rating.max()))
+    trainset = timer('trainset', lambda: Dataset.load_from_df(ratings[['user_id', 'product_id', 'rating']], reader).build_full_trainset())
+    algo = SVD(n_factors=n_factors, n_epochs=n_epochs, random_state=0)
+    timer('svd', algo.fit, trainset)
+    return SVDScorer.from_algo(algo)
+
+
+def measure(fn, inputs, warmup=5):
+    """Call fn on every input one at a time; latency percentiles (ms), throughput and peak RSS"""
+    for item in inputs[:warmup]:
+        fn(item)
+    latencies = np.empty(len(inputs))
+    started = time.perf_counter()
+    for i, item in enumerate(inputs):
+        start = time.perf_counter()
+        fn(item)
+        latencies[i] = (time.perf_counter() - start) * 1000
+    elapsed = time.perf_counter() - started
+    return {
+        'calls': len(inputs),
+        'p50_ms': round(float(np.percentile(latencies, 50)), 4),
+        'p90_ms': round(float(np.percentile(latencies, 90)), 4),
+        'p99_ms': round(float(np.percentile(latencies, 99)), 4),
+        'max_ms': round(float(latencies.max()), 4),
+        'mean_ms': round(float(latencies.mean()), 4),
+        'throughput_per_s': round(len(inputs) / elapsed, 1),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Print the change of p50, p99 and throughput against an earlier result file"""
+    print(f"\nAgainst {baseline['git']['commit']} ({baseline['timestamp']}), "
+          f"{baseline['dataset']['products']} products; '!' marks changes worse than {tolerance:.0%}")
+    print(f"{'recommender':<18} {'p50':>12} {'p99':>12} {'throughput':>12}")
+    for name, current in results.items():
+        previous = baseline['results'].get(name)
+        if previous is None:
+            continue
+        cells = []
+        for key, higher_is_better in (('p50_ms', False), ('p99_ms', False), ('throughput_per_s', True)):
+            change = current[key] / previous[key] - 1 if previous[key] else 0.0
+            worse = -change if higher_is_better else change
+            cells.append(f"{change:>+10.1%}{'!' if worse > tolerance else ' ':>2}")
+        print(f"{name:<18} {' '.join(cells)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--products', type=int, default=10000)
+    parser.add_argument('--users', type=int, default=None, help='Default 5 per product')
+    parser.add_argument('--ratings', type=int, default=None, help='Default 20 per product')
+    parser.add_argument('--doc-length', type=int, default=80, help='Mean tokens per product')
+    parser.add_argument('--vocabulary', type=int, default=None, help='Distinct tokens (default 12 per product, at most 500k)')
+    parser.add_argument('--topics', type=int, default=100, help='LSI topics (the notebook uses 300)')
+    parser.add_argument('--factors', type=int, default=50, help='SVD factors')
+    parser.add_argument('--epochs', type=int, default=5, help='SVD epochs')
+    parser.add_argument('--queries', type=int, default=500, help='Calls timed per recommender')
+    parser.add_argument('--nums', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--skip', default='', help='Comma-separated recommenders to leave out, e.g. surprise_user')
+    parser.add_argument('--output', default=None, help='JSON result file (default benchmarks/results/...)')
+    parser.add_argument('--compare', default=None, help='Earlier JSON result to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='Relative change flagged as a regression')
+    args = parser.parse_args()
+
+    n_users = args.users or 5 * args.products
+    n_ratings = args.ratings or 20 * args.products
+    skip = set(filter(None, args.skip.split(',')))
+    timer = StageTimer()
+
+    print(f"Generating {args.products} products, {n_users} users, {n_ratings} ratings", flush=True)
+    df, ratings = timer('generate', generate, args.products, n_users, n_ratings, doc_length=args.doc_length,
+                        vocabulary_size=args.vocabulary, seed=args.seed)
+    documents = df['content_processed'].tolist()
+    catalog = CatalogIndex(df)
+    rng = np.random.default_rng(args.seed + 3)
+    queries = make_queries(df, args.queries, seed=args.seed)
+    product_ids = df['product_id'].to_numpy()[rng.integers(0, len(df), args.queries)].tolist()
+    user_ids = ratings['user_id'].to_numpy()[rng.integers(0, len(ratings), args.queries)].tolist()
+
+    results = {}
+    print("Training", flush=True)
+    gensim = cosine = scorer = None
+    with tempfile.TemporaryDirectory() as cosine_dir:
+        if not skip >= {'gensim_product', 'gensim_query'}:
+            dictionary, tfidf, lsi_model, similarity_index = train_gensim(documents, args.topics, timer)
+            gensim = dict(similarity_index=similarity_index, df=df, tfidf=tfidf, lsi_model=lsi_model,
+                          dictionary=dictionary, catalog=catalog, nums=args.nums)
+        if not skip >= {'cosine_product', 'cosine_query'}:
+            vectorizer, tfidf_matrix = train_cosine(documents, cosine_dir, timer)
+            cosine = dict(tfidf_matrix=tfidf_matrix, df=df, vectorizer=vectorizer, catalog=catalog, nums=args.nums)
+        if 'surprise_user' not in skip:
+            scorer = train_surprise(ratings, args.factors, args.epochs, timer)
+
+        benchmarks = {
+            'preprocess_text': (lambda q: preprocess_text(q), queries),
+            'gensim_product': (lambda p: get_recommendations_gensim(product_id=p, **gensim), product_ids),
+            'gensim_query': (lambda q: get_recommendations_gensim(query=q, **gensim), queries),
+            'cosine_product': (lambda p: get_recommendations_cosine(product_id=p, **cosine), product_ids),
+            'cosine_query': (lambda q: get_recommendations_cosine(query=q, **cosine), queries),
+            'surprise_user': (lambda u: get_recommendations_surprise(
+                df[['product_id']], df, scorer, u, nums=args.nums, catalog=catalog), user_ids),
+        }
+        print(f"\n{'recommender':<18} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9} {'calls/s':>10} {'peak MB':>9}")
+        for name, (fn, inputs) in benchmarks.items():
+            if name in skip:
+                continue
+            result = results[name] = measure(fn, inputs)
+            print(f"{name:<18} {result['p50_ms']:>9.3f} {result['p90_ms']:>9.3f} {result['p99_ms']:>9.3f} "
+                  f"{result['max_ms']:>9.3f} {result['throughput_per_s']:>10.1f} {result['peak_rss_mb']:>9.0f}", flush=True)
+
+    commit, dirty = git_revision()
+    report = {
+        'benchmark': 'recommenders',
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'git': {'commit': commit, 'dirty': dirty},
+        'platform': {'system': platform.platform(), 'machine': platform.machine(), 'cpus': os.cpu_count()},
+        'versions': versions(),
+        'args': vars(args),
+        'dataset': {
+            'products': len(df),
+            'users': int(ratings['user_id'].nunique()),
+            'ratings': len(ratings),
+            'tokens': int(sum(len(tokens) for tokens in documents)),
+            'vocabulary': len(gensim['dictionary']) if gensim is not None else None,
+        },
+        'build': timer.stages,
+        'results': results,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"recommenders-{commit or 'nogit'}-{args.products}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\nPeak RSS {report['peak_rss_mb']:.0f} MB; results written to {output}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            compare(results, json.load(f), args.tolerance)
+
+
+if __name__ == '__main__':
+    main()
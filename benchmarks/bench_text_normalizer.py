@@ -0,0 +1,82 @@
+"""
+Per-query benchmark of the text search normalizer
+
+Compares the original `preprocess_text` pipeline (kept verbatim below as the
+baseline) with `TextNormalizer`, checks that both return the same tokens for
+every query and prints the time per query.
+
+    python benchmarks/bench_text_normalizer.py --queries 5000
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import TextNormalizer  # noqa: E402
+
+SYLLABLES = [
+    'áo', 'quần', 'nam', 'thun', 'cotton', 'ba', 'lỗ', 'khoác', 'jean', 'dài', 'ngắn', 'tay', 'cổ', 'tròn',
+    'màu', 'trắng', 'đen', 'xanh', 'size', 'form', 'rộng', 'ôm', 'body', 'hàng', 'chính', 'hãng', 'giá', 'rẻ',
+    'chất', 'liệu', 'thoáng', 'mát', 'co', 'giãn', 'mềm', 'mịn', 'đẹp', 'thời', 'trang', 'công', 'sở', 'và',
+    'của', 'cho', 'với', 'là', 'có', 'không', 'được', 'những',
+]
+NOISE = ['2024', '100%', 'xl', '(freeship)', '⭐', '💥', 'sale!!!', '-', '...', 'giá:99k', 'm2', '#hot']
+STOP_WORDS = ['và', 'của', 'cho', 'với', 'là', 'có', 'không', 'được', 'những'] + [f'stop{i}' for i in range(2000)]
+
+SPECIAL = ['', ' ', ',', '.', '...', '-',':', ';', '?', '%', '(', ')', '+', '/', "'", '&','⭐','💢','🏘','☎','📖','🌱','❤','📞','🎯','💥','⛔']
+
+
+def legacy_preprocess_text(text, stop_words=None):
+    """The pipeline before TextNormalizer (preprocess_text + data_preprocessing_for_gensim)"""
+    tokens = [re.sub(r'[^\w\s]', '', text.lower()).split()]
+    text_re = [[re.sub('[0-9]+','', e) for e in text] for text in tokens]
+    text_re = [[t.lower() for t in text if not t in SPECIAL] for text in  text_re]
+    if stop_words:
+        text_re = [[t for t in text if not t in stop_words] for text in text_re]
+    return text_re[0]
+
+
+def make_queries(n, seed=0):
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(n):
+        words = rng.choices(SYLLABLES, k=rng.randint(2, 12)) + rng.choices(NOISE, k=rng.randint(0, 3))
+        rng.shuffle(words)
+        queries.append(' '.join(w.upper() if rng.random() < 0.1 else w for w in words))
+    return queries
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--queries', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    queries = make_queries(args.queries)
+    normalizer = TextNormalizer(STOP_WORDS)
+
+    for query in queries:
+        assert normalizer(query) == legacy_preprocess_text(query, STOP_WORDS), query
+
+    def run_legacy():
+        for query in queries:
+            legacy_preprocess_text(query, STOP_WORDS)
+
+    def run_normalizer():
+        for query in queries:
+            normalizer(query)
+
+    legacy = min(timeit.repeat(run_legacy, number=1, repeat=args.repeat)) / len(queries)
+    current = min(timeit.repeat(run_normalizer, number=1, repeat=args.repeat)) / len(queries)
+    print(f"{len(queries)} queries, outputs identical")
+    print(f"legacy pipeline : {legacy * 1e6:8.2f} us/query")
+    print(f"TextNormalizer  : {current * 1e6:8.2f} us/query")
+    print(f"speedup         : {legacy / current:8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,239 @@
+"""
+Synthetic Vietnamese fashion catalog and rating set of any size
+
+The shipped models/*.pkl and data/*.pkl are LFS pointers, so timings cannot be
+reproduced from the repository alone. This module generates data with the
+shape of the real one (Thời Trang Nam, ~11.7k products, 145k distinct
+tokens, 1M ratings from 650k users):
+
+    - content_processed token lists as data_preprocessing_for_gensim leaves them:
+      lower-case syllables and underthesea compounds joined by "_"
+      (áo_thun, chất_liệu, ...), no digits or punctuation
+    - token frequencies following a Zipf-Mandelbrot law over the vocabulary,
+      mixed with a per-sub_category topic vocabulary so LSI finds structure
+    - prices in VND (log-normal around 150k), many products without ratings
+    - ratings skewed towards 5, with Zipf-distributed product popularity and
+      user activity; the catalog `rating` column is the mean of the generated ratings
+
+Everything is drawn from one seed, so the same arguments give the same data.
+
+    python benchmarks/synthetic_catalog.py --products 100000 --ratings 2000000 --out-dir build/synthetic
+"""
+import argparse
+import os
+import pickle
+import time
+
+import numpy as np
+import pandas as pd
+
+SUB_CATEGORIES = [
+    'Áo Ba Lỗ', 'Áo Khoác', 'Áo Vest và Blazer', 'Áo Hoodie, Áo Len & Áo Nỉ', 'Áo Sơ Mi', 'Áo Thun', 'Áo Polo',
+    'Quần Jeans', 'Quần Dài/Quần Âu', 'Quần Short', 'Đồ Bộ', 'Đồ Lót', 'Đồ Ngủ', 'Vớ/Tất', 'Trang Phục Truyền Thống',
+    'Đồ Hóa Trang', 'Trang Phục Ngành Nghề', 'Trang Sức Nam', 'Kính Mắt Nam', 'Thắt Lưng Nam', 'Cà vạt & Nơ cổ', 'Khác',
+]
+SYLLABLES = [
+    'áo', 'quần', 'nam', 'thun', 'cotton', 'ba', 'lỗ', 'khoác', 'jean', 'dài', 'ngắn', 'tay', 'cổ', 'tròn', 'màu',
+    'trắng', 'đen', 'xanh', 'đỏ', 'xám', 'be', 'nâu', 'size', 'form', 'rộng', 'ôm', 'body', 'hàng', 'chính', 'hãng',
+    'giá', 'rẻ', 'chất', 'liệu', 'thoáng', 'mát', 'co', 'giãn', 'mềm', 'mịn', 'đẹp', 'thời', 'trang', 'công', 'sở',
+    'sơ', 'mi', 'vải', 'kaki', 'nỉ', 'len', 'dù', 'gió', 'da', 'lụa', 'đũi', 'linen', 'polo', 'hoodie', 'vest',
+    'blazer', 'short', 'lót', 'ngủ', 'bộ', 'tất', 'vớ', 'kính', 'mắt', 'thắt', 'lưng', 'cà', 'vạt', 'nơ', 'khóa',
+    'túi', 'nút', 'dây', 'kéo', 'mũ', 'trùm', 'đầu', 'phong', 'cách', 'hàn', 'quốc', 'việt', 'trẻ', 'trung',
+    'năng', 'động', 'lịch', 'sự', 'thể', 'thao', 'dạo', 'phố', 'mùa', 'hè', 'đông', 'xuân', 'thu', 'ấm', 'giữ',
+    'nhiệt', 'chống', 'nắng', 'nước', 'bền', 'dày', 'mỏng', 'nhẹ', 'cao', 'cấp', 'xuất', 'khẩu', 'may', 'kỹ',
+    'đường', 'chỉ', 'in', 'hình', 'họa', 'tiết', 'sọc', 'caro', 'trơn', 'basic', 'oversize', 'slim', 'fit',
+    'unisex', 'cặp', 'đôi', 'shop', 'giao', 'nhanh', 'freeship', 'đổi', 'trả', 'bảo', 'hành', 'tư', 'vấn',
+    'bảng', 'kích', 'thước', 'cân', 'nặng', 'chiều', 'vòng', 'ngực', 'eo', 'mông', 'mặc', 'đi', 'làm', 'chơi',
+    'tiệc', 'cưới', 'học', 'sinh', 'văn', 'phòng', 'gym', 'chạy', 'bộ', 'bơi', 'thoải', 'mái', 'sang', 'trọng',
+]
+PHRASES = [
+    'áo_thun', 'áo_khoác', 'áo_sơ_mi', 'quần_jean', 'quần_short', 'chất_liệu', 'thoáng_mát', 'co_giãn', 'thời_trang',
+    'phong_cách', 'hàn_quốc', 'cao_cấp', 'xuất_khẩu', 'giá_rẻ', 'chính_hãng', 'đường_may', 'tỉ_mỉ', 'tư_vấn',
+    'bảng_size', 'cân_nặng', 'chiều_cao', 'vòng_ngực', 'trẻ_trung', 'năng_động', 'lịch_sự', 'thể_thao', 'dạo_phố',
+    'công_sở', 'mùa_hè', 'mùa_đông', 'giữ_nhiệt', 'chống_nắng', 'chống_nước', 'họa_tiết', 'oversize', 'slim_fit',
+    'thoải_mái', 'sang_trọng', 'đổi_trả', 'giao_hàng', 'quý_khách', 'vui_lòng', 'kích_thước', 'tham_khảo',
+]
+CATEGORY = 'Thời Trang Nam'
+NOISE = ['2024', '100%', 'XL', '(freeship)', '⭐', '💥', 'SALE!!!', '-', '...', 'giá:99k', 'M2', '#hot']
+
+
+# Sinh từ vựng: âm tiết đơn và từ ghép kiểu underthesea, xếp theo tần suất
+def make_vocabulary(size, seed=0):
+    """
+    Distinct tokens ordered from most to least frequent
+
+    Common syllables and phrases come first, then random two and three
+    syllable compounds (joined by "_") fill the long tail.
+    """
+    rng = np.random.default_rng(seed)
+    vocabulary = list(dict.fromkeys(SYLLABLES[:60] + PHRASES + SYLLABLES[60:]))
+    seen = set(vocabulary)
+    syllables = np.asarray(sorted(set(SYLLABLES)), dtype=object)
+    while len(vocabulary) < size:
+        n = size - len(vocabulary)
+        lengths = rng.choice([2, 3], size=n, p=[0.7, 0.3])
+        parts = syllables[rng.integers(0, len(syllables), (n, 3))]
+        for row, length in zip(parts, lengths):
+            token = '_'.join(row[:length])
+            if token not in seen:
+                seen.add(token)
+                vocabulary.append(token)
+    return vocabulary[:size]
+
+
+def zipf_probabilities(n, exponent=1.07, shift=2.7):
+    """Zipf-Mandelbrot probabilities of ranks 0..n-1"""
+    weights = 1.0 / (np.arange(n) + 1 + shift) ** exponent
+    return weights / weights.sum()
+
+
+# Sinh danh mục sản phẩm với token đã xử lý (content_processed)
+def make_catalog(n_products, vocabulary_size=None, doc_length=80, topic_words=300, topic_share=0.4, seed=0, block_size=50000):
+    """
+    Generate a processed catalog like data/processed_data.pkl
+
+    Args:
+        n_products: Number of products
+        vocabulary_size: Distinct tokens (default 12 per product, at most 500k)
+        doc_length: Mean number of tokens per product
+        topic_words: Size of each sub_category's topic vocabulary
+        topic_share: Share of a product's tokens drawn from its topic vocabulary
+        seed: Random seed
+        block_size: Products generated per step (bounds the temporary arrays)
+
+    Returns:
+        DataFrame with the columns of the notebook's df, content_processed included
+    """
+    rng = np.random.default_rng(seed)
+    if vocabulary_size is None:
+        vocabulary_size = int(min(max(12 * n_products, 5000), 500000))
+    vocabulary = np.asarray(make_vocabulary(vocabulary_size, seed), dtype=object)
+    probabilities = np.cumsum(zipf_probabilities(vocabulary_size))
+
+    n_categories = len(SUB_CATEGORIES)
+    # Topic words come from the frequent part of the vocabulary, like "áo_thun" for Áo Thun
+    topics = rng.integers(0, min(vocabulary_size, 20000), (n_categories, topic_words))
+    category_ids = np.sort(rng.choice(n_categories, n_products, p=zipf_probabilities(n_categories, 0.6, 1.0)))
+    lengths = np.maximum(3, rng.lognormal(np.log(doc_length), 0.5, n_products).astype(np.int64))
+
+    content = []
+    for start in range(0, n_products, block_size):
+        stop = min(start + block_size, n_products)
+        block_lengths = lengths[start:stop]
+        total = int(block_lengths.sum())
+        ids = np.searchsorted(probabilities, rng.random(total)).clip(max=vocabulary_size - 1)
+        from_topic = rng.random(total) < topic_share
+        owner = np.repeat(category_ids[start:stop], block_lengths)
+        ids[from_topic] = topics[owner[from_topic], rng.integers(0, topic_words, int(from_topic.sum()))]
+        tokens = vocabulary[ids]
+        offsets = np.concatenate([[0], np.cumsum(block_lengths)])
+        content.extend(tokens[offsets[i]:offsets[i + 1]].tolist() for i in range(stop - start))
+
+    sub_categories = np.asarray(SUB_CATEGORIES, dtype=object)[category_ids]
+    names = [
+        ' '.join([sub_category.split('/')[0].split(',')[0]] + [t.replace('_', ' ') for t in tokens[:rng.integers(3, 8)]])
+        for sub_category, tokens in zip(sub_categories, content)
+    ]
+    product_ids = np.arange(190, 190 + n_products)
+    return pd.DataFrame({
+        'product_id': product_ids,
+        'product_name': names,
+        'category': CATEGORY,
+        'sub_category': sub_categories,
+        'link': [f"https://shopee.vn/product/{product_id}" for product_id in product_ids],
+        'image': None,
+        'price': np.round(rng.lognormal(np.log(150000), 0.6, n_products), -2),
+        'rating': 0.0,
+        'description': [' '.join(t.replace('_', ' ') for t in tokens[:30]) for tokens in content],
+        'content_processed': content,
+    })
+
+
+# Sinh tập đánh giá (user_id, product_id, rating) lệch về 5 sao
+def make_ratings(product_ids, n_users, n_ratings, seed=0):
+    """
+    Generate a rating set like data/user_rating_df.pkl
+
+    Product popularity and user activity are Zipf distributed; a user rates a
+    product at most once. Ratings lean towards 5 like Shopee reviews, shifted
+    by a per-product quality and a per-user leniency.
+
+    Returns:
+        DataFrame (product_id, user_id, user, rating)
+    """
+    rng = np.random.default_rng(seed + 1)
+    product_ids = np.asarray(product_ids)
+    n_products = len(product_ids)
+    product_rank = rng.permutation(n_products)
+    user_rank = rng.permutation(n_users)
+    products = product_rank[np.searchsorted(np.cumsum(zipf_probabilities(n_products, 0.9, 10)), rng.random(n_ratings)).clip(max=n_products - 1)]
+    users = user_rank[np.searchsorted(np.cumsum(zipf_probabilities(n_users, 0.6, 50)), rng.random(n_ratings)).clip(max=n_users - 1)]
+    pairs = pd.DataFrame({'product': products, 'user_id': users}).drop_duplicates()
+
+    quality = rng.normal(0.0, 0.5, n_products)
+    leniency = rng.normal(0.0, 0.4, n_users)
+    scores = 4.6 + quality[pairs['product'].to_numpy()] + leniency[pairs['user_id'].to_numpy()] + rng.normal(0, 0.8, len(pairs))
+    return pd.DataFrame({
+        'product_id': product_ids[pairs['product'].to_numpy()],
+        'user_id': pairs['user_id'].to_numpy(),
+        'user': [f"user{user_id}" for user_id in pairs['user_id'].to_numpy()],
+        'rating': np.clip(np.rint(scores), 1, 5).astype(np.int64),
+    }).sort_values(['product_id', 'user_id'], ignore_index=True)
+
+
+def attach_mean_ratings(df, ratings):
+    """Set the catalog `rating` column to the mean rating of each product (0 without ratings)"""
+    means = ratings.groupby('product_id')['rating'].mean().round(1)
+    df['rating'] = df['product_id'].map(means).fillna(0.0).to_numpy()
+    return df
+
+
+# Sinh truy vấn văn bản giống người dùng gõ (từ tên sản phẩm và nhiễu)
+def make_queries(df, n, seed=0):
+    rng = np.random.default_rng(seed + 2)
+    names = df['product_name'].to_numpy()
+    queries = []
+    for row in rng.integers(0, len(names), n):
+        words = names[row].split()
+        start = int(rng.integers(0, max(1, len(words) - 2)))
+        query = words[start:start + int(rng.integers(2, 6))]
+        if rng.random() < 0.3:
+            query.append(NOISE[rng.integers(len(NOISE))])
+        queries.append(' '.join(w.upper() if rng.random() < 0.1 else w for w in query))
+    return queries
+
+
+def generate(n_products, n_users, n_ratings, doc_length=80, vocabulary_size=None, seed=0):
+    """Catalog with mean ratings and the rating set"""
+    df = make_catalog(n_products, vocabulary_size=vocabulary_size, doc_length=doc_length, seed=seed)
+    ratings = make_ratings(df['product_id'].to_numpy(), n_users, n_ratings, seed=seed)
+    return attach_mean_ratings(df, ratings), ratings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--products', type=int, default=10000)
+    parser.add_argument('--users', type=int, default=None, help='Default 5 per product')
+    parser.add_argument('--ratings', type=int, default=None, help='Default 20 per product')
+    parser.add_argument('--doc-length', type=int, default=80, help='Mean tokens per product')
+    parser.add_argument('--vocabulary', type=int, default=None, help='Distinct tokens (default 12 per product, at most 500k)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out-dir', default='build/synthetic')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    df, ratings = generate(
+        args.products, args.users or 5 * args.products, args.ratings or 20 * args.products,
+        doc_length=args.doc_length, vocabulary_size=args.vocabulary, seed=args.seed,
+    )
+    os.makedirs(args.out_dir, exist_ok=True)
+    with open(os.path.join(args.out_dir, 'processed_data.pkl'), 'wb') as f:
+        pickle.dump({'df': df, 'content_processed': df['content_processed'].tolist()}, f)
+    with open(os.path.join(args.out_dir, 'user_rating_df.pkl'), 'wb') as f:
+        pickle.dump(ratings, f)
+    print(f"{len(df)} products, {ratings['user_id'].nunique()} users, {len(ratings)} ratings "
+          f"written to {args.out_dir} in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,237 @@
+"""
+Offline build steps for the artifacts served by Streamlit.py
+
+Run after retraining the models in the notebooks, e.g.:
+
+    python build_artifacts.py neighbors --k 50
+    python build_artifacts.py export-mmap
+    python build_artifacts.py export-cosine
+    python build_artifacts.py resolve-images
+    python build_artifacts.py export-catalog --data data/processed_data_images.pkl
+    python build_artifacts.py shard-index --by category
+    python build_artifacts.py ivf-index --nprobe 8
+    python build_artifacts.py quantize-index --dtype int8 --rerank 200
+    python build_artifacts.py partition-index
+"""
+import argparse
+import os
+import pickle
+
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from artifacts import (
+    CATALOG_DIR, COSINE_MODELS_DIR, MMAP_MODELS_DIR, export_cosine_models, export_mmap_models, save_columnar_catalog,
+)
+from images import RESOLVER_CACHE_PATH, ShopeeImageResolver
+from indexes import (
+    IVF_INDEX_DIR, PARTITIONED_INDEX_DIR, QUANTIZED_INDEX_DIR, SHARDED_INDEX_DIR,
+    IVFIndex, PartitionedIndex, QuantizedIndex, ShardedIndex,
+)
+from utils import build_neighbor_table
+
+SIMILARITY_INDEX_PATH = 'models/similarity_index.pkl'
+PROCESSED_DATA_PATH = 'data/processed_data.pkl'
+RESOLVED_DATA_PATH = 'data/processed_data_images.pkl'
+NEIGHBOR_TABLE_PATH = 'models/neighbors.npz'
+VECTORIZER_PATH = 'models/vectorizer.pkl'
+TFIDF_MATRIX_PATH = 'models/tfidf_matrix.pkl'
+MODEL_PATHS = {
+    'dictionary': 'models/dictionary.pkl',
+    'tfidf': 'models/tfidf_model.pkl',
+    'lsi_model': 'models/lsi_model.pkl',
+    'similarity_index': 'models/similarity_index.pkl',
+    'surprise': 'models/surprise_svd_model.pkl',
+}
+
+
+def load_pickle(path):
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+# Bảng láng giềng LSI cho "Product Selection"
+def build_neighbors(args):
+    similarity_index = load_pickle(args.similarity_index)
+    df = load_pickle(args.data)['df']
+    table = build_neighbor_table(
+        similarity_index,
+        product_ids=df['product_id'].to_numpy(),
+        k=args.k,
+        chunk_size=args.chunk_size,
+        source_path=args.similarity_index,
+    )
+    table.save(args.output)
+    print(f"Saved {len(table)} x {table.k} neighbors to {args.output}")
+
+
+# Xuất mô hình sang định dạng .npy ánh xạ bộ nhớ
+def export_mmap(args):
+    models = {name: load_pickle(path) for name, path in MODEL_PATHS.items()}
+    export_mmap_models(out_dir=args.output, **models)
+    print(f"Exported memory-mapped models to {args.output}")
+
+
+# Xuất mô hình cosine (TfidfVectorizer + ma trận TF-IDF) sang .npy ánh xạ bộ nhớ
+def export_cosine(args):
+    vectorizer = load_pickle(args.vectorizer) if os.path.exists(args.vectorizer) else None
+    if vectorizer is not None and os.path.exists(args.matrix):
+        tfidf_matrix = load_pickle(args.matrix)
+    else:
+        # Vectorize the catalog rows: the joined content_processed tokens, like the queries
+        df = load_pickle(args.data)['df']
+        documents = [' '.join(tokens) for tokens in df['content_processed']]
+        if vectorizer is None:
+            vectorizer = TfidfVectorizer(analyzer='word')
+            tfidf_matrix = vectorizer.fit_transform(documents)
+        else:
+            tfidf_matrix = vectorizer.transform(documents)
+    export_cosine_models(vectorizer, tfidf_matrix, out_dir=args.output)
+    print(f"Exported {tfidf_matrix.shape[0]} x {tfidf_matrix.shape[1]} TF-IDF matrix "
+          f"({tfidf_matrix.nnz} nonzeros) to {args.output}")
+
+
+# Lưu danh mục sản phẩm theo định dạng cột
+def export_catalog(args):
+    df = load_pickle(args.data)['df']
+    save_columnar_catalog(df, out_dir=args.output)
+    print(f"Saved {len(df)} products ({len(df.columns)} columns) to {args.output}")
+
+
+# Chia chỉ mục tương đồng thành các mảnh (hoặc dựng lại một mảnh)
+def shard_index(args):
+    similarity_index = load_pickle(args.similarity_index)
+    vectors = similarity_index.index
+    if args.rebuild_shard is not None:
+        index = ShardedIndex.load(args.output, mmap_mode=None)
+        shard = index.shards[args.rebuild_shard]
+        index.replace_shard(args.rebuild_shard, vectors[shard.positions])
+        index.save(args.output, shard_ids=[args.rebuild_shard])
+        print(f"Rebuilt shard {args.rebuild_shard} ({len(shard)} products) in {args.output}")
+        return
+    groups = load_pickle(args.data)['df'][args.by].to_numpy() if args.by else None
+    index = ShardedIndex.build(vectors, shard_size=args.shard_size, groups=groups)
+    index.save(args.output)
+    print(f"Saved {len(index)} products in {len(index.shards)} shards to {args.output}")
+
+
+# Dựng chỉ mục xấp xỉ IVF cho tìm kiếm nhanh
+def ivf_index(args):
+    similarity_index = load_pickle(args.similarity_index)
+    index = IVFIndex.build(similarity_index.index, n_lists=args.lists, nprobe=args.nprobe)
+    index.save(args.output)
+    print(f"Saved IVF index ({index.n_lists} lists, nprobe={index.nprobe}) to {args.output}")
+
+
+# Lưu chỉ mục tương đồng dạng float32/int8
+def quantize_index(args):
+    similarity_index = load_pickle(args.similarity_index)
+    index = QuantizedIndex.build(similarity_index.index, dtype=args.dtype, rerank=args.rerank)
+    index.save(args.output)
+    before = similarity_index.index.nbytes
+    print(f"Saved {args.dtype} index to {args.output}: {index.scored_nbytes / 2**20:.1f} MB scored per query "
+          f"+ {index.rerank_nbytes / 2**20:.1f} MB float32 re-rank vectors (was {before / 2**20:.1f} MB)")
+
+
+# Phân vùng chỉ mục theo sub_category cho tìm kiếm có bộ lọc
+def partition_index(args):
+    similarity_index = load_pickle(args.similarity_index)
+    df = load_pickle(args.data)['df']
+    index = PartitionedIndex.build(
+        similarity_index.index,
+        df['sub_category'].to_numpy(),
+        prices=df['price'].to_numpy() if 'price' in df.columns else None,
+        ratings=df['rating'].to_numpy() if 'rating' in df.columns else None,
+    )
+    index.save(args.output)
+    print(f"Saved {len(index)} products in {len(index.partitions)} sub_category partitions to {args.output}")
+
+
+# Phân giải URL ảnh cho toàn bộ danh mục (offline)
+def resolve_images(args):
+    with open(args.data, 'rb') as f:
+        data = pickle.load(f)
+    resolver = ShopeeImageResolver(cache_path=args.cache, max_per_host=args.max_per_host)
+    before = data['df']['image'].notna().sum() if 'image' in data['df'].columns else 0
+    data['df'] = resolver.resolve_catalog(data['df'], only_missing=not args.refresh, max_workers=args.workers)
+    # The tracked processed_data.pkl is left alone; the result is swapped in whole so a crash leaves no partial file
+    tmp_path = args.output + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(data, f)
+    os.replace(tmp_path, args.output)
+    after = data['df']['image'].notna().sum()
+    print(f"Image URLs: {before} -> {after} of {len(data['df'])} products saved to {args.output} "
+          f"(publish with: export-catalog --data {args.output})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    neighbors = subparsers.add_parser('neighbors', help='Precompute the top-K LSI neighbors of every product')
+    neighbors.add_argument('--similarity-index', default=SIMILARITY_INDEX_PATH)
+    neighbors.add_argument('--data', default=PROCESSED_DATA_PATH)
+    neighbors.add_argument('--output', default=NEIGHBOR_TABLE_PATH)
+    neighbors.add_argument('--k', type=int, default=50)
+    neighbors.add_argument('--chunk-size', type=int, default=1024)
+    neighbors.set_defaults(func=build_neighbors)
+
+    mmap = subparsers.add_parser('export-mmap', help='Export the pickled models as memory-mapped .npy arrays')
+    mmap.add_argument('--output', default=MMAP_MODELS_DIR)
+    mmap.set_defaults(func=export_mmap)
+
+    cosine = subparsers.add_parser('export-cosine', help='Export the TF-IDF cosine engine as memory-mapped .npy arrays')
+    cosine.add_argument('--vectorizer', default=VECTORIZER_PATH, help='Fitted TfidfVectorizer (fitted on --data if missing)')
+    cosine.add_argument('--matrix', default=TFIDF_MATRIX_PATH, help='Its TF-IDF matrix (--data is vectorized if missing)')
+    cosine.add_argument('--data', default=PROCESSED_DATA_PATH)
+    cosine.add_argument('--output', default=COSINE_MODELS_DIR)
+    cosine.set_defaults(func=export_cosine)
+
+    images = subparsers.add_parser('resolve-images', help='Fill missing image URLs by resolving the product pages')
+    images.add_argument('--data', default=PROCESSED_DATA_PATH)
+    images.add_argument('--output', default=RESOLVED_DATA_PATH, help='Where to save the catalog with the resolved image URLs')
+    images.add_argument('--cache', default=RESOLVER_CACHE_PATH)
+    images.add_argument('--workers', type=int, default=16)
+    images.add_argument('--max-per-host', type=int, default=4)
+    images.add_argument('--refresh', action='store_true', help='Resolve every product, not only missing images')
+    images.set_defaults(func=resolve_images)
+
+    catalog = subparsers.add_parser('export-catalog', help='Save processed_data.pkl as a columnar catalog')
+    catalog.add_argument('--data', default=PROCESSED_DATA_PATH)
+    catalog.add_argument('--output', default=CATALOG_DIR)
+    catalog.set_defaults(func=export_catalog)
+
+    shards = subparsers.add_parser('shard-index', help='Split the similarity index into float32 shards')
+    shards.add_argument('--similarity-index', default=SIMILARITY_INDEX_PATH)
+    shards.add_argument('--data', default=PROCESSED_DATA_PATH)
+    shards.add_argument('--output', default=SHARDED_INDEX_DIR)
+    shards.add_argument('--shard-size', type=int, default=65536)
+    shards.add_argument('--by', default=None, help='Catalog column to group shards by, e.g. category')
+    shards.add_argument('--rebuild-shard', type=int, default=None, help='Only rebuild this shard of an existing index')
+    shards.set_defaults(func=shard_index)
+
+    ivf = subparsers.add_parser('ivf-index', help='Cluster the LSI vectors into an approximate IVF index')
+    ivf.add_argument('--similarity-index', default=SIMILARITY_INDEX_PATH)
+    ivf.add_argument('--output', default=IVF_INDEX_DIR)
+    ivf.add_argument('--lists', type=int, default=None, help='Number of lists (default sqrt(products))')
+    ivf.add_argument('--nprobe', type=int, default=8)
+    ivf.set_defaults(func=ivf_index)
+
+    quantized = subparsers.add_parser('quantize-index', help='Store the LSI vectors as float32 or int8 with per-vector scales')
+    quantized.add_argument('--similarity-index', default=SIMILARITY_INDEX_PATH)
+    quantized.add_argument('--output', default=QUANTIZED_INDEX_DIR)
+    quantized.add_argument('--dtype', choices=['int8', 'float32'], default='int8')
+    quantized.add_argument('--rerank', type=int, default=200, help='Candidates re-scored exactly (0 to disable)')
+    quantized.set_defaults(func=quantize_index)
+
+    partitioned = subparsers.add_parser('partition-index', help='Group the LSI vectors by sub_category for filtered search')
+    partitioned.add_argument('--similarity-index', default=SIMILARITY_INDEX_PATH)
+    partitioned.add_argument('--data', default=PROCESSED_DATA_PATH)
+    partitioned.add_argument('--output', default=PARTITIONED_INDEX_DIR)
+    partitioned.set_defaults(func=partition_index)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,394 @@
+"""
+Product image fetching for the results grid
+
+All card images are downloaded in parallel through one pooled HTTP session with
+connect/read timeouts. Downloaded images are resized to thumbnails once and kept
+in a size-bounded LRU cache (in memory and on disk) keyed by URL, so reruns of
+the Streamlit script do not hit the image host again.
+
+Product pages without an `image` URL are resolved offline by
+ShopeeImageResolver, which scrapes the page once and remembers the result in a
+persistent cache; requests served to users only read that cache.
+"""
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from urllib.parse import urlsplit
+
+import pandas as pd
+import requests
+from bs4 import BeautifulSoup
+from PIL import Image
+from requests.adapters import HTTPAdapter
+
+IMAGE_CACHE_DIR = os.path.join(tempfile.gettempdir(), 'product_image_cache')
+RESOLVER_CACHE_PATH = 'data/image_urls.sqlite'
+THUMBNAIL_SIZE = (400, 400)
+DEFAULT_TIMEOUT = (3.05, 10)  # (connect, read) seconds
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+
+
+def make_session(pool_size=16):
+    """Create a requests session with a connection pool shared by all worker threads"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers['User-Agent'] = USER_AGENT
+    return session
+
+
+# Bộ nhớ đệm LRU cho ảnh thu nhỏ (RAM + đĩa)
+class ImageCache:
+    """
+    Size-bounded LRU cache of encoded thumbnails, keyed by URL
+
+    Args:
+        cache_dir: Directory of the on-disk tier (None keeps the cache in memory only)
+        max_memory_bytes: Budget of the in-memory tier
+        max_disk_bytes: Budget of the on-disk tier
+    """
+
+    def __init__(self, cache_dir=IMAGE_CACHE_DIR, max_memory_bytes=64 * 2**20, max_disk_bytes=512 * 2**20):
+        self.cache_dir = cache_dir
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self._disk_bytes = 0
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            self._disk_bytes = sum(entry.stat().st_size for entry in os.scandir(cache_dir) if entry.is_file())
+
+    def _path(self, url):
+        return os.path.join(self.cache_dir, hashlib.sha1(url.encode('utf-8')).hexdigest())
+
+    def get(self, url):
+        with self._lock:
+            if url in self._memory:
+                self._memory.move_to_end(url)
+                return self._memory[url]
+        if not self.cache_dir:
+            return None
+        path = self._path(url)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)  # mark as recently used for the disk LRU
+        except OSError:
+            return None
+        self._put_memory(url, data)
+        return data
+
+    def put(self, url, data):
+        self._put_memory(url, data)
+        if self.cache_dir:
+            self._put_disk(url, data)
+
+    def discard(self, url):
+        """Drop the entry of a URL from both tiers (e.g. a corrupt file)"""
+        with self._lock:
+            if url in self._memory:
+                self._memory_bytes -= len(self._memory.pop(url))
+        if not self.cache_dir:
+            return
+        path = self._path(url)
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            return
+        with self._lock:
+            self._disk_bytes -= size
+
+    def _put_memory(self, url, data):
+        with self._lock:
+            if url in self._memory:
+                self._memory_bytes -= len(self._memory.pop(url))
+            self._memory[url] = data
+            self._memory_bytes += len(data)
+            while self._memory_bytes > self.max_memory_bytes and len(self._memory) > 1:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_bytes -= len(evicted)
+
+    def _put_disk(self, url, data):
+        path = self._path(url)
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            # Rewriting a URL replaces its old file, whose size leaves the total
+            try:
+                replaced = os.path.getsize(path)
+            except OSError:
+                replaced = 0
+            os.replace(tmp_path, path)
+        except OSError:
+            return
+        with self._lock:
+            self._disk_bytes += len(data) - replaced
+            if self._disk_bytes > self.max_disk_bytes:
+                self._evict_disk()
+
+    def _evict_disk(self):
+        entries = sorted((entry.stat().st_mtime, entry.path, entry.stat().st_size)
+                         for entry in os.scandir(self.cache_dir) if entry.is_file())
+        self._disk_bytes = sum(size for _, _, size in entries)
+        # Drop the least recently used files until we are back under 90% of the budget
+        for _, path, size in entries:
+            if self._disk_bytes <= self.max_disk_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+                self._disk_bytes -= size
+            except OSError:
+                pass
+
+
+# Tải ảnh song song với timeout và bộ nhớ đệm
+class ImageFetcher:
+    """
+    Concurrent image downloader with a pooled session and a thumbnail cache
+
+    Args:
+        cache: ImageCache instance (a default one is created if None)
+        max_workers: Number of parallel downloads
+        timeout: (connect, read) timeout in seconds for each request
+        thumbnail_size: Maximum (width, height) of the cached thumbnails
+        failure_ttl: Seconds during which a failed URL is not requested again
+    """
+
+    def __init__(self, cache=None, max_workers=8, timeout=DEFAULT_TIMEOUT, thumbnail_size=THUMBNAIL_SIZE, failure_ttl=300):
+        self.cache = cache if cache is not None else ImageCache()
+        self.timeout = timeout
+        self.thumbnail_size = thumbnail_size
+        self.failure_ttl = failure_ttl
+        self._failures = {}
+        self._failures_lock = threading.Lock()
+        self.session = make_session(pool_size=max_workers)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='image-fetch')
+
+    def _download_thumbnail(self, url):
+        response = self.session.get(url, timeout=self.timeout)
+        if response.status_code != 200:
+            return None
+        img = Image.open(BytesIO(response.content))
+        img.thumbnail(self.thumbnail_size)
+        if img.mode == 'P' and 'transparency' in img.info:
+            img = img.convert('RGBA')
+        buffer = BytesIO()
+        if img.mode in ('RGBA', 'LA'):
+            img.save(buffer, format='PNG')
+        else:
+            # CMYK, P, I;16 etc. cannot all be written as JPEG (CMYK not as PNG either)
+            if img.mode not in ('RGB', 'L'):
+                img = img.convert('RGB')
+            img.save(buffer, format='JPEG', quality=85)
+        return buffer.getvalue()
+
+    @staticmethod
+    def _decode(data):
+        """Decode an encoded thumbnail, None if it is not a readable image"""
+        try:
+            img = Image.open(BytesIO(data))
+            img.load()
+        except Exception:
+            return None
+        return img
+
+    def fetch(self, url):
+        """Return the thumbnail of one image URL as a PIL image, or None on failure"""
+        if not isinstance(url, str) or not url.strip():
+            return None
+        data = self.cache.get(url)
+        if data is not None:
+            img = self._decode(data)
+            if img is not None:
+                return img
+            # A corrupt cache entry counts as a miss: drop it and download again
+            self.cache.discard(url)
+
+        with self._failures_lock:
+            failed_at = self._failures.get(url, -self.failure_ttl)
+        if time.monotonic() - failed_at < self.failure_ttl:
+            return None
+        try:
+            data = self._download_thumbnail(url)
+        except Exception:
+            data = None
+        img = self._decode(data) if data is not None else None
+        if img is None:
+            with self._failures_lock:
+                self._failures[url] = time.monotonic()
+            return None
+        self.cache.put(url, data)
+        return img
+
+    def fetch_many(self, urls):
+        """Fetch several image URLs in parallel; results are aligned with urls"""
+        return list(self._executor.map(self.fetch, urls))
+
+
+# Trích xuất URL ảnh từ HTML trang sản phẩm Shopee
+def extract_image_url_from_html(html):
+    """Return the product image URL of a Shopee product page, or None"""
+    soup = BeautifulSoup(html, 'html.parser')
+
+    # Find the picture element with class UkIsx8
+    picture = soup.find('picture', {'class': 'UkIsx8'})
+    if picture:
+        # Find the img tag within the picture
+        img_tag = picture.find('img')
+        if img_tag and 'src' in img_tag.attrs:
+            # Remove any resize parameters to get the full resolution image URL
+            image_url = img_tag['src']
+            return image_url.split('@')[0] if '@' in image_url else image_url
+
+    # Fallback: Look for meta tags with image information
+    meta_img = soup.find('meta', {'property': 'og:image'})
+    if meta_img and 'content' in meta_img.attrs:
+        return meta_img['content']
+    return None
+
+
+# Dịch vụ phân giải link sản phẩm -> URL ảnh, có cache và giới hạn tốc độ
+class ShopeeImageResolver:
+    """
+    Resolve product page links to image URLs with a persistent cache
+
+    Successful lookups are cached for `ttl` seconds and answers without an
+    image (no image on the page, HTTP error status) for `negative_ttl` seconds,
+    in a SQLite file so the cache survives restarts. Transport errors
+    (timeouts, refused or reset connections) are not cached, so the next
+    lookup tries again. Page fetches share one pooled session and at most
+    `max_per_host` requests run against the same host at a time.
+
+    Args:
+        cache_path: SQLite file of the cache (':memory:' for a throwaway cache)
+        ttl: Lifetime of a resolved image URL in seconds
+        negative_ttl: Lifetime of a failed lookup in seconds
+        timeout: (connect, read) timeout of each page request
+        max_per_host: Concurrent requests allowed per host
+        session: requests session to use (a pooled one is created if None)
+        clock: Time function, replaceable in tests
+    """
+
+    def __init__(self, cache_path=RESOLVER_CACHE_PATH, ttl=30 * 86400, negative_ttl=86400,
+                 timeout=DEFAULT_TIMEOUT, max_per_host=4, session=None, clock=time.time):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.timeout = timeout
+        self.max_per_host = max_per_host
+        self.session = session if session is not None else make_session()
+        self.clock = clock
+        self._host_limits = {}
+        self._lock = threading.Lock()
+        if cache_path != ':memory:' and os.path.dirname(cache_path):
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        self._db = sqlite3.connect(cache_path, check_same_thread=False)
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS image_urls (link TEXT PRIMARY KEY, image_url TEXT, fetched_at REAL NOT NULL)'
+        )
+        self._db.commit()
+
+    def _host_limit(self, link):
+        host = urlsplit(link).netloc
+        with self._lock:
+            if host not in self._host_limits:
+                self._host_limits[host] = threading.BoundedSemaphore(self.max_per_host)
+            return self._host_limits[host]
+
+    def cached(self, link):
+        """
+        Look a link up in the cache only (never fetches)
+
+        Returns:
+            Tuple (hit, image_url); image_url is None for cached failures
+        """
+        with self._lock:
+            row = self._db.execute('SELECT image_url, fetched_at FROM image_urls WHERE link = ?', (link,)).fetchone()
+        if row is None:
+            return False, None
+        image_url, fetched_at = row
+        ttl = self.ttl if image_url else self.negative_ttl
+        if self.clock() - fetched_at > ttl:
+            return False, None
+        return True, image_url
+
+    def lookup(self, link):
+        """Return the cached image URL of a link, or None; safe to call while serving users"""
+        if not isinstance(link, str) or not link:
+            return None
+        return self.cached(link)[1]
+
+    def _store(self, link, image_url):
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO image_urls (link, image_url, fetched_at) VALUES (?, ?, ?)',
+                (link, image_url, self.clock()),
+            )
+            self._db.commit()
+
+    def _fetch(self, link):
+        """Scrape the image URL of a page; requests.RequestException on transport errors"""
+        with self._host_limit(link):
+            response = self.session.get(link, timeout=self.timeout)
+        if response.status_code != 200:
+            return None
+        return extract_image_url_from_html(response.text)
+
+    def resolve(self, link, refresh=False):
+        """Return the image URL of a link, scraping the page if it is not cached"""
+        if not isinstance(link, str) or not link:
+            return None
+        if not refresh:
+            hit, image_url = self.cached(link)
+            if hit:
+                return image_url
+        try:
+            image_url = self._fetch(link)
+        except requests.RequestException:
+            # Nothing was learned about the page: no negative entry
+            return None
+        self._store(link, image_url)
+        return image_url
+
+    def resolve_many(self, links, max_workers=16, refresh=False):
+        """Resolve several links concurrently; returns {link: image_url or None}"""
+        unique_links = list(dict.fromkeys(link for link in links if isinstance(link, str) and link))
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='image-resolve') as executor:
+            image_urls = executor.map(lambda link: self.resolve(link, refresh=refresh), unique_links)
+            return dict(zip(unique_links, image_urls))
+
+    def resolve_catalog(self, df, link_column='link', image_column='image', only_missing=True, max_workers=16):
+        """
+        Fill the image column of a catalog offline (bulk mode)
+
+        Args:
+            df: DataFrame containing product information
+            link_column: Column with the product page links
+            image_column: Column to fill with image URLs
+            only_missing: Only resolve rows whose image is empty
+            max_workers: Concurrent page fetches (still capped per host)
+
+        Returns:
+            Copy of df with the image column filled where a URL was found
+        """
+        result = df.copy()
+        if image_column not in result.columns:
+            result[image_column] = None
+        if only_missing:
+            missing = ~result[image_column].apply(lambda x: isinstance(x, str) and bool(x.strip()))
+        else:
+            missing = pd.Series(True, index=result.index)
+        resolved = self.resolve_many(result.loc[missing, link_column], max_workers=max_workers)
+        filled = result.loc[missing, link_column].map(resolved)
+        result.loc[missing, image_column] = filled.where(filled.notna(), result.loc[missing, image_column])
+        return result
@@ -0,0 +1,757 @@
+"""
+Similarity indexes that scale past a single dense MatrixSimilarity
+
+`ShardedIndex` splits the L2-normalized LSI vectors of the catalog into
+fixed-size float32 shards (optionally one group of shards per `category`).
+A query is scored against every shard concurrently on a thread pool - NumPy
+releases the GIL inside the matrix-vector products - and the per-shard top-k
+lists are merged into the global top-k. Every shard is saved as its own `.npy`
+file, so adding or retraining the products of one shard only rewrites that
+shard.
+
+`IVFIndex` is an approximate alternative: products are clustered with
+k-means and a query only scores the few closest clusters. `QuantizedIndex`
+stores the vectors as float32 or int8 codes with a per-vector scale to cut
+memory, with an optional exact re-rank of the best candidates.
+`PartitionedIndex` groups the vectors by `sub_category` so searches filtered
+by sub_category, price or rating only score the matching rows.
+
+All indexes keep the `similarity_index[lsi_vector]` call interface of
+Gensim's MatrixSimilarity and add `top_k`, which `get_recommendations_gensim`
+uses when available.
+"""
+import heapq
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+import numpy as np
+import pandas as pd
+
+from utils import select_top_k
+
+SHARDED_INDEX_DIR = 'models/shards'
+MANIFEST_FILE = 'manifest.json'
+
+
+def _unit_rows(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.sqrt(np.einsum('ij,ij->i', vectors, vectors))
+    return vectors / np.where(norms > 0, norms, 1)[:, None]
+
+
+def unit_query_vector(lsi_vector, num_features, dtype=np.float32):
+    """
+    Convert a Gensim LSI vector into a unit-length dense query
+
+    Args:
+        lsi_vector: Sparse [(topic, value), ...] list or dense array
+        num_features: Number of LSI topics
+        dtype: dtype of the returned vector (that of the matrix it is scored against)
+
+    Returns:
+        1-D array of length num_features (all zeros for an empty query)
+    """
+    if isinstance(lsi_vector, np.ndarray):
+        query = np.asarray(lsi_vector, dtype=dtype).ravel()
+    else:
+        query = np.zeros(num_features, dtype=dtype)
+        for topic, value in lsi_vector:
+            query[topic] = value
+    norm = np.sqrt(np.dot(query, query))
+    return query / norm if norm > 0 else query
+
+
+# Một mảnh của chỉ mục: vector LSI và vị trí dòng tương ứng trong danh mục
+class IndexShard:
+    """
+    One shard of a ShardedIndex
+
+    Args:
+        vectors: float32 array (n_rows x num_features) of unit-length LSI vectors
+        positions: int64 array of the catalog row position of every vector
+        group: Category the shard belongs to (None when not sharded by category)
+    """
+
+    def __init__(self, vectors, positions, group=None):
+        self.vectors = vectors
+        self.positions = np.asarray(positions, dtype=np.int64)
+        self.group = group
+
+    def __len__(self):
+        return len(self.positions)
+
+    def top_k(self, query, k, exclude=None):
+        """Return the k best (scores, global positions) of this shard, best first"""
+        sims = self.vectors @ query
+        local_exclude = None
+        if exclude is not None:
+            local_exclude = np.isin(self.positions, exclude)
+        top, values = select_top_k(sims, k, exclude=local_exclude)
+        return values, self.positions[top]
+
+
+# Chỉ mục tương đồng chia mảnh, chấm điểm song song
+class ShardedIndex:
+    """
+    LSI similarity index split into float32 shards scored in parallel
+
+    Args:
+        shards: List of IndexShard covering every catalog row exactly once
+        max_workers: Threads used to score the shards (defaults to one per shard, at most 8)
+    """
+
+    def __init__(self, shards, max_workers=None):
+        self.shards = list(shards)
+        self.num_features = self.shards[0].vectors.shape[1] if self.shards else 0
+        self.num_rows = sum(len(shard) for shard in self.shards)
+        self.max_workers = max_workers or min(8, max(1, len(self.shards)))
+        self._executor = None
+
+    def __len__(self):
+        return self.num_rows
+
+    @classmethod
+    def build(cls, vectors, shard_size=65536, groups=None, max_workers=None):
+        """
+        Split a (n_products x num_features) matrix of LSI vectors into shards
+
+        Args:
+            vectors: LSI vectors in catalog row order (e.g. `similarity_index.index`)
+            shard_size: Maximum number of products per shard
+            groups: Optional label per row (e.g. `df['category']`); each group gets its own shards
+            max_workers: Threads used to score the shards
+
+        Returns:
+            ShardedIndex
+        """
+        vectors = np.asarray(vectors)
+        if groups is None:
+            group_rows = [(None, np.arange(len(vectors)))]
+        else:
+            groups = np.asarray(groups, dtype=object)
+            labels = sorted(set(groups.tolist()), key=str)
+            group_rows = [(label, np.flatnonzero(groups == label)) for label in labels]
+
+        shards = []
+        for label, rows in group_rows:
+            for start in range(0, len(rows), shard_size):
+                positions = rows[start:start + shard_size]
+                shards.append(IndexShard(_unit_rows(vectors[positions]), positions, group=label))
+        return cls(shards, max_workers=max_workers)
+
+    def _map(self, func):
+        if len(self.shards) == 1 or self.max_workers == 1:
+            return [func(shard) for shard in self.shards]
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='index-shard')
+        return list(self._executor.map(func, self.shards))
+
+    @property
+    def index(self):
+        """Full (n_products x num_features) matrix in catalog row order (materialized on access)"""
+        full = np.zeros((self.num_rows, self.num_features), dtype=np.float32)
+        for shard in self.shards:
+            full[shard.positions] = shard.vectors
+        return full
+
+    def query_vector(self, lsi_vector):
+        """Convert a Gensim sparse or dense LSI vector into a unit-length float32 vector"""
+        return unit_query_vector(lsi_vector, self.num_features)
+
+    def __getitem__(self, lsi_vector):
+        """Similarity of the query to every product, in catalog row order"""
+        query = self.query_vector(lsi_vector)
+        sims = np.zeros(self.num_rows, dtype=np.float32)
+        for shard, shard_sims in zip(self.shards, self._map(lambda shard: shard.vectors @ query)):
+            sims[shard.positions] = shard_sims
+        return sims
+
+    def top_k(self, lsi_vector, k, exclude=None):
+        """
+        Global top-k of a query, merged from the per-shard top-k lists
+
+        Ties are broken by catalog row position, so the result is the same as
+        `select_top_k(similarity_index[lsi_vector], k, exclude)`.
+
+        Args:
+            lsi_vector: Gensim LSI vector of the query
+            k: Number of products to return
+            exclude: Catalog row position(s) to leave out
+
+        Returns:
+            Tuple (positions, scores) sorted best first
+        """
+        query = self.query_vector(lsi_vector)
+        if exclude is not None:
+            exclude = np.atleast_1d(np.asarray(exclude, dtype=np.int64))
+        partials = self._map(lambda shard: shard.top_k(query, k, exclude=exclude))
+        # Each shard list is already ordered by (-score, position): a k-way heap merge is enough
+        streams = [zip((-values).tolist(), positions.tolist()) for values, positions in partials]
+        merged = list(islice(heapq.merge(*streams), k))
+        positions = np.fromiter((position for _, position in merged), dtype=np.int64, count=len(merged))
+        scores = np.fromiter((-score for score, _ in merged), dtype=np.float32, count=len(merged))
+        return positions, scores
+
+    def replace_shard(self, shard_id, vectors, positions=None):
+        """Swap in new vectors for one shard, e.g. after retraining its products"""
+        shard = self.shards[shard_id]
+        positions = shard.positions if positions is None else positions
+        self.shards[shard_id] = IndexShard(_unit_rows(vectors), positions, group=shard.group)
+        self.num_rows = sum(len(s) for s in self.shards)
+
+    def add_shard(self, vectors, positions, group=None):
+        """Add the vectors of newly appended catalog rows as a new shard; returns its id"""
+        self.shards.append(IndexShard(_unit_rows(vectors), positions, group=group))
+        self.num_features = self.shards[0].vectors.shape[1]
+        self.num_rows = sum(len(s) for s in self.shards)
+        return len(self.shards) - 1
+
+    def save(self, out_dir=SHARDED_INDEX_DIR, shard_ids=None):
+        """
+        Save the shards and the manifest
+
+        Args:
+            out_dir: Target directory
+            shard_ids: Only rewrite these shards (all shards when None); the manifest is always rewritten
+        """
+        os.makedirs(out_dir, exist_ok=True)
+        for shard_id, shard in enumerate(self.shards):
+            if shard_ids is not None and shard_id not in shard_ids:
+                continue
+            np.save(os.path.join(out_dir, f'shard-{shard_id:04d}.npy'), np.ascontiguousarray(shard.vectors), allow_pickle=False)
+            np.save(os.path.join(out_dir, f'shard-{shard_id:04d}-positions.npy'), shard.positions, allow_pickle=False)
+        manifest = {
+            'num_rows': self.num_rows,
+            'num_features': self.num_features,
+            'shards': [{'rows': len(shard), 'group': shard.group} for shard in self.shards],
+        }
+        with open(os.path.join(out_dir, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    @classmethod
+    def load(cls, index_dir=SHARDED_INDEX_DIR, mmap_mode='r', max_workers=None):
+        with open(os.path.join(index_dir, MANIFEST_FILE), encoding='utf-8') as f:
+            manifest = json.load(f)
+        shards = []
+        for shard_id, meta in enumerate(manifest['shards']):
+            vectors = np.load(os.path.join(index_dir, f'shard-{shard_id:04d}.npy'), mmap_mode=mmap_mode, allow_pickle=False)
+            positions = np.load(os.path.join(index_dir, f'shard-{shard_id:04d}-positions.npy'), allow_pickle=False)
+            shards.append(IndexShard(vectors, positions, group=meta['group']))
+        return cls(shards, max_workers=max_workers)
+
+
+def has_sharded_index(index_dir=SHARDED_INDEX_DIR):
+    return os.path.exists(os.path.join(index_dir, MANIFEST_FILE))
+
+
+IVF_INDEX_DIR = 'models/ivf'
+
+
+def _assign_clusters(vectors, centroids, chunk_size=8192):
+    """Index of the closest (highest cosine) centroid of every row"""
+    labels = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), chunk_size):
+        labels[start:start + chunk_size] = np.argmax(vectors[start:start + chunk_size] @ centroids.T, axis=1)
+    return labels
+
+
+# Phân cụm k-means trên mặt cầu đơn vị (độ tương đồng cosine)
+def spherical_kmeans(vectors, n_clusters, n_iter=20, sample_size=100000, seed=0):
+    """
+    Cluster unit-length vectors by cosine similarity
+
+    Args:
+        vectors: (n x num_features) unit-length float32 vectors
+        n_clusters: Number of centroids
+        n_iter: Lloyd iterations
+        sample_size: Rows used to fit the centroids (all rows when smaller)
+        seed: Random seed
+
+    Returns:
+        (n_clusters x num_features) float32 array of unit-length centroids
+    """
+    rng = np.random.default_rng(seed)
+    n_rows = len(vectors)
+    sample = np.asarray(vectors[np.sort(rng.choice(n_rows, min(n_rows, sample_size), replace=False))], dtype=np.float32)
+    n_clusters = min(n_clusters, len(sample))
+    centroids = sample[rng.choice(len(sample), n_clusters, replace=False)].copy()
+    for _ in range(n_iter):
+        labels = _assign_clusters(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, sample)
+        counts = np.bincount(labels, minlength=n_clusters)
+        # Re-seed empty clusters with random rows so every list stays in use
+        empty = np.flatnonzero(counts == 0)
+        sums[empty] = sample[rng.choice(len(sample), len(empty), replace=False)]
+        centroids = _unit_rows(sums)
+    return centroids
+
+
+# Chỉ mục xấp xỉ IVF: chỉ chấm điểm các cụm gần truy vấn nhất
+class IVFIndex:
+    """
+    Approximate LSI similarity index with inverted lists (IVF)
+
+    Products are clustered with spherical k-means; their vectors are stored
+    contiguously list by list. A query is compared with the centroids first
+    and only the `nprobe` closest lists are scored exactly, so latency grows
+    with nprobe / n_lists instead of the catalog size. Pure NumPy.
+
+    Args:
+        centroids: (n_lists x num_features) unit-length centroids
+        vectors: float32 product vectors ordered list by list
+        positions: Catalog row position of every row of `vectors`
+        offsets: Start of every list in `vectors` (length n_lists + 1)
+        nprobe: Default number of lists scored per query
+    """
+
+    def __init__(self, centroids, vectors, positions, offsets, nprobe=8):
+        self.centroids = centroids
+        self.vectors = vectors
+        self.positions = np.asarray(positions, dtype=np.int64)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.nprobe = nprobe
+        self.num_features = centroids.shape[1]
+
+    def __len__(self):
+        return len(self.positions)
+
+    @property
+    def n_lists(self):
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, vectors, n_lists=None, nprobe=8, n_iter=20, sample_size=100000, seed=0):
+        """
+        Cluster the LSI vectors (e.g. `similarity_index.index`) into inverted lists
+
+        Args:
+            vectors: (n_products x num_features) LSI vectors in catalog row order
+            n_lists: Number of lists (defaults to about sqrt(n_products))
+            nprobe: Default number of lists scored per query
+            n_iter: k-means iterations
+            sample_size: Rows used to fit the centroids
+            seed: Random seed
+
+        Returns:
+            IVFIndex
+        """
+        vectors = _unit_rows(vectors)
+        if n_lists is None:
+            n_lists = max(1, int(np.sqrt(len(vectors))))
+        centroids = spherical_kmeans(vectors, n_lists, n_iter=n_iter, sample_size=sample_size, seed=seed)
+        labels = _assign_clusters(vectors, centroids)
+        order = np.argsort(labels, kind='stable')
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(labels, minlength=len(centroids)))])
+        return cls(centroids, vectors[order], order, offsets, nprobe=nprobe)
+
+    def query_vector(self, lsi_vector):
+        """Convert a Gensim sparse or dense LSI vector into a unit-length float32 vector"""
+        return unit_query_vector(lsi_vector, self.num_features)
+
+    def _probe(self, query, nprobe):
+        """Exact scores of the rows in the nprobe closest lists: (row slices, scores)"""
+        lists, _ = select_top_k(self.centroids @ query, nprobe or self.nprobe)
+        rows = [np.arange(self.offsets[i], self.offsets[i + 1]) for i in lists]
+        rows = np.concatenate(rows) if rows else np.empty(0, dtype=np.int64)
+        return rows, self.vectors[rows] @ query
+
+    def __getitem__(self, lsi_vector):
+        """Similarity to every product in catalog row order; rows outside the probed lists score -inf"""
+        rows, scores = self._probe(self.query_vector(lsi_vector), self.nprobe)
+        sims = np.full(len(self), -np.inf, dtype=np.float32)
+        sims[self.positions[rows]] = scores
+        return sims
+
+    def top_k(self, lsi_vector, k, exclude=None, nprobe=None):
+        """
+        Approximate top-k of a query
+
+        Args:
+            lsi_vector: Gensim LSI vector of the query
+            k: Number of products to return (fewer if the probed lists are smaller)
+            exclude: Catalog row position(s) to leave out
+            nprobe: Lists scored for this call (defaults to `self.nprobe`)
+
+        Returns:
+            Tuple (positions, scores) sorted best first, ties by position
+        """
+        rows, scores = self._probe(self.query_vector(lsi_vector), nprobe)
+        positions = self.positions[rows]
+        mask = np.isin(positions, exclude) if exclude is not None else None
+        top, values = select_top_k(scores, k, exclude=mask)
+        positions = positions[top]
+        order = np.lexsort((positions, -values))
+        return positions[order], values[order]
+
+    def add(self, vectors, positions):
+        """
+        Assign new catalog rows to the existing lists (no re-clustering)
+
+        Args:
+            vectors: LSI vectors of the new rows
+            positions: Their catalog row positions
+
+        Returns:
+            New IVFIndex with the same centroids
+        """
+        vectors = _unit_rows(vectors)
+        old_labels = np.repeat(np.arange(self.n_lists), np.diff(self.offsets))
+        labels = np.concatenate([old_labels, _assign_clusters(vectors, self.centroids)])
+        order = np.argsort(labels, kind='stable')
+        all_vectors = np.concatenate([np.asarray(self.vectors), vectors])[order]
+        all_positions = np.concatenate([self.positions, np.asarray(positions, dtype=np.int64)])[order]
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(labels, minlength=self.n_lists))])
+        return IVFIndex(self.centroids, all_vectors, all_positions, offsets, nprobe=self.nprobe)
+
+    def save(self, out_dir=IVF_INDEX_DIR):
+        os.makedirs(out_dir, exist_ok=True)
+        for name in ('centroids', 'vectors', 'positions', 'offsets'):
+            np.save(os.path.join(out_dir, f'{name}.npy'), np.ascontiguousarray(getattr(self, name)), allow_pickle=False)
+        with open(os.path.join(out_dir, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+            json.dump({'n_lists': self.n_lists, 'nprobe': self.nprobe, 'num_rows': len(self)}, f, indent=2)
+
+    @classmethod
+    def load(cls, index_dir=IVF_INDEX_DIR, mmap_mode='r'):
+        with open(os.path.join(index_dir, MANIFEST_FILE), encoding='utf-8') as f:
+            manifest = json.load(f)
+        arrays = {
+            name: np.load(os.path.join(index_dir, f'{name}.npy'), mmap_mode=mmap_mode, allow_pickle=False)
+            for name in ('centroids', 'vectors', 'positions', 'offsets')
+        }
+        return cls(nprobe=manifest['nprobe'], **arrays)
+
+
+def has_ivf_index(index_dir=IVF_INDEX_DIR):
+    return os.path.exists(os.path.join(index_dir, MANIFEST_FILE))
+
+
+QUANTIZED_INDEX_DIR = 'models/quantized'
+
+
+# Lượng tử hóa vector LSI sang int8 với hệ số tỉ lệ cho từng vector
+def quantize_rows(vectors):
+    """
+    Quantize unit-length vectors to int8 with one scale per vector
+
+    Returns:
+        Tuple (codes, scales) with `codes * scales[:, None]` approximating the vectors
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+# Chỉ mục tương đồng lưu vector dạng float32 hoặc int8
+class QuantizedIndex:
+    """
+    LSI similarity index with compact float32 or int8 vector storage
+
+    In int8 mode every vector is stored as int8 codes plus one float32 scale
+    (about a quarter of the float32 size). Queries are scored in chunks with
+    mixed precision (int8 codes widened to float32 block by block, times the
+    per-vector scale); optionally the best `rerank` candidates are re-scored
+    exactly against the float32 vectors, which are memory-mapped and only
+    touched for those rows. With the re-rank the float32 vectors are stored
+    as well, so the saving is in resident memory, not on disk. The widening
+    makes an int8 scan slower than the exact float32 scan; the index trades
+    latency for memory.
+
+    Args:
+        codes: int8 (or float32) array (n_products x num_features) in catalog row order
+        scales: float32 per-vector scales (None for float32 storage)
+        vectors: Optional float32 unit-length vectors used for the exact re-rank
+        rerank: Number of candidates re-scored exactly (0 disables the re-rank)
+        chunk_size: Rows widened to float32 per block
+    """
+
+    def __init__(self, codes, scales=None, vectors=None, rerank=200, chunk_size=2048):
+        self.codes = codes
+        self.scales = scales
+        self.vectors = vectors
+        self.rerank = rerank
+        self.chunk_size = chunk_size
+        self.num_features = codes.shape[1]
+
+    def __len__(self):
+        return len(self.codes)
+
+    @classmethod
+    def build(cls, vectors, dtype='int8', rerank=200):
+        """
+        Build from LSI vectors in catalog row order (e.g. `similarity_index.index`)
+
+        Args:
+            vectors: (n_products x num_features) LSI vectors
+            dtype: 'int8' or 'float32'
+            rerank: Number of candidates re-scored exactly with the float32 vectors
+        """
+        vectors = _unit_rows(vectors)
+        if dtype == 'float32':
+            return cls(vectors, rerank=0)
+        if dtype != 'int8':
+            raise ValueError(f"Unsupported dtype: {dtype}")
+        codes, scales = quantize_rows(vectors)
+        return cls(codes, scales, vectors=vectors if rerank else None, rerank=rerank)
+
+    @property
+    def scored_nbytes(self):
+        """Bytes of the codes and scales scored on every query"""
+        return self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    @property
+    def rerank_nbytes(self):
+        """Bytes of the float32 re-rank vectors (memory-mapped, only candidate rows are read)"""
+        return self.vectors.nbytes if self.vectors is not None else 0
+
+    @property
+    def nbytes(self):
+        """Bytes of everything the index stores and loads: scored vectors plus re-rank vectors"""
+        return self.scored_nbytes + self.rerank_nbytes
+
+    def query_vector(self, lsi_vector):
+        """Convert a Gensim sparse or dense LSI vector into a unit-length float32 vector"""
+        return unit_query_vector(lsi_vector, self.num_features)
+
+    def _scores(self, query):
+        if self.scales is None:
+            return self.codes @ query
+        sims = np.empty(len(self), dtype=np.float32)
+        for start in range(0, len(self), self.chunk_size):
+            block = np.asarray(self.codes[start:start + self.chunk_size], dtype=np.float32)
+            sims[start:start + len(block)] = (block @ query) * self.scales[start:start + len(block)]
+        return sims
+
+    def __getitem__(self, lsi_vector):
+        """Approximate similarity of the query to every product, in catalog row order"""
+        return self._scores(self.query_vector(lsi_vector))
+
+    def top_k(self, lsi_vector, k, exclude=None):
+        """
+        Top-k of a query, re-ranked exactly when float32 vectors are available
+
+        Returns:
+            Tuple (positions, scores) sorted best first, ties by position
+        """
+        query = self.query_vector(lsi_vector)
+        sims = self._scores(query)
+        if self.vectors is None or not self.rerank:
+            return select_top_k(sims, k, exclude=exclude)
+        candidates, _ = select_top_k(sims, max(k, self.rerank), exclude=exclude)
+        candidates = np.sort(candidates)
+        exact = np.asarray(self.vectors[candidates], dtype=np.float32) @ query
+        top, values = select_top_k(exact, k)
+        return candidates[top], values
+
+    def save(self, out_dir=QUANTIZED_INDEX_DIR):
+        os.makedirs(out_dir, exist_ok=True)
+        np.save(os.path.join(out_dir, 'codes.npy'), np.ascontiguousarray(self.codes), allow_pickle=False)
+        if self.scales is not None:
+            np.save(os.path.join(out_dir, 'scales.npy'), self.scales, allow_pickle=False)
+        if self.vectors is not None:
+            np.save(os.path.join(out_dir, 'vectors.npy'), np.ascontiguousarray(self.vectors), allow_pickle=False)
+        manifest = {
+            'dtype': str(self.codes.dtype),
+            'rerank': self.rerank,
+            'has_scales': self.scales is not None,
+            'has_vectors': self.vectors is not None,
+        }
+        with open(os.path.join(out_dir, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+
+    @classmethod
+    def load(cls, index_dir=QUANTIZED_INDEX_DIR, rerank=None):
+        with open(os.path.join(index_dir, MANIFEST_FILE), encoding='utf-8') as f:
+            manifest = json.load(f)
+        # Codes are read into memory; the float32 vectors are only mapped for the re-rank
+        codes = np.load(os.path.join(index_dir, 'codes.npy'), allow_pickle=False)
+        scales = np.load(os.path.join(index_dir, 'scales.npy'), allow_pickle=False) if manifest['has_scales'] else None
+        vectors = None
+        if manifest['has_vectors']:
+            vectors = np.load(os.path.join(index_dir, 'vectors.npy'), mmap_mode='r', allow_pickle=False)
+        return cls(codes, scales, vectors=vectors, rerank=manifest['rerank'] if rerank is None else rerank)
+
+
+def has_quantized_index(index_dir=QUANTIZED_INDEX_DIR):
+    return os.path.exists(os.path.join(index_dir, MANIFEST_FILE))
+
+
+PARTITIONED_INDEX_DIR = 'models/partitioned'
+
+
+def _numeric(values, order):
+    """Column values as float64 in partition order (NaN where not numeric), or None"""
+    if values is None:
+        return None
+    return pd.to_numeric(pd.Series(values), errors='coerce').to_numpy(dtype=np.float64)[order]
+
+
+def _in_range(values, value_range):
+    """Boolean mask of values inside an inclusive (low, high) range; None leaves a side open"""
+    low, high = value_range
+    mask = ~np.isnan(values)
+    if low is not None:
+        mask &= values >= low
+    if high is not None:
+        mask &= values <= high
+    return mask
+
+
+# Chỉ mục phân vùng theo sub_category, lọc trước theo giá/đánh giá
+class PartitionedIndex:
+    """
+    LSI index partitioned by sub_category for pre-filtered search
+
+    Vectors are stored contiguously partition by partition (an inverted
+    sub_category -> row range map), together with the price and rating of
+    every row. A search restricted to some sub_categories only scores their
+    row ranges, and price/rating ranges are applied before scoring, so
+    filtered queries touch a fraction of the catalog.
+
+    Args:
+        vectors: float32 unit-length LSI vectors ordered partition by partition
+        positions: Catalog row position of every row of `vectors`
+        partitions: Dict sub_category -> (start, stop) row range in `vectors`
+        prices: float64 price per row of `vectors` (NaN when unknown)
+        ratings: float64 rating per row of `vectors` (NaN when unknown)
+    """
+
+    def __init__(self, vectors, positions, partitions, prices=None, ratings=None):
+        self.vectors = vectors
+        self.positions = np.asarray(positions, dtype=np.int64)
+        self.partitions = partitions
+        self.prices = prices
+        self.ratings = ratings
+        self.num_features = vectors.shape[1]
+
+    def __len__(self):
+        return len(self.positions)
+
+    @classmethod
+    def build(cls, vectors, sub_categories, prices=None, ratings=None):
+        """
+        Build from LSI vectors and catalog columns, all in catalog row order
+
+        Args:
+            vectors: (n_products x num_features) LSI vectors (e.g. `similarity_index.index`)
+            sub_categories: sub_category of every product
+            prices: Price of every product (optional)
+            ratings: Rating of every product (optional)
+        """
+        labels = np.asarray([str(value) for value in sub_categories], dtype=object)
+        order = np.argsort(labels, kind='stable')
+        sorted_labels = labels[order]
+        boundaries = np.flatnonzero(sorted_labels[1:] != sorted_labels[:-1]) + 1
+        starts = np.concatenate([[0], boundaries]).astype(int)
+        stops = np.concatenate([boundaries, [len(order)]]).astype(int)
+        partitions = {sorted_labels[start]: (int(start), int(stop)) for start, stop in zip(starts, stops) if stop > start}
+        return cls(
+            _unit_rows(np.asarray(vectors)[order]),
+            order,
+            partitions,
+            prices=_numeric(prices, order),
+            ratings=_numeric(ratings, order),
+        )
+
+    def query_vector(self, lsi_vector):
+        """Convert a Gensim sparse or dense LSI vector into a unit-length float32 vector"""
+        return unit_query_vector(lsi_vector, self.num_features)
+
+    def __getitem__(self, lsi_vector):
+        """Similarity of the query to every product, in catalog row order (unfiltered)"""
+        sims = np.empty(len(self), dtype=np.float32)
+        sims[self.positions] = self.vectors @ self.query_vector(lsi_vector)
+        return sims
+
+    def candidate_rows(self, sub_categories=None, price_range=None, rating_range=None):
+        """Rows of `vectors` matching the filters, as a list of row arrays per partition"""
+        if sub_categories is None:
+            ranges = [(0, len(self))]
+        else:
+            # A sub_category listed twice is still scored once
+            labels = dict.fromkeys(str(label) for label in sub_categories)
+            ranges = [self.partitions[label] for label in labels if label in self.partitions]
+        selected = []
+        for start, stop in ranges:
+            rows = np.arange(start, stop)
+            if price_range is not None and self.prices is not None:
+                rows = rows[_in_range(self.prices[start:stop], price_range)]
+            if rating_range is not None and self.ratings is not None:
+                rows = rows[_in_range(self.ratings[rows], rating_range)]
+            if len(rows):
+                selected.append(rows)
+        return selected
+
+    def top_k(self, lsi_vector, k, exclude=None, sub_categories=None, price_range=None, rating_range=None):
+        """
+        Top-k of a query among the products matching the filters
+
+        Args:
+            lsi_vector: Gensim LSI vector of the query
+            k: Number of products to return (fewer if fewer products match)
+            exclude: Catalog row position(s) to leave out
+            sub_categories: Only search these sub_categories (all when None)
+            price_range: Inclusive (min, max) price, None for an open side
+            rating_range: Inclusive (min, max) rating, None for an open side
+
+        Returns:
+            Tuple (positions, scores) sorted best first, ties by position
+        """
+        query = self.query_vector(lsi_vector)
+        scores, positions = [], []
+        for rows in self.candidate_rows(sub_categories, price_range, rating_range):
+            start, stop = rows[0], rows[-1] + 1
+            if len(rows) == stop - start:
+                # Unfiltered partition: score the contiguous block without gathering rows
+                scores.append(self.vectors[start:stop] @ query)
+            else:
+                scores.append(self.vectors[rows] @ query)
+            positions.append(self.positions[rows])
+        if not scores:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        scores = np.concatenate(scores)
+        positions = np.concatenate(positions)
+        # Catalog order, so ties at the k-th score keep the lowest positions
+        order = np.argsort(positions, kind='stable')
+        scores, positions = scores[order], positions[order]
+        mask = np.isin(positions, exclude) if exclude is not None else None
+        top, values = select_top_k(scores, k, exclude=mask)
+        return positions[top], values
+
+    def save(self, out_dir=PARTITIONED_INDEX_DIR):
+        os.makedirs(out_dir, exist_ok=True)
+        np.save(os.path.join(out_dir, 'vectors.npy'), np.ascontiguousarray(self.vectors), allow_pickle=False)
+        np.save(os.path.join(out_dir, 'positions.npy'), self.positions, allow_pickle=False)
+        for name in ('prices', 'ratings'):
+            if getattr(self, name) is not None:
+                np.save(os.path.join(out_dir, f'{name}.npy'), getattr(self, name), allow_pickle=False)
+        manifest = {
+            'partitions': {label: list(bounds) for label, bounds in self.partitions.items()},
+            'has_prices': self.prices is not None,
+            'has_ratings': self.ratings is not None,
+        }
+        with open(os.path.join(out_dir, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    @classmethod
+    def load(cls, index_dir=PARTITIONED_INDEX_DIR, mmap_mode='r'):
+        with open(os.path.join(index_dir, MANIFEST_FILE), encoding='utf-8') as f:
+            manifest = json.load(f)
+        def load(name):
+            return np.load(os.path.join(index_dir, f'{name}.npy'), mmap_mode=mmap_mode, allow_pickle=False)
+
+        return cls(
+            load('vectors'),
+            load('positions'),
+            {label: tuple(bounds) for label, bounds in manifest['partitions'].items()},
+            prices=load('prices') if manifest['has_prices'] else None,
+            ratings=load('ratings') if manifest['has_ratings'] else None,
+        )
+
+
+def has_partitioned_index(index_dir=PARTITIONED_INDEX_DIR):
+    return os.path.exists(os.path.join(index_dir, MANIFEST_FILE))
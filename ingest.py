@@ -0,0 +1,395 @@
+"""
+Incremental catalog updates without retraining the content models
+
+New and changed products are tokenized like the training data and folded
+into the existing LSI space with the frozen dictionary, TF-IDF weights and
+LSI projection of the memory-mapped models (build_artifacts.py export-mmap).
+Their vectors are appended to the similarity index and their rows to the
+columnar catalog (export-catalog), both in place. A changed product is
+tombstoned and appended again; deleted products are only tombstoned, so row
+positions never move. Sharded, IVF, quantized and partitioned indexes found
+on disk are brought up to date as well, and so is the TF-IDF cosine engine
+(export-cosine), whose frozen vectorizer vectorizes the new rows.
+
+Folding in cannot learn new words or topics, so every ingest adds to a drift
+record (rows changed since the last full build, share of out-of-vocabulary
+tokens). Once it passes --max-churn or --max-oov, the full training pipeline
+is due: --rebuild-command is run, or the script exits with status 3.
+
+    python ingest.py --upsert new_products.csv --stop-words vietnamese-stopwords.txt
+    python ingest.py --delete removed_ids.txt
+    python ingest.py --upsert changed.pkl --rebuild-command "python train_content.py"
+
+Running services see the new rows after their next restart; the pickles in
+models/ and data/processed_data.pkl stay the snapshot of the last full build.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from artifacts import (
+    CATALOG_DIR, COSINE_MODELS_DIR, MANIFEST_FILE, MMAP_MODELS_DIR, ColumnarCatalog, _write_manifest,
+    append_columnar_catalog, append_cosine_rows, append_rows, commit_cosine_rows, has_columnar_catalog, has_cosine_models,
+    has_mmap_models, load_cosine_models, load_mmap_models, save_tombstones,
+)
+from indexes import (
+    IVF_INDEX_DIR, PARTITIONED_INDEX_DIR, QUANTIZED_INDEX_DIR, SHARDED_INDEX_DIR,
+    IVFIndex, PartitionedIndex, QuantizedIndex, ShardedIndex,
+    has_ivf_index, has_partitioned_index, has_quantized_index, has_sharded_index,
+)
+from utils import CatalogIndex, data_preprocessing_for_gensim, filter_vietnamese_words, tfidf_batch
+
+INGEST_STATE_PATH = 'models/ingest_state.json'
+DEFAULT_MAX_CHURN = 0.2
+DEFAULT_MAX_OOV = 0.1
+# The notebook builds the content from the name and the first 200 words of the description
+DESCRIPTION_WORDS = 200
+
+
+def load_stop_words(path):
+    with open(path, encoding='utf-8') as f:
+        return frozenset(line.strip() for line in f if line.strip())
+
+
+# Đọc danh sách sản phẩm mới/thay đổi (csv, pickle hoặc json)
+def read_products(path):
+    if path.endswith('.csv'):
+        return pd.read_csv(path)
+    if path.endswith(('.json', '.jsonl')):
+        return pd.read_json(path, lines=path.endswith('.jsonl'))
+    data = pd.read_pickle(path)
+    return data['df'] if isinstance(data, dict) else data
+
+
+# Đọc danh sách product_id cần xóa (mỗi dòng một id, hoặc csv có cột product_id)
+def read_product_ids(path):
+    if path.endswith('.csv'):
+        values = pd.read_csv(path)['product_id'].tolist()
+    else:
+        with open(path, encoding='utf-8') as f:
+            values = [line.strip() for line in f if line.strip()]
+    return [int(value) if str(value).lstrip('-').isdigit() else value for value in values]
+
+
+# Tách từ nội dung sản phẩm giống như lúc huấn luyện
+def tokenize_products(df, stop_words=None):
+    """
+    Fill `content_processed` for the products that do not have it yet
+
+    Same steps as ContentBased.ipynb: product_name plus the first 200 words of
+    the cleaned description, underthesea word segmentation, stop word removal
+    and `data_preprocessing_for_gensim`.
+
+    Args:
+        df: DataFrame of products (product_name, description_clean or description)
+        stop_words: Stop words to remove
+
+    Returns:
+        Copy of df with a `content_processed` token list on every row
+    """
+    df = df.copy()
+    if 'content_processed' not in df.columns:
+        df['content_processed'] = None
+    missing = df['content_processed'].map(lambda tokens: not isinstance(tokens, (list, tuple))).to_numpy()
+    if not missing.any():
+        return df
+
+    # Only needed when raw text has to be segmented
+    from underthesea import word_tokenize
+
+    stop_words = frozenset(stop_words or ())
+    rows = df[missing]
+    if 'description_clean' in rows.columns:
+        descriptions = rows['description_clean'].fillna('')
+    else:
+        descriptions = rows['description'].fillna('').map(filter_vietnamese_words)
+    contents = rows['product_name'].fillna('') + ' ' + descriptions.map(lambda text: ' '.join(text.split()[:DESCRIPTION_WORDS]))
+    segmented = [
+        [word for word in word_tokenize(text, format='text').split() if word not in stop_words]
+        for text in contents
+    ]
+    processed = data_preprocessing_for_gensim(segmented, remove_number=True, remove_special_chars=True, stop_words=stop_words)
+    column = df['content_processed'].tolist()
+    for position, tokens in zip(np.flatnonzero(missing), processed):
+        column[position] = tokens
+    df['content_processed'] = pd.Series(column, index=df.index, dtype=object)
+    return df
+
+
+# Chiếu tài liệu mới vào không gian LSI đã huấn luyện (fold-in)
+def fold_in(documents, dictionary, tfidf, lsi_model):
+    """
+    LSI vectors of token lists, with the frozen dictionary, TF-IDF and projection
+
+    Returns:
+        Tuple (vectors, n_tokens, n_oov): unit-length float32 rows as stored in
+        the similarity index, the number of tokens and how many were out of vocabulary
+    """
+    token2id = dictionary.token2id
+    n_tokens = sum(len(doc) for doc in documents)
+    n_oov = sum(1 for doc in documents for token in doc if token not in token2id)
+    projection = lsi_model.projection.u[:, :lsi_model.num_topics]
+    weights = tfidf_batch(tfidf, [dictionary.doc2bow(doc) for doc in documents], projection.shape[0])
+    vectors = np.asarray(weights @ projection, dtype=np.float32).reshape(len(documents), -1)
+    norms = np.sqrt(np.einsum('ij,ij->i', vectors, vectors))
+    vectors /= np.where(norms > 0, norms, 1)[:, None]
+    return vectors, n_tokens, n_oov
+
+
+# Trạng thái trôi dạt (drift) kể từ lần huấn luyện đầy đủ gần nhất
+class IngestState:
+    """
+    Drift counters since the last full build, kept in a small JSON file
+
+    Args:
+        base_rows: Catalog rows at the last full build
+        appended: Rows appended since then (new and changed products)
+        deleted: Products deleted since then
+        tokens, oov_tokens: Tokens folded in and how many the dictionary did not know
+    """
+
+    def __init__(self, base_rows, appended=0, deleted=0, tokens=0, oov_tokens=0, updated_at=None):
+        self.base_rows = base_rows
+        self.appended = appended
+        self.deleted = deleted
+        self.tokens = tokens
+        self.oov_tokens = oov_tokens
+        self.updated_at = updated_at
+
+    @classmethod
+    def load(cls, path, base_rows):
+        if not os.path.exists(path):
+            return cls(base_rows)
+        with open(path, encoding='utf-8') as f:
+            return cls(**json.load(f))
+
+    def save(self, path):
+        self.updated_at = time.strftime('%Y-%m-%dT%H:%M:%S')
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(vars(self), f, indent=2)
+
+    @property
+    def churn(self):
+        return (self.appended + self.deleted) / max(1, self.base_rows)
+
+    @property
+    def oov_rate(self):
+        return self.oov_tokens / self.tokens if self.tokens else 0.0
+
+    def needs_rebuild(self, max_churn=DEFAULT_MAX_CHURN, max_oov=DEFAULT_MAX_OOV):
+        return self.churn > max_churn or self.oov_rate > max_oov
+
+
+def _save_replacing(index, out_dir):
+    """
+    Save an index next to out_dir and move its files in one by one
+
+    Running services may have the old files memory-mapped; renaming over
+    them keeps the old pages valid, while rewriting them in place would not.
+    The manifest is moved last.
+    """
+    tmp_dir = out_dir.rstrip('/') + '.tmp'
+    index.save(tmp_dir)
+    names = sorted(os.listdir(tmp_dir), key=lambda name: name == MANIFEST_FILE)
+    for name in names:
+        os.replace(os.path.join(tmp_dir, name), os.path.join(out_dir, name))
+    os.rmdir(tmp_dir)
+
+
+# Cập nhật các chỉ mục phụ (mảnh, IVF, lượng tử hóa, phân vùng) theo các dòng mới
+def refresh_indexes(vectors, start, stop, store):
+    """
+    Add the rows [start, stop) to the derived indexes found on disk
+
+    Args:
+        vectors: Similarity index matrix covering rows [0, stop)
+        start, stop: Positions of the appended rows
+        store: ColumnarCatalog after the append
+
+    Returns:
+        List of the refreshed index directories
+    """
+    positions = np.arange(start, stop)
+    refreshed = []
+    if has_sharded_index():
+        index = ShardedIndex.load(mmap_mode=None)
+        if len(index) == start:
+            shard_id = index.add_shard(vectors[start:stop], positions)
+            index.save(SHARDED_INDEX_DIR, shard_ids=[shard_id])
+            refreshed.append(SHARDED_INDEX_DIR)
+    if has_ivf_index():
+        index = IVFIndex.load(mmap_mode=None)
+        if len(index) == start:
+            _save_replacing(index.add(vectors[start:stop], positions), IVF_INDEX_DIR)
+            refreshed.append(IVF_INDEX_DIR)
+    if has_quantized_index():
+        index = QuantizedIndex.load()
+        if len(index) == start:
+            dtype = 'int8' if index.scales is not None else 'float32'
+            _save_replacing(QuantizedIndex.build(vectors[:stop], dtype=dtype, rerank=index.rerank), QUANTIZED_INDEX_DIR)
+            refreshed.append(QUANTIZED_INDEX_DIR)
+    if has_partitioned_index():
+        index = PartitionedIndex.load()
+        if len(index) == start:
+            index = PartitionedIndex.build(
+                vectors[:stop],
+                np.asarray(store.column('sub_category')),
+                prices=store.column('price') if 'price' in store.columns else None,
+                ratings=store.column('rating') if 'rating' in store.columns else None,
+            )
+            _save_replacing(index, PARTITIONED_INDEX_DIR)
+            refreshed.append(PARTITIONED_INDEX_DIR)
+    return refreshed
+
+
+# Cập nhật danh mục tăng dần: thêm/sửa/xóa sản phẩm không cần huấn luyện lại
+def ingest(upserts=None, deletions=None, stop_words=None, model_dir=MMAP_MODELS_DIR, catalog_dir=CATALOG_DIR,
+           state_path=INGEST_STATE_PATH, max_churn=DEFAULT_MAX_CHURN, max_oov=DEFAULT_MAX_OOV, cosine_dir=COSINE_MODELS_DIR):
+    """
+    Fold new or changed products into the served artifacts and tombstone deletions
+
+    Args:
+        upserts: DataFrame of new or changed products (optional)
+        deletions: List of product ids to delete (optional)
+        stop_words: Stop words used when raw text has to be tokenized
+        model_dir: Memory-mapped models directory
+        catalog_dir: Columnar catalog directory
+        state_path: Drift record
+        max_churn: Share of rows changed since the last full build that calls for a rebuild
+        max_oov: Share of out-of-vocabulary tokens that calls for a rebuild
+        cosine_dir: Exported cosine engine, updated when present
+
+    Returns:
+        Dict report (counts, drift, refreshed indexes, rebuild_required)
+    """
+    if not (has_mmap_models(model_dir) and has_columnar_catalog(catalog_dir)):
+        raise FileNotFoundError("Incremental ingest needs build_artifacts.py export-mmap and export-catalog first")
+    started = time.perf_counter()
+    dictionary, tfidf, lsi_model, similarity_index, _ = load_mmap_models(model_dir)
+    store = ColumnarCatalog(catalog_dir)
+    n_rows = len(store)
+    index_path = os.path.join(model_dir, 'similarity_index.npy')
+    with open(os.path.join(model_dir, MANIFEST_FILE), encoding='utf-8') as f:
+        model_manifest = json.load(f)
+    state = IngestState.load(state_path, base_rows=n_rows)
+
+    # An ingest interrupted after the catalog commit left rows without vectors: fold them in first
+    index_rows = len(similarity_index)
+    if index_rows < n_rows:
+        tail = store.take('content_processed', np.arange(index_rows, n_rows))
+        vectors, _, _ = fold_in(list(tail), dictionary, tfidf, lsi_model)
+        append_rows(index_path, vectors, at_row=index_rows)
+    elif index_rows > n_rows:
+        raise ValueError(f"Similarity index has {index_rows} rows but the catalog only {n_rows}")
+    cosine = has_cosine_models(cosine_dir)
+    if cosine:
+        cosine_rows = load_cosine_models(cosine_dir)[1].shape[0]
+        if cosine_rows < n_rows:
+            tail = store.take('content_processed', np.arange(cosine_rows, n_rows))
+            append_cosine_rows([' '.join(tokens) for tokens in tail], cosine_dir, at_row=cosine_rows)
+        elif cosine_rows > n_rows:
+            # Committed before a catalog commit that never happened
+            append_cosine_rows([], cosine_dir, at_row=n_rows)
+
+    catalog = CatalogIndex(store.frame(['product_id']), store=store, deleted=store.tombstones)
+    deleted = np.zeros(n_rows, dtype=bool) if catalog.deleted is None else catalog.deleted.copy()
+    report = {'added': 0, 'updated': 0, 'deleted': 0, 'unknown_deletions': 0, 'refreshed_indexes': []}
+
+    if deletions:
+        positions = catalog.positions(deletions)
+        report['unknown_deletions'] = int((positions < 0).sum())
+        positions = np.unique(positions[positions >= 0])
+        deleted[positions] = True
+        report['deleted'] = len(positions)
+        state.deleted += len(positions)
+
+    start = stop = n_rows
+    if upserts is not None and len(upserts):
+        upserts = tokenize_products(upserts.drop_duplicates('product_id', keep='last'), stop_words=stop_words)
+        replaced = catalog.positions(upserts['product_id'].to_numpy())
+        replaced = replaced[replaced >= 0]
+        vectors, n_tokens, n_oov = fold_in(list(upserts['content_processed']), dictionary, tfidf, lsi_model)
+
+        # Vectors first, then the catalog commit, then the tombstones and the model and cosine manifests
+        append_rows(index_path, vectors, at_row=n_rows)
+        if cosine:
+            append_cosine_rows([' '.join(tokens) for tokens in upserts['content_processed']], cosine_dir,
+                               at_row=n_rows, commit=False)
+        start, stop = append_columnar_catalog(upserts, catalog_dir)
+        deleted = np.concatenate([deleted, np.zeros(stop - start, dtype=bool)])
+        deleted[replaced] = True
+        report['updated'] = len(replaced)
+        report['added'] = len(upserts) - len(replaced)
+        state.appended += len(upserts)
+        state.tokens += n_tokens
+        state.oov_tokens += n_oov
+
+    if deleted.any():
+        save_tombstones(deleted, catalog_dir)
+    model_manifest['num_rows'] = stop
+    _write_manifest(model_dir, model_manifest)
+    if cosine and stop > start:
+        commit_cosine_rows(stop, cosine_dir)
+
+    if stop > start:
+        store = ColumnarCatalog(catalog_dir)
+        vectors = np.load(index_path, mmap_mode='r')
+        report['refreshed_indexes'] = refresh_indexes(vectors, start, stop, store)
+        if cosine:
+            report['refreshed_indexes'].append(cosine_dir)
+
+    state.save(state_path)
+    report.update({
+        'rows': stop,
+        'churn': round(state.churn, 4),
+        'oov_rate': round(state.oov_rate, 4),
+        'rebuild_required': state.needs_rebuild(max_churn, max_oov),
+        'seconds': round(time.perf_counter() - started, 3),
+    })
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--upsert', default=None, help='New or changed products (.csv, .pkl, .json or .jsonl)')
+    parser.add_argument('--delete', default=None, help='Product ids to delete (one per line, or .csv with product_id)')
+    parser.add_argument('--stop-words', default=None, help='Stop word file used for tokenizing raw text')
+    parser.add_argument('--max-churn', type=float, default=DEFAULT_MAX_CHURN)
+    parser.add_argument('--max-oov', type=float, default=DEFAULT_MAX_OOV)
+    parser.add_argument('--rebuild-command', default=None, help='Full rebuild to run once drift passes a threshold')
+    parser.add_argument('--reset-state', action='store_true', help='Record a full build of the current catalog and exit')
+    args = parser.parse_args()
+
+    if args.reset_state:
+        IngestState(len(ColumnarCatalog())).save(INGEST_STATE_PATH)
+        print(f"Drift record reset in {INGEST_STATE_PATH}")
+        return
+    if not (args.upsert or args.delete):
+        parser.error("Nothing to ingest: pass --upsert and/or --delete")
+
+    report = ingest(
+        upserts=read_products(args.upsert) if args.upsert else None,
+        deletions=read_product_ids(args.delete) if args.delete else None,
+        stop_words=load_stop_words(args.stop_words) if args.stop_words else None,
+        max_churn=args.max_churn,
+        max_oov=args.max_oov,
+    )
+    print(json.dumps(report, indent=2))
+    if not report['rebuild_required']:
+        return
+    if args.rebuild_command is None:
+        print("Drift threshold exceeded: a full rebuild of the content models is due", file=sys.stderr)
+        sys.exit(3)
+    print(f"Drift threshold exceeded, running: {args.rebuild_command}", flush=True)
+    subprocess.run(args.rebuild_command, shell=True, check=True)
+    IngestState(len(ColumnarCatalog())).save(INGEST_STATE_PATH)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,325 @@
+"""
+Latency metrics for the recommendation service and its hot path
+
+`LatencyHistogram` counts observations into fixed millisecond buckets (the
+same cumulative layout Prometheus uses), so percentiles can be estimated and
+histograms from several processes can be added up. `MetricsRegistry` keeps
+one histogram per (name, label) pair, e.g. per API endpoint and status, and
+renders them in the Prometheus text format.
+
+`Tracer` times the stages of a recommendation (tokenization, doc2bow, TF-IDF,
+LSI projection, similarity scan, top-k selection, re-rank, image fetch,
+rendering) with `with TRACER.stage('gensim.lsi'):` blocks and
+`@TRACER.traced('rerank')` decorators. Besides the cumulative histograms it
+keeps a rolling window per stage for the Streamlit debug panel and optional
+periodic log lines. Tracing is off unless RECOMMENDER_TRACE=1 (or
+`TRACER.enable()`); a disabled stage costs one attribute check.
+"""
+import bisect
+import functools
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+# Upper bounds of the latency buckets in milliseconds (the last bucket is +Inf)
+DEFAULT_BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+# Finer buckets for the stages of one request, most of which take well under a millisecond
+STAGE_BUCKETS_MS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+STAGE_METRIC = 'recommender_stage_duration_ms'
+
+
+# Biểu đồ phân bố độ trễ theo các ngưỡng cố định
+class LatencyHistogram:
+    """
+    Thread-safe latency histogram with fixed buckets
+
+    Args:
+        buckets: Increasing upper bounds in milliseconds
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS_MS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, milliseconds):
+        """Record one latency in milliseconds"""
+        slot = bisect.bisect_left(self.buckets, milliseconds)
+        with self._lock:
+            self.counts[slot] += 1
+            self.count += 1
+            self.total_ms += milliseconds
+
+    def merge(self, other):
+        """Add the observations of another histogram with the same buckets"""
+        with other._lock:
+            counts, count, total = list(other.counts), other.count, other.total_ms
+        with self._lock:
+            self.counts = [a + b for a, b in zip(self.counts, counts)]
+            self.count += count
+            self.total_ms += total
+
+    def quantile(self, q):
+        """Estimate a quantile (0-1) by linear interpolation inside its bucket"""
+        with self._lock:
+            counts, count = list(self.counts), self.count
+        if count == 0:
+            return 0.0
+        rank = q * count
+        seen = 0
+        for slot, bucket_count in enumerate(counts):
+            if seen + bucket_count >= rank and bucket_count:
+                lower = self.buckets[slot - 1] if slot > 0 else 0.0
+                if slot == len(self.buckets):
+                    return float(self.buckets[-1])
+                upper = self.buckets[slot]
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return float(self.buckets[-1])
+
+    def snapshot(self):
+        """Counts per bucket plus summary statistics"""
+        with self._lock:
+            counts, count, total = list(self.counts), self.count, self.total_ms
+        return {
+            'buckets_ms': list(self.buckets) + ['+Inf'],
+            'counts': counts,
+            'count': count,
+            'sum_ms': round(total, 3),
+            'mean_ms': round(total / count, 3) if count else 0.0,
+            'p50_ms': round(self.quantile(0.5), 3),
+            'p95_ms': round(self.quantile(0.95), 3),
+            'p99_ms': round(self.quantile(0.99), 3),
+        }
+
+
+# Tập hợp các biểu đồ độ trễ theo tên và nhãn
+class MetricsRegistry:
+    """Histograms keyed by metric name and a tuple of label values"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS_MS):
+        self.buckets = buckets
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            if key not in self._histograms:
+                self._histograms[key] = LatencyHistogram(self.buckets)
+            return self._histograms[key]
+
+    def observe(self, name, milliseconds, **labels):
+        self.histogram(name, **labels).observe(milliseconds)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Time the body of a `with` block into a histogram"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, (time.perf_counter() - start) * 1000, **labels)
+
+    def snapshot(self):
+        with self._lock:
+            items = list(self._histograms.items())
+        return [
+            {'name': name, 'labels': dict(labels), **histogram.snapshot()}
+            for (name, labels), histogram in sorted(items, key=lambda item: (item[0][0], str(item[0][1])))
+        ]
+
+    def prometheus_text(self):
+        """All histograms in the Prometheus text exposition format"""
+        with self._lock:
+            items = sorted(self._histograms.items(), key=lambda item: (item[0][0], str(item[0][1])))
+        lines = []
+        for name in dict.fromkeys(name for (name, _), _ in items):
+            lines.append(f"# TYPE {name} histogram")
+            for (metric, labels), histogram in items:
+                if metric != name:
+                    continue
+                with histogram._lock:
+                    counts, count, total = list(histogram.counts), histogram.count, histogram.total_ms
+                label_text = ''.join(f'{key}="{_escape_label(value)}",' for key, value in labels)
+                cumulative = 0
+                for bound, bucket_count in zip(list(histogram.buckets) + ['+Inf'], counts):
+                    cumulative += bucket_count
+                    lines.append(f'{name}_bucket{{{label_text}le="{bound}"}} {cumulative}')
+                label_text = label_text.rstrip(',')
+                lines.append(f'{name}_sum{{{label_text}}} {total:.6f}')
+                lines.append(f'{name}_count{{{label_text}}} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+REGISTRY = MetricsRegistry()
+
+
+# Biểu đồ độ trễ trong một cửa sổ thời gian trượt
+class RollingHistogram:
+    """
+    Latency histogram of the last `window_s` seconds
+
+    The window is split into `slots` sub-histograms; the oldest one is
+    cleared when time moves into it, so old observations age out in steps.
+
+    Args:
+        window_s: Length of the window in seconds
+        slots: Number of sub-histograms the window is split into
+        buckets: Increasing upper bounds in milliseconds
+        clock: Monotonic clock in seconds (replaceable in tests)
+    """
+
+    def __init__(self, window_s=300, slots=10, buckets=STAGE_BUCKETS_MS, clock=time.monotonic):
+        self.window_s = window_s
+        self.buckets = tuple(buckets)
+        self.clock = clock
+        self._slot_s = window_s / slots
+        self._slots = [LatencyHistogram(self.buckets) for _ in range(slots)]
+        self._epochs = [None] * slots
+        self._lock = threading.Lock()
+
+    def observe(self, milliseconds):
+        epoch = int(self.clock() // self._slot_s)
+        slot = epoch % len(self._slots)
+        if self._epochs[slot] != epoch:
+            with self._lock:
+                if self._epochs[slot] != epoch:
+                    self._slots[slot] = LatencyHistogram(self.buckets)
+                    self._epochs[slot] = epoch
+        self._slots[slot].observe(milliseconds)
+
+    def merged(self):
+        """One LatencyHistogram with the observations still inside the window"""
+        epoch = int(self.clock() // self._slot_s)
+        merged = LatencyHistogram(self.buckets)
+        with self._lock:
+            live = [h for h, e in zip(self._slots, self._epochs) if e is not None and epoch - e < len(self._slots)]
+        for histogram in live:
+            merged.merge(histogram)
+        return merged
+
+    def snapshot(self):
+        return {'window_s': self.window_s, **self.merged().snapshot()}
+
+
+# Bộ đo thời gian một giai đoạn (dùng trong khối with)
+class _StageTimer:
+    __slots__ = ('tracer', 'name', 'start')
+
+    def __init__(self, tracer, name):
+        self.tracer = tracer
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.tracer.observe(self.name, (time.perf_counter() - self.start) * 1000)
+        return False
+
+
+_NO_STAGE = nullcontext()
+
+
+# Theo dõi thời gian từng giai đoạn của một lượt đề xuất
+class Tracer:
+    """
+    Per-stage timers for the recommendation hot path
+
+    Args:
+        enabled: Record stages (when False, `stage` returns a shared no-op context)
+        window_s: Length of the rolling window behind `snapshot`
+        log_interval_s: Log a summary line per stage this often (None: never)
+        logger: Logger for the summary lines
+    """
+
+    def __init__(self, enabled=False, window_s=300, log_interval_s=None, logger=None):
+        self.enabled = enabled
+        self.window_s = window_s
+        self.log_interval_s = log_interval_s
+        self.logger = logger or logging.getLogger('recommender.trace')
+        self.registry = MetricsRegistry(STAGE_BUCKETS_MS)
+        self._rolling = {}
+        self._lock = threading.Lock()
+        self._last_log = time.monotonic()
+
+    def enable(self, log_interval_s=None):
+        self.enabled = True
+        if log_interval_s is not None:
+            self.log_interval_s = log_interval_s
+
+    def disable(self):
+        self.enabled = False
+
+    def stage(self, name):
+        """Context manager timing the body of a `with` block as one stage"""
+        if not self.enabled:
+            return _NO_STAGE
+        return _StageTimer(self, name)
+
+    def traced(self, name=None):
+        """Decorator timing every call of a function as one stage"""
+        def decorate(fn):
+            stage_name = name or fn.__qualname__
+
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return fn(*args, **kwargs)
+                with _StageTimer(self, stage_name):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    def observe(self, name, milliseconds):
+        """Record one stage duration"""
+        self.registry.observe(STAGE_METRIC, milliseconds, stage=name)
+        rolling = self._rolling.get(name)
+        if rolling is None:
+            with self._lock:
+                rolling = self._rolling.setdefault(name, RollingHistogram(self.window_s))
+        rolling.observe(milliseconds)
+        if self.log_interval_s is not None and time.monotonic() - self._last_log >= self.log_interval_s:
+            self._last_log = time.monotonic()
+            self.log_summary()
+
+    def snapshot(self):
+        """Rolling-window statistics per stage, sorted by stage name"""
+        with self._lock:
+            items = sorted(self._rolling.items())
+        return [{'stage': name, **rolling.snapshot()} for name, rolling in items]
+
+    def log_summary(self):
+        for row in self.snapshot():
+            if row['count']:
+                self.logger.info(
+                    "stage=%s count=%d mean_ms=%.3f p50_ms=%.3f p95_ms=%.3f p99_ms=%.3f window_s=%d",
+                    row['stage'], row['count'], row['mean_ms'], row['p50_ms'], row['p95_ms'], row['p99_ms'], row['window_s'],
+                )
+
+    def reset(self):
+        # observe reads self.registry once per call, so it records into either the old or the new registry
+        with self._lock:
+            self._rolling = {}
+            self.registry = MetricsRegistry(STAGE_BUCKETS_MS)
+
+
+def _env_float(name):
+    value = os.environ.get(name)
+    return float(value) if value else None
+
+
+TRACER = Tracer(
+    enabled=os.environ.get('RECOMMENDER_TRACE', '0').lower() in ('1', 'true', 'yes'),
+    log_interval_s=_env_float('RECOMMENDER_TRACE_LOG_INTERVAL'),
+)
@@ -0,0 +1,561 @@
+"""
+Headless HTTP/JSON recommendation service
+
+Loads the models once per process and serves the recommenders of utils.py
+over a small JSON API (standard library only), so they can be called by other
+services, load-tested, and used by Streamlit.py as a client:
+
+    python service.py --port 8000 --workers 4
+
+    GET /health
+    GET /recommend/product?product_id=123&nums=4[&approximate=1][&same_category=1][&engine=cosine]
+    GET /recommend/query?q=áo+thun+nam&nums=4[&approximate=1][&engine=cosine]
+    GET /recommend/user?user_id=42&nums=4
+    GET /recommend/hybrid?user_id=42[&product_id=123|&q=áo+thun][&nums=4][&candidates=300][&content_weight=0.5&rating_weight=0.5]
+    GET /metrics[?format=prometheus]
+
+With --batch-size N (> 1) concurrent exact text searches and user
+recommendations are micro-batched (batching.py): requests arriving within
+--batch-wait-ms are scored as one matrix product.
+
+Product and text searches run on the Gensim LSI engine by default;
+engine=cosine uses the sklearn TF-IDF cosine engine instead when it was
+exported (build_artifacts.py export-cosine). Hybrid requests take the LSI
+candidates of a seed product or query and re-rank them with the user's SVD
+factors (utils.get_recommendations_hybrid).
+
+With --workers N the listening socket and the models are set up once, then N
+worker processes are forked. Memory-mapped models (build_artifacts.py
+export-mmap) are shared through the page cache, everything else copy-on-write.
+Latency histograms are kept per worker process; /metrics reports the worker
+that answered. With --trace (or RECOMMENDER_TRACE=1) the stages of every
+recommendation are timed as well (metrics.TRACER): /metrics adds the rolling
+per-stage percentiles, format=prometheus returns all histograms in the
+Prometheus text format, and --trace-log-interval logs a summary line per
+stage every N seconds.
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import pickle
+import signal
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+import pandas as pd
+import requests
+
+from artifacts import (
+    CORE_CATALOG_COLUMNS, ColumnarCatalog, has_columnar_catalog, has_cosine_models, has_mmap_models, load_cosine_models,
+    load_mmap_models,
+)
+from batching import BackgroundLoop, BatchedRecommender
+from indexes import (
+    IVFIndex, PartitionedIndex, QuantizedIndex, ShardedIndex,
+    has_ivf_index, has_partitioned_index, has_quantized_index, has_sharded_index,
+)
+from metrics import REGISTRY, TRACER
+from utils import (
+    CatalogIndex, NeighborTable, QueryResultCache, SVDScorer,
+    HYBRID_CANDIDATES, HYBRID_CONTENT_WEIGHT, HYBRID_RATING_WEIGHT,
+    get_recommendations_cosine, get_recommendations_gensim, get_recommendations_hybrid, get_recommendations_surprise,
+)
+
+PROCESSED_DATA_PATH = 'data/processed_data.pkl'
+SIMILARITY_INDEX_PATH = 'models/similarity_index.pkl'
+NEIGHBOR_TABLE_PATH = 'models/neighbors.npz'
+ENGINES = ('gensim', 'cosine')
+
+
+def load_pickle(path):
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+# Nạp mô hình (ưu tiên định dạng ánh xạ bộ nhớ)
+def load_models():
+    """
+    Load the content and collaborative models
+
+    Prefers the memory-mapped export (near-instant cold start, pages shared
+    between worker processes), and a sharded or int8 index over the single
+    dense similarity matrix when one was built.
+
+    Returns:
+        Tuple (dictionary, tfidf, lsi_model, similarity_index, svd_scorer)
+    """
+    if has_mmap_models():
+        dictionary, tfidf, lsi_model, similarity_index, surprise = load_mmap_models()
+    else:
+        dictionary = load_pickle('models/dictionary.pkl')
+        tfidf = load_pickle('models/tfidf_model.pkl')
+        lsi_model = load_pickle('models/lsi_model.pkl')
+        similarity_index = None
+        if not (has_sharded_index() or has_quantized_index()):
+            similarity_index = load_pickle(SIMILARITY_INDEX_PATH)
+        surprise = load_pickle('models/surprise_svd_model.pkl')
+    if has_sharded_index():
+        similarity_index = ShardedIndex.load()
+    elif has_quantized_index():
+        similarity_index = QuantizedIndex.load()
+    scorer = surprise if isinstance(surprise, SVDScorer) else SVDScorer.from_algo(surprise)
+    return dictionary, tfidf, lsi_model, similarity_index, scorer
+
+
+# Nạp danh mục sản phẩm (ưu tiên định dạng cột)
+def load_catalog():
+    if has_columnar_catalog():
+        store = ColumnarCatalog()
+        return CatalogIndex(store.frame(CORE_CATALOG_COLUMNS), store=store, deleted=store.tombstones)
+    return CatalogIndex(load_pickle(PROCESSED_DATA_PATH)['df'])
+
+
+def to_records(df):
+    """DataFrame rows as JSON-safe dicts (NaN becomes null, NumPy scalars become Python ones)"""
+    records = []
+    for record in df.to_dict('records'):
+        for key, value in record.items():
+            if hasattr(value, 'item'):
+                value = value.item()
+            if isinstance(value, float) and math.isnan(value):
+                value = None
+            record[key] = value
+        records.append(record)
+    return records
+
+
+def check_engine(engine):
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine {engine!r} (expected one of {', '.join(ENGINES)})")
+    return engine
+
+
+def parse_product_id(value):
+    """Query-string product ids are numeric in the catalog; keep other ids as strings"""
+    return int(value) if value.lstrip('-').isdigit() else value
+
+
+# Dịch vụ đề xuất: giữ mô hình trong bộ nhớ, dùng chung cho API và Streamlit
+class RecommendationService:
+    """
+    In-process recommendation service around the utils.py recommenders
+
+    Args:
+        dictionary, tfidf, lsi_model, similarity_index: Content-based models
+        svd_scorer: SVDScorer for user recommendations
+        catalog: CatalogIndex of the products
+        neighbors: Fresh NeighborTable (optional)
+        ann_index: Approximate index for approximate=True searches (optional)
+        partitions: PartitionedIndex for same-category searches (optional)
+        query_cache: QueryResultCache (optional)
+        vectorizer, tfidf_matrix: Cosine engine (optional, see artifacts.load_cosine_models)
+        batch_size, batch_wait_ms: Micro-batching of text and user requests (off when batch_size <= 1)
+    """
+
+    def __init__(self, dictionary, tfidf, lsi_model, similarity_index, svd_scorer, catalog,
+                 neighbors=None, ann_index=None, partitions=None, query_cache=None, vectorizer=None, tfidf_matrix=None,
+                 batch_size=1, batch_wait_ms=2.0):
+        self.dictionary = dictionary
+        self.tfidf = tfidf
+        self.lsi_model = lsi_model
+        self.similarity_index = similarity_index
+        self.svd_scorer = svd_scorer
+        self.catalog = catalog
+        self.neighbors = neighbors
+        self.ann_index = ann_index
+        self.partitions = partitions
+        self.query_cache = query_cache
+        self.vectorizer = vectorizer
+        self.tfidf_matrix = tfidf_matrix
+        self.batch_size = batch_size
+        self.batch_wait_ms = batch_wait_ms
+        self._batched = None
+        self._batch_lock = threading.Lock()
+
+    @classmethod
+    def load(cls, **kwargs):
+        """Load every model and optional index found on disk"""
+        dictionary, tfidf, lsi_model, similarity_index, scorer = load_models()
+        catalog = load_catalog()
+        neighbors = None
+        if os.path.exists(NEIGHBOR_TABLE_PATH):
+            neighbors = NeighborTable.load(NEIGHBOR_TABLE_PATH)
+            if not neighbors.is_fresh(catalog, SIMILARITY_INDEX_PATH):
+                neighbors = None
+        vectorizer, tfidf_matrix = load_cosine_models() if has_cosine_models() else (None, None)
+        return cls(
+            dictionary, tfidf, lsi_model, similarity_index, scorer, catalog,
+            neighbors=neighbors,
+            ann_index=IVFIndex.load() if has_ivf_index() else None,
+            partitions=PartitionedIndex.load() if has_partitioned_index() else None,
+            query_cache=QueryResultCache(max_entries=4096, ttl=3600),
+            vectorizer=vectorizer,
+            tfidf_matrix=tfidf_matrix,
+            **kwargs,
+        )
+
+    def info(self):
+        return {
+            'products': len(self.catalog),
+            'approximate': self.ann_index is not None,
+            'neighbors': self.neighbors is not None,
+            'partitions': self.partitions is not None,
+            'engines': [engine for engine in ENGINES if engine != 'cosine' or self.tfidf_matrix is not None],
+            'batch_size': self.batch_size,
+        }
+
+    def _batcher(self):
+        """Micro-batcher and its event loop thread, started on first use (after any fork)"""
+        if self.batch_size <= 1:
+            return None
+        with self._batch_lock:
+            if self._batched is None:
+                self._batched = (BackgroundLoop(), BatchedRecommender(self, self.batch_size, self.batch_wait_ms))
+        return self._batched
+
+    def _gensim(self, **kwargs):
+        return get_recommendations_gensim(
+            similarity_index=self.similarity_index,
+            df=self.catalog.df,
+            tfidf=self.tfidf,
+            lsi_model=self.lsi_model,
+            dictionary=self.dictionary,
+            catalog=self.catalog,
+            cache=self.query_cache,
+            ann_index=self.ann_index,
+            **kwargs,
+        )
+
+    def _cosine(self, **kwargs):
+        if self.tfidf_matrix is None:
+            raise ValueError("The cosine engine is not available (run build_artifacts.py export-cosine)")
+        return get_recommendations_cosine(
+            tfidf_matrix=self.tfidf_matrix,
+            df=self.catalog.df,
+            vectorizer=self.vectorizer,
+            catalog=self.catalog,
+            cache=self.query_cache,
+            **kwargs,
+        )
+
+    def recommend_product(self, product_id, nums=4, approximate=False, same_category=False, engine='gensim'):
+        """Products similar to a product (KeyError if it is not in the catalog)"""
+        check_engine(engine)
+        sub_categories = [self.catalog.get(product_id, 'sub_category')] if same_category else None
+        if engine == 'cosine':
+            return self._cosine(product_id=product_id, nums=nums, sub_categories=sub_categories)
+        return self._gensim(
+            product_id=product_id,
+            nums=nums,
+            neighbors=self.neighbors,
+            approximate=approximate,
+            sub_categories=sub_categories,
+            partitions=self.partitions,
+        )
+
+    def recommend_query(self, query, nums=4, approximate=False, engine='gensim'):
+        """Products matching a text query"""
+        if check_engine(engine) == 'cosine':
+            return self._cosine(query=query, nums=nums)
+        batched = None if approximate else self._batcher()
+        if batched is not None:
+            loop, recommender = batched
+            return loop.run(recommender.recommend_query(query, nums))
+        return self._gensim(query=query, nums=nums, approximate=approximate)
+
+    def recommend_user(self, user_id, nums=4):
+        """Products with the highest predicted rating for a user"""
+        batched = self._batcher()
+        if batched is not None:
+            loop, recommender = batched
+            return loop.run(recommender.recommend_user(user_id, nums))
+        return get_recommendations_surprise(
+            df_productid=self.catalog.live_frame()[['product_id']],
+            full_product_df=self.catalog.df,
+            surprise=self.svd_scorer,
+            user_id=user_id,
+            nums=nums,
+            catalog=self.catalog,
+        )
+
+    def recommend_hybrid(self, user_id, product_id=None, query=None, nums=4, candidates=HYBRID_CANDIDATES,
+                         content_weight=HYBRID_CONTENT_WEIGHT, rating_weight=HYBRID_RATING_WEIGHT, approximate=False):
+        """LSI candidates of a seed product or query re-ranked for a user (plain SVD ranking without a seed)"""
+        if product_id is not None and query is not None:
+            raise ValueError("Give either a seed product or a query, not both")
+        return get_recommendations_hybrid(
+            similarity_index=self.similarity_index,
+            df=self.catalog.df,
+            tfidf=self.tfidf,
+            lsi_model=self.lsi_model,
+            dictionary=self.dictionary,
+            surprise=self.svd_scorer,
+            user_id=user_id,
+            query=query,
+            product_id=product_id,
+            nums=nums,
+            candidates=candidates,
+            content_weight=content_weight,
+            rating_weight=rating_weight,
+            catalog=self.catalog,
+            cache=self.query_cache,
+            ann_index=self.ann_index,
+            approximate=approximate,
+        )
+
+
+# Trình xử lý HTTP: định tuyến, chuyển tham số và đo độ trễ
+class RecommendationHandler(BaseHTTPRequestHandler):
+    """JSON endpoints of a RecommendationService (set on the server as `server.service`)"""
+
+    server_version = 'RecommendationService/1.0'
+
+    def log_message(self, format, *args):
+        # Per-request logging is replaced by the latency histograms
+        pass
+
+    def _send_json(self, status, payload):
+        # Plain strings are text exports (Prometheus), everything else is JSON
+        if isinstance(payload, str):
+            body, content_type = payload.encode('utf-8'), 'text/plain; version=0.0.4; charset=utf-8'
+        else:
+            body, content_type = json.dumps(payload, ensure_ascii=False).encode('utf-8'), 'application/json; charset=utf-8'
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        start = time.perf_counter()
+        url = urlparse(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        route = ROUTES.get(url.path)
+        if route is None:
+            status, payload = 404, {'error': f"Unknown endpoint {url.path}"}
+        else:
+            try:
+                status, payload = 200, route(self.server.service, params)
+            except KeyError as e:
+                status, payload = 404, {'error': str(e).strip('"\'')}
+            except ValueError as e:
+                status, payload = 400, {'error': str(e)}
+            except Exception as e:
+                status, payload = 500, {'error': f"{type(e).__name__}: {e}"}
+        took_ms = (time.perf_counter() - start) * 1000
+        if route is not None and status == 200 and isinstance(payload, dict) and 'recommendations' in payload:
+            payload['took_ms'] = round(took_ms, 3)
+        self._send_json(status, payload)
+        REGISTRY.observe('http_request_duration_ms', took_ms, endpoint=url.path if route else 'unknown', status=status)
+
+
+def _flag(params, name):
+    return params.get(name, '0').lower() in ('1', 'true', 'yes')
+
+
+def _nums(params):
+    nums = int(params.get('nums', 4))
+    if not 1 <= nums <= 100:
+        raise ValueError("nums must be between 1 and 100")
+    return nums
+
+
+def _required(params, name):
+    if not params.get(name):
+        raise ValueError(f"Missing parameter: {name}")
+    return params[name]
+
+
+def handle_health(service, params):
+    return {'status': 'ok', 'pid': os.getpid(), **service.info()}
+
+
+def handle_product(service, params):
+    result = service.recommend_product(
+        parse_product_id(_required(params, 'product_id')),
+        nums=_nums(params),
+        approximate=_flag(params, 'approximate'),
+        same_category=_flag(params, 'same_category'),
+        engine=params.get('engine', 'gensim'),
+    )
+    return {'recommendations': to_records(result)}
+
+
+def handle_query(service, params):
+    result = service.recommend_query(
+        _required(params, 'q'), nums=_nums(params), approximate=_flag(params, 'approximate'), engine=params.get('engine', 'gensim'),
+    )
+    return {'recommendations': to_records(result)}
+
+
+def handle_user(service, params):
+    user_id = _required(params, 'user_id')
+    if not user_id.isdigit():
+        raise ValueError("user_id must be a number")
+    return {'recommendations': to_records(service.recommend_user(int(user_id), nums=_nums(params)))}
+
+
+def handle_hybrid(service, params):
+    user_id = _required(params, 'user_id')
+    if not user_id.isdigit():
+        raise ValueError("user_id must be a number")
+    candidates = int(params.get('candidates', HYBRID_CANDIDATES))
+    if not 1 <= candidates <= 5000:
+        raise ValueError("candidates must be between 1 and 5000")
+    result = service.recommend_hybrid(
+        int(user_id),
+        product_id=parse_product_id(params['product_id']) if params.get('product_id') else None,
+        query=params.get('q') or None,
+        nums=_nums(params),
+        candidates=candidates,
+        content_weight=float(params.get('content_weight', HYBRID_CONTENT_WEIGHT)),
+        rating_weight=float(params.get('rating_weight', HYBRID_RATING_WEIGHT)),
+        approximate=_flag(params, 'approximate'),
+    )
+    return {'recommendations': to_records(result)}
+
+
+def handle_metrics(service, params):
+    if params.get('format') == 'prometheus':
+        return REGISTRY.prometheus_text() + TRACER.registry.prometheus_text()
+    return {'pid': os.getpid(), 'histograms': REGISTRY.snapshot(), 'tracing': TRACER.enabled, 'stages': TRACER.snapshot()}
+
+
+ROUTES = {
+    '/health': handle_health,
+    '/recommend/product': handle_product,
+    '/recommend/query': handle_query,
+    '/recommend/user': handle_user,
+    '/recommend/hybrid': handle_hybrid,
+    '/metrics': handle_metrics,
+}
+
+
+def make_server(service, host='0.0.0.0', port=8000):
+    server = ThreadingHTTPServer((host, port), RecommendationHandler)
+    server.daemon_threads = True
+    server.service = service
+    return server
+
+
+# Chế độ pre-fork: các tiến trình con dùng chung socket và mô hình đã nạp
+def serve_prefork(server, workers):
+    """Fork `workers` processes that all accept on the already bound socket"""
+    children = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            try:
+                server.serve_forever()
+            finally:
+                os._exit(0)
+        children.append(pid)
+
+    def stop(signum, frame):
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for pid in children:
+        os.waitpid(pid, 0)
+    server.server_close()
+
+
+# Client HTTP có cùng giao diện với RecommendationService (dùng trong Streamlit)
+class ServiceClient:
+    """
+    Calls a running service.py and returns DataFrames like RecommendationService
+
+    Args:
+        base_url: Service URL, e.g. http://localhost:8000
+        timeout: (connect, read) timeout in seconds
+    """
+
+    def __init__(self, base_url, timeout=(3.05, 30)):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+        self._info = None
+
+    def _get(self, path, **params):
+        params = {key: value for key, value in params.items() if value is not None}
+        response = self.session.get(f"{self.base_url}{path}?{urlencode(params)}", timeout=self.timeout)
+        payload = response.json()
+        if response.status_code == 404:
+            raise KeyError(payload.get('error'))
+        if response.status_code == 400:
+            raise ValueError(payload.get('error'))
+        if response.status_code != 200:
+            raise RuntimeError(payload.get('error'))
+        return payload
+
+    def info(self):
+        # The capabilities of the service do not change while it runs
+        if self._info is None:
+            self._info = self._get('/health')
+        return self._info
+
+    def _frame(self, payload):
+        return pd.DataFrame(payload['recommendations'])
+
+    def recommend_product(self, product_id, nums=4, approximate=False, same_category=False, engine='gensim'):
+        return self._frame(self._get(
+            '/recommend/product', product_id=product_id, nums=nums,
+            approximate=int(approximate), same_category=int(same_category), engine=engine,
+        ))
+
+    def recommend_query(self, query, nums=4, approximate=False, engine='gensim'):
+        return self._frame(self._get('/recommend/query', q=query, nums=nums, approximate=int(approximate), engine=engine))
+
+    def recommend_user(self, user_id, nums=4):
+        return self._frame(self._get('/recommend/user', user_id=user_id, nums=nums))
+
+    def recommend_hybrid(self, user_id, product_id=None, query=None, nums=4, candidates=HYBRID_CANDIDATES,
+                         content_weight=HYBRID_CONTENT_WEIGHT, rating_weight=HYBRID_RATING_WEIGHT, approximate=False):
+        return self._frame(self._get(
+            '/recommend/hybrid', user_id=user_id, product_id=product_id, q=query, nums=nums, candidates=candidates,
+            content_weight=content_weight, rating_weight=rating_weight, approximate=int(approximate),
+        ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', 8000)))
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('WEB_CONCURRENCY', 1)))
+    parser.add_argument('--batch-size', type=int, default=1, help='Micro-batch size for text and user requests (1 = off)')
+    parser.add_argument('--batch-wait-ms', type=float, default=2.0, help='Longest wait for a micro-batch to fill')
+    parser.add_argument('--trace', action='store_true', help='Time every stage of the recommenders (see /metrics)')
+    parser.add_argument('--trace-log-interval', type=float, default=None, help='Log a per-stage latency summary every N seconds')
+    args = parser.parse_args()
+
+    if args.trace or args.trace_log_interval:
+        logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(message)s')
+        TRACER.enable(log_interval_s=args.trace_log_interval)
+
+    service = RecommendationService.load(batch_size=args.batch_size, batch_wait_ms=args.batch_wait_ms)
+    server = make_server(service, args.host, args.port)
+    print(f"Serving {len(service.catalog)} products on {args.host}:{args.port} with {args.workers} worker(s)", flush=True)
+    if args.workers > 1:
+        serve_prefork(server, args.workers)
+    else:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+# The modules live flat at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic_catalog import make_catalog  # noqa: E402
+
+NUM_TOPICS = 16
+
+
+def train_gensim(documents, num_topics=NUM_TOPICS):
+    """Dictionary, TF-IDF, LSI and MatrixSimilarity as in ContentBased.ipynb"""
+    from gensim import corpora, models, similarities
+    dictionary = corpora.Dictionary(documents)
+    corpus = [dictionary.doc2bow(tokens) for tokens in documents]
+    tfidf = models.TfidfModel(corpus)
+    lsi_model = models.LsiModel(tfidf[corpus], id2word=dictionary, num_topics=num_topics, random_seed=0)
+    similarity_index = similarities.MatrixSimilarity(lsi_model[tfidf[corpus]], num_features=num_topics)
+    return dictionary, tfidf, lsi_model, similarity_index
+
+
+def random_scorer(product_ids, n_users=20, n_factors=8, seed=0):
+    """utils.SVDScorer with small random factors for users 0..n_users-1"""
+    from utils import SVDScorer
+    rng = np.random.default_rng(seed)
+    return SVDScorer(
+        pu=rng.normal(0, 0.1, (n_users, n_factors)), qi=rng.normal(0, 0.1, (len(product_ids), n_factors)),
+        bu=np.zeros(n_users), bi=rng.normal(0, 0.3, len(product_ids)), global_mean=4.0, rating_scale=(1, 5),
+        raw_user_ids=list(range(n_users)), raw_item_ids=list(product_ids),
+    )
+
+
+@pytest.fixture(scope='session')
+def catalog_df():
+    """Small synthetic catalog with the columns of data/processed_data.pkl"""
+    return make_catalog(400, doc_length=30, seed=0)
+
+
+@pytest.fixture(scope='session')
+def gensim_models(catalog_df):
+    """(dictionary, tfidf, lsi_model, similarity_index) trained on catalog_df"""
+    return train_gensim(catalog_df['content_processed'].tolist())
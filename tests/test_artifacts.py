@@ -0,0 +1,21 @@
+import pytest
+
+import artifacts
+from artifacts import ColumnarCatalog, save_columnar_catalog
+
+
+def test_interrupted_catalog_export_keeps_the_served_manifest(catalog_df, tmp_path, monkeypatch):
+    save_columnar_catalog(catalog_df.iloc[:100], out_dir=str(tmp_path))
+
+    def crash_mid_write(obj, f, **kwargs):
+        f.write('{"version": 1, "num_ro')
+        raise OSError("disk full")
+
+    # Re-exporting into the served directory dies while writing the manifest
+    monkeypatch.setattr(artifacts.json, 'dump', crash_mid_write)
+    with pytest.raises(OSError):
+        save_columnar_catalog(catalog_df, out_dir=str(tmp_path))
+
+    store = ColumnarCatalog(str(tmp_path))
+    assert len(store) == 100
+    assert list(store.column('product_id')) == list(catalog_df['product_id'].iloc[:100])
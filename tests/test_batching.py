@@ -0,0 +1,107 @@
+import numpy as np
+import pytest
+
+from artifacts import MmapSimilarity
+from batching import QueryBatchScorer
+from indexes import QuantizedIndex, ShardedIndex
+from utils import CatalogIndex, QueryResultCache, get_recommendations_gensim, search_gensim_batch, warm_query_cache
+
+
+INDEX_TYPES = {
+    'matrix_similarity': lambda similarity_index: similarity_index,
+    'mmap': lambda similarity_index: MmapSimilarity(similarity_index.index),
+    'sharded': lambda similarity_index: ShardedIndex.build(similarity_index.index, shard_size=64),
+    'float32': lambda similarity_index: QuantizedIndex.build(similarity_index.index, dtype='float32'),
+    'int8': lambda similarity_index: QuantizedIndex.build(similarity_index.index, dtype='int8', rerank=400),
+}
+
+
+def queries_for(catalog_df):
+    # Product names are made of catalog tokens, so every query has LSI topics
+    names = catalog_df['product_name'].tolist()
+    return [(names[3], 8), (names[50], 4), (names[200], 6)]
+
+
+@pytest.fixture(params=sorted(INDEX_TYPES))
+def index(request, gensim_models):
+    return INDEX_TYPES[request.param](gensim_models[3])
+
+
+def test_batch_matches_single_queries(index, catalog_df, gensim_models, monkeypatch):
+    dictionary, tfidf, lsi_model, _ = gensim_models
+    catalog = CatalogIndex(catalog_df)
+    # Sharding must survive batching: the dense catalog matrix is never built
+    monkeypatch.setattr(ShardedIndex, 'index', property(lambda self: pytest.fail('ShardedIndex.index materialized')))
+
+    items = queries_for(catalog_df)
+    results = QueryBatchScorer(index, tfidf, lsi_model, dictionary, catalog)(items)
+
+    for (query, k), (positions, scores) in zip(items, results):
+        single = get_recommendations_gensim(
+            index, catalog_df, tfidf, lsi_model, dictionary, query=query, nums=k // 2, catalog=catalog, ranking_keys=[],
+        )
+        assert len(positions) == k
+        assert np.all(np.diff(scores) <= 1e-6)
+        assert list(catalog_df['product_id'].to_numpy()[positions[:k // 2]]) == list(single['product_id'])
+        np.testing.assert_allclose(scores[:k // 2], single['similarity_score'], atol=1e-5)
+
+
+def test_tombstoned_rows_are_not_returned(index, catalog_df, gensim_models):
+    dictionary, tfidf, lsi_model, _ = gensim_models
+    items = queries_for(catalog_df)
+    first = QueryBatchScorer(index, tfidf, lsi_model, dictionary, CatalogIndex(catalog_df))(items)
+    deleted = np.zeros(len(catalog_df), dtype=bool)
+    deleted[first[0][0][:3]] = True
+
+    results = QueryBatchScorer(index, tfidf, lsi_model, dictionary, CatalogIndex(catalog_df, deleted=deleted))(items)
+
+    for positions, scores in results:
+        assert not deleted[positions].any()
+        assert np.isfinite(scores).all()
+
+
+@pytest.mark.parametrize('mode', ['queries', 'product_ids'])
+def test_search_batch_matches_the_single_selection(index, catalog_df, gensim_models, mode):
+    dictionary, tfidf, lsi_model, _ = gensim_models
+    catalog = CatalogIndex(catalog_df)
+    if mode == 'queries':
+        items = [query for query, _ in queries_for(catalog_df)] + [catalog_df['product_name'].iloc[321]]
+    else:
+        items = list(catalog_df['product_id'].iloc[[0, 7, 150, 399]])
+
+    indices, scores = search_gensim_batch(index, catalog_df, tfidf, lsi_model, dictionary, nums=12, catalog=catalog, **{mode: items})
+
+    for item, row_indices, row_scores in zip(items, indices, scores):
+        seed = {'query': item} if mode == 'queries' else {'product_id': item}
+        single = get_recommendations_gensim(
+            index, catalog_df, tfidf, lsi_model, dictionary, nums=12, catalog=catalog, ranking_keys=[], **seed,
+        )
+        assert list(catalog_df['product_id'].to_numpy()[row_indices]) == list(single['product_id'])
+        np.testing.assert_allclose(row_scores, single['similarity_score'], atol=1e-5)
+
+
+@pytest.mark.parametrize('mode', ['queries', 'product_ids'])
+def test_search_batch_pads_instead_of_returning_tombstones(index, catalog_df, gensim_models, mode):
+    dictionary, tfidf, lsi_model, _ = gensim_models
+    live = np.array([3, 50, 200, 201, 398])
+    deleted = np.ones(len(catalog_df), dtype=bool)
+    deleted[live] = False
+    catalog = CatalogIndex(catalog_df, deleted=deleted)
+    items = ([query for query, _ in queries_for(catalog_df)] if mode == 'queries'
+             else list(catalog_df['product_id'].iloc[[3, 50]]))
+
+    indices, scores = search_gensim_batch(index, catalog_df, tfidf, lsi_model, dictionary, nums=10, catalog=catalog, **{mode: items})
+
+    found = indices >= 0
+    assert set(indices[found]) <= set(live)
+    assert np.isneginf(scores[~found]).all() and np.isfinite(scores[found]).all()
+    assert (found.sum(axis=1) == (len(live) if mode == 'queries' else len(live) - 1)).all()
+
+    # Warmed entries hold only live products, so a cache hit never serves a tombstone
+    cache = QueryResultCache(max_entries=64, watch_paths=())
+    warm_query_cache(cache, index, catalog_df, tfidf, lsi_model, dictionary, nums=5, catalog=catalog, **{mode: items})
+    for item in items:
+        seed = {'query': item} if mode == 'queries' else {'product_id': item}
+        result = get_recommendations_gensim(index, catalog_df, tfidf, lsi_model, dictionary, nums=5, catalog=catalog, cache=cache, **seed)
+        assert set(result['product_id']) <= set(catalog_df['product_id'].iloc[live])
+    assert cache.hits == len(items)
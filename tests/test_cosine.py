@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.metrics.pairwise import cosine_similarity
+from sklearn.preprocessing import normalize
+
+from artifacts import append_cosine_rows, commit_cosine_rows, export_cosine_models, load_cosine_models
+from utils import sparse_cosine_scores
+
+
+@pytest.fixture(scope='module')
+def cosine_engine(catalog_df):
+    documents = [' '.join(tokens) for tokens in catalog_df['content_processed']]
+    vectorizer = TfidfVectorizer(analyzer='word')
+    return vectorizer, vectorizer.fit_transform(documents), documents
+
+
+def test_scores_match_sklearn_cosine_similarity(cosine_engine):
+    vectorizer, tfidf_matrix, documents = cosine_engine
+    queries = [documents[5], ' '.join(documents[9].split()[:3]), 'từ_lạ không_có', documents[2] + ' ' + documents[3]]
+    vectors = [tfidf_matrix[17], 3.5 * tfidf_matrix[40]] + [vectorizer.transform([query]) for query in queries]
+
+    for vector in vectors:
+        np.testing.assert_allclose(
+            sparse_cosine_scores(tfidf_matrix, vector), cosine_similarity(vector, tfidf_matrix).ravel(), atol=1e-6,
+        )
+
+
+def test_export_load_round_trip(cosine_engine, tmp_path):
+    vectorizer, tfidf_matrix, documents = cosine_engine
+    export_cosine_models(vectorizer, tfidf_matrix, out_dir=str(tmp_path))
+
+    loaded_vectorizer, loaded_matrix = load_cosine_models(str(tmp_path))
+
+    np.testing.assert_allclose(loaded_matrix.toarray(), tfidf_matrix.toarray(), atol=1e-6)
+    queries = documents[:3] + ['từ_lạ không_có', documents[4].upper()]
+    np.testing.assert_allclose(
+        loaded_vectorizer.transform(queries).toarray(), vectorizer.transform(queries).toarray(), atol=1e-6,
+    )
+
+
+def test_append_commit_and_overwrite(cosine_engine, tmp_path):
+    vectorizer, tfidf_matrix, documents = cosine_engine
+    model_dir = str(tmp_path)
+    export_cosine_models(vectorizer, tfidf_matrix, out_dir=model_dir)
+    n_rows = tfidf_matrix.shape[0]
+    new_documents = [documents[1] + ' ' + documents[2], 'từ_lạ', documents[7]]
+
+    # Written but not committed: still invisible
+    assert append_cosine_rows(new_documents, model_dir, at_row=n_rows, commit=False) == n_rows + 3
+    assert load_cosine_models(model_dir)[1].shape[0] == n_rows
+
+    commit_cosine_rows(n_rows + 3, model_dir)
+    _, loaded_matrix = load_cosine_models(model_dir)
+    expected = normalize(vectorizer.transform(new_documents), norm='l2')
+    np.testing.assert_allclose(loaded_matrix[n_rows:].toarray(), expected.toarray(), atol=1e-6)
+    np.testing.assert_allclose(loaded_matrix[:n_rows].toarray(), tfidf_matrix.toarray(), atol=1e-6)
+
+    # Writing from an earlier row drops everything after it
+    assert append_cosine_rows(new_documents[2:], model_dir, at_row=n_rows + 1) == n_rows + 2
+    _, loaded_matrix = load_cosine_models(model_dir)
+    assert loaded_matrix.shape[0] == n_rows + 2
+    np.testing.assert_allclose(loaded_matrix[n_rows:].toarray(), expected[[0, 2]].toarray(), atol=1e-6)
+    scores = sparse_cosine_scores(loaded_matrix, vectorizer.transform([documents[7]]))
+    assert int(np.argmax(scores[n_rows:])) == 1
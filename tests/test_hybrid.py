@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+from conftest import random_scorer
+from indexes import QuantizedIndex
+from utils import CatalogIndex, build_neighbor_table, get_recommendations_hybrid, select_top_k
+
+
+class RecordingIndex:
+    """Exact float32 index that records the k of every top_k call"""
+
+    def __init__(self, vectors):
+        self.inner = QuantizedIndex.build(vectors, dtype='float32', rerank=0)
+        self.calls = []
+
+    def __len__(self):
+        return len(self.inner)
+
+    def top_k(self, lsi_vector, k, exclude=None):
+        self.calls.append(k)
+        return self.inner.top_k(lsi_vector, k, exclude=exclude)
+
+
+@pytest.fixture(scope='module')
+def hybrid_setup(catalog_df, gensim_models):
+    dictionary, tfidf, lsi_model, similarity_index = gensim_models
+    return dictionary, tfidf, lsi_model, similarity_index, random_scorer(catalog_df['product_id']), CatalogIndex(catalog_df)
+
+
+@pytest.mark.parametrize('candidates', [7, 40])
+def test_query_pool_is_exactly_the_candidates(catalog_df, hybrid_setup, candidates):
+    dictionary, tfidf, lsi_model, similarity_index, scorer, catalog = hybrid_setup
+    index = RecordingIndex(similarity_index.index)
+    query = ' '.join(catalog_df['content_processed'].iloc[3][:8])
+
+    result = get_recommendations_hybrid(
+        index, catalog_df, tfidf, lsi_model, dictionary, scorer, user_id=1, query=query,
+        nums=candidates, candidates=candidates, catalog=catalog,
+    )
+
+    assert index.calls == [candidates]
+    # The pool is the `candidates` most similar products, re-ordered by the blended score
+    sims = similarity_index[lsi_model[tfidf[dictionary.doc2bow(query.split())]]]
+    top, _ = select_top_k(sims, candidates)
+    assert set(result['product_id']) == set(catalog_df['product_id'].iloc[top])
+
+
+def test_neighbor_table_answers_a_pool_of_its_own_size(catalog_df, hybrid_setup):
+    dictionary, tfidf, lsi_model, similarity_index, scorer, catalog = hybrid_setup
+    table = build_neighbor_table(similarity_index, catalog_df['product_id'].to_numpy(), k=20)
+    product_id = catalog_df['product_id'].iloc[10]
+
+    # No index to fall back on: the answer has to come from the table
+    result = get_recommendations_hybrid(
+        object(), catalog_df, tfidf, lsi_model, dictionary, scorer, user_id=2, product_id=product_id,
+        nums=20, candidates=20, catalog=catalog, neighbors=table,
+    )
+
+    assert set(result['product_id']) == set(catalog_df['product_id'].iloc[table.neighbors[10]])
+
+
+def test_pool_is_never_smaller_than_nums(catalog_df, hybrid_setup):
+    dictionary, tfidf, lsi_model, similarity_index, scorer, catalog = hybrid_setup
+    result = get_recommendations_hybrid(
+        similarity_index, catalog_df, tfidf, lsi_model, dictionary, scorer, user_id=3,
+        product_id=catalog_df['product_id'].iloc[0], nums=12, candidates=5, catalog=catalog,
+    )
+    assert len(result) == 12
+    assert np.all(np.diff(result['hybrid_score'].to_numpy()) <= 0)
@@ -0,0 +1,146 @@
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+import pytest
+
+from images import ShopeeImageResolver, make_session
+
+PAGE = '<html><head><meta property="og:image" content="{}"></head><body></body></html>'
+
+
+class StubShop(BaseHTTPRequestHandler):
+    """Product pages: /ok/<name> has an og:image, /noimage has none, /slow/<name> answers after 50 ms"""
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append(self.path)
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        try:
+            if self.path.startswith('/slow/'):
+                time.sleep(0.05)
+            if self.path.startswith(('/ok/', '/slow/')):
+                body = PAGE.format('http://img.example/' + self.path.rsplit('/', 1)[-1] + '.jpg').encode()
+                self.send_response(200)
+            elif self.path == '/noimage':
+                body = b'<html><body>no picture here</body></html>'
+                self.send_response(200)
+            else:
+                body = b'not found'
+                self.send_response(404)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def shop():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubShop)
+    server.lock = threading.Lock()
+    server.requests = []
+    server.in_flight = server.max_in_flight = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.url = f'http://127.0.0.1:{server.server_address[1]}'
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_resolver(clock, max_per_host=4):
+    session = make_session()
+    session.trust_env = False  # never route the stub through a proxy from the environment
+    return ShopeeImageResolver(cache_path=':memory:', ttl=100, negative_ttl=10, timeout=(1, 1),
+                               max_per_host=max_per_host, session=session, clock=clock)
+
+
+def test_resolved_url_is_cached_until_the_ttl(shop):
+    clock = Clock()
+    resolver = make_resolver(clock)
+    link = shop.url + '/ok/shirt'
+
+    assert resolver.resolve(link) == 'http://img.example/shirt.jpg'
+    assert resolver.resolve(link) == 'http://img.example/shirt.jpg'
+    assert resolver.lookup(link) == 'http://img.example/shirt.jpg'
+    assert shop.requests == ['/ok/shirt']
+
+    clock.now += 101
+    assert resolver.lookup(link) is None
+    assert resolver.resolve(link) == 'http://img.example/shirt.jpg'
+    assert shop.requests == ['/ok/shirt'] * 2
+
+
+@pytest.mark.parametrize('path', ['/noimage', '/gone'])
+def test_pages_without_an_image_are_cached_for_the_negative_ttl(shop, path):
+    clock = Clock()
+    resolver = make_resolver(clock)
+
+    assert resolver.resolve(shop.url + path) is None
+    assert resolver.cached(shop.url + path) == (True, None)
+    clock.now += 9
+    assert resolver.resolve(shop.url + path) is None
+    assert shop.requests == [path]
+
+    clock.now += 2
+    assert resolver.resolve(shop.url + path) is None
+    assert shop.requests == [path] * 2
+
+
+def test_transport_errors_are_not_cached():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    # Nothing listens on the port any more: the connection is refused
+    link = f'http://127.0.0.1:{port}/ok/shirt'
+    resolver = make_resolver(Clock())
+
+    assert resolver.resolve(link) is None
+    assert resolver.cached(link) == (False, None)
+
+
+def test_requests_per_host_are_capped(shop):
+    resolver = make_resolver(Clock(), max_per_host=2)
+    links = [f'{shop.url}/slow/{i}' for i in range(8)]
+
+    resolved = resolver.resolve_many(links + links, max_workers=8)
+
+    assert resolved == {link: f'http://img.example/{i}.jpg' for i, link in enumerate(links)}
+    assert sorted(shop.requests) == sorted(f'/slow/{i}' for i in range(8))
+    assert shop.max_in_flight <= 2
+
+
+def test_resolve_catalog_fills_only_missing_images(shop):
+    resolver = make_resolver(Clock())
+    df = pd.DataFrame({
+        'product_id': [1, 2, 3, 4],
+        'link': [shop.url + '/ok/a', shop.url + '/noimage', shop.url + '/ok/c', shop.url + '/ok/a'],
+        'image': [None, None, 'http://img.example/kept.jpg', ''],
+    })
+    original = df.copy()
+
+    result = resolver.resolve_catalog(df, max_workers=4)
+
+    assert result['image'].iloc[[0, 2, 3]].tolist() == [
+        'http://img.example/a.jpg', 'http://img.example/kept.jpg', 'http://img.example/a.jpg',
+    ]
+    assert pd.isna(result['image'].iloc[1])
+    assert sorted(shop.requests) == ['/noimage', '/ok/a']
+    pd.testing.assert_frame_equal(df, original)
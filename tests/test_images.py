@@ -0,0 +1,83 @@
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from PIL import Image
+
+from images import ImageCache, ImageFetcher
+
+
+def jpeg_bytes(color='red'):
+    buffer = BytesIO()
+    Image.new('RGB', (8, 8), color).save(buffer, format='JPEG')
+    return buffer.getvalue()
+
+
+def make_fetcher(tmp_path, download):
+    fetcher = ImageFetcher(cache=ImageCache(cache_dir=str(tmp_path)), max_workers=4)
+    fetcher._download_thumbnail = download
+    return fetcher
+
+
+def test_corrupt_cache_entry_is_refetched(tmp_path):
+    calls = []
+    fetcher = make_fetcher(tmp_path, lambda url: calls.append(url) or jpeg_bytes())
+    fetcher.cache.put('http://img/a.jpg', b'not an image')
+
+    img = fetcher.fetch('http://img/a.jpg')
+
+    assert img is not None and img.size == (8, 8)
+    assert calls == ['http://img/a.jpg']
+    assert fetcher.cache.get('http://img/a.jpg') == jpeg_bytes()
+
+
+def test_corrupt_download_is_a_failure(tmp_path):
+    fetcher = make_fetcher(tmp_path, lambda url: b'not an image')
+
+    assert fetcher.fetch_many(['http://img/b.jpg'] * 16) == [None] * 16
+    assert fetcher.cache.get('http://img/b.jpg') is None
+
+
+def test_failures_from_worker_threads(tmp_path):
+    fetcher = make_fetcher(tmp_path, lambda url: None)
+    urls = [f'http://img/{i}.jpg' for i in range(200)]
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(fetcher.fetch_many, [urls] * 8))
+
+    assert set(fetcher._failures) == set(urls)
+
+
+class StubResponse:
+    def __init__(self, content, status_code=200):
+        self.content = content
+        self.status_code = status_code
+
+
+class StubSession:
+    def __init__(self, content):
+        self.content = content
+
+    def get(self, url, timeout=None):
+        return StubResponse(self.content)
+
+
+def test_cmyk_download_becomes_a_jpeg_thumbnail(tmp_path):
+    buffer = BytesIO()
+    Image.new('CMYK', (600, 300), (0, 255, 255, 0)).save(buffer, format='JPEG')
+    fetcher = ImageFetcher(cache=ImageCache(cache_dir=str(tmp_path)), max_workers=1)
+    fetcher.session = StubSession(buffer.getvalue())
+
+    img = fetcher.fetch('http://img/cmyk.jpg')
+
+    assert img is not None and img.format == 'JPEG' and img.mode == 'RGB'
+    assert max(img.size) == 400
+    assert 'http://img/cmyk.jpg' not in fetcher._failures
+
+
+def test_rewriting_a_url_keeps_the_disk_total(tmp_path):
+    cache = ImageCache(cache_dir=str(tmp_path))
+    for color in ('red', 'green', 'blue'):
+        cache.put('http://img/a.jpg', jpeg_bytes(color))
+    cache.put('http://img/b.jpg', b'x' * 100)
+
+    assert cache._disk_bytes == sum(entry.stat().st_size for entry in tmp_path.iterdir())
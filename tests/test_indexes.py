@@ -0,0 +1,23 @@
+import numpy as np
+
+from indexes import PartitionedIndex
+from utils import CatalogIndex, get_recommendations_gensim
+
+
+def test_repeated_sub_category_is_scored_once(catalog_df, gensim_models):
+    dictionary, tfidf, lsi_model, similarity_index = gensim_models
+    catalog = CatalogIndex(catalog_df)
+    partitions = PartitionedIndex.build(similarity_index.index, catalog_df['sub_category'].to_numpy())
+    sub_category = catalog_df['sub_category'].iloc[0]
+    product_id = catalog_df['product_id'].iloc[0]
+
+    def recommend(sub_categories, partitions=None):
+        return get_recommendations_gensim(
+            similarity_index, catalog_df, tfidf, lsi_model, dictionary, product_id=product_id, nums=8,
+            catalog=catalog, sub_categories=sub_categories, partitions=partitions,
+        )
+
+    repeated = recommend([sub_category, sub_category], partitions)
+    assert repeated['product_id'].is_unique
+    assert np.array_equal(repeated['product_id'], recommend([sub_category], partitions)['product_id'])
+    assert np.array_equal(repeated['product_id'], recommend([sub_category, sub_category])['product_id'])
@@ -0,0 +1,126 @@
+import numpy as np
+import pytest
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+import ingest as ingest_module
+from artifacts import (
+    CATALOG_DIR, MMAP_MODELS_DIR, ColumnarCatalog, export_cosine_models, export_mmap_models, load_cosine_models,
+    load_mmap_models, save_columnar_catalog,
+)
+from benchmarks.synthetic_catalog import make_catalog
+from conftest import random_scorer, train_gensim
+from ingest import fold_in, ingest
+from service import RecommendationService
+
+N_PRODUCTS = 300
+
+
+@pytest.fixture
+def served_tree(tmp_path, monkeypatch):
+    """Memory-mapped models, columnar catalog and cosine engine of a synthetic catalog, in a scratch cwd"""
+    monkeypatch.chdir(tmp_path)
+    df = make_catalog(N_PRODUCTS, doc_length=30, seed=1)
+    dictionary, tfidf, lsi_model, similarity_index = train_gensim(df['content_processed'].tolist())
+    export_mmap_models(dictionary, tfidf, lsi_model, similarity_index, random_scorer(df['product_id']))
+    save_columnar_catalog(df)
+    vectorizer = TfidfVectorizer(analyzer='word')
+    export_cosine_models(vectorizer, vectorizer.fit_transform([' '.join(tokens) for tokens in df['content_processed']]))
+    return df
+
+
+def upserts_from(df, rows, new_ids):
+    """Products with the content of `rows`, under new ids (or the same ids for updates)"""
+    products = df.iloc[rows].copy()
+    products['product_id'] = new_ids
+    products['content_processed'] = [tokens[::-1][:20] for tokens in products['content_processed']]
+    return products
+
+
+def search_everything(service, df):
+    """Product ids returned by product, text, user and cosine searches over the whole catalog"""
+    found = set()
+    for product_id in service.catalog.live_frame()['product_id'].iloc[::7]:
+        found |= set(service.recommend_product(product_id, nums=10)['product_id'])
+        found |= set(service.recommend_product(product_id, nums=10, engine='cosine')['product_id'])
+    for name in df['product_name'].iloc[::11]:
+        found |= set(service.recommend_query(name, nums=10)['product_id'])
+        found |= set(service.recommend_query(name, nums=10, engine='cosine')['product_id'])
+    for user_id in range(5):
+        found |= set(service.recommend_user(user_id, nums=50)['product_id'])
+    return found
+
+
+def test_upsert_adds_and_replaces_products(served_tree):
+    df = served_tree
+    updated_id = int(df['product_id'].iloc[5])
+    products = upserts_from(df, [0, 1, 5], [900001, 900002, updated_id])
+
+    report = ingest(upserts=products)
+
+    assert (report['added'], report['updated'], report['rows']) == (2, 1, N_PRODUCTS + 3)
+    service = RecommendationService.load()
+    assert len(service.similarity_index) == len(service.catalog) == N_PRODUCTS + 3
+    assert service.tfidf_matrix.shape[0] == N_PRODUCTS + 3
+    # The changed product moved to a new row with the folded-in vector; its old row is tombstoned
+    position = service.catalog.position(updated_id)
+    assert position == N_PRODUCTS + 2
+    assert service.catalog.deleted[5] and not service.catalog.deleted[position]
+    vectors, _, _ = fold_in(list(products['content_processed']), service.dictionary, service.tfidf, service.lsi_model)
+    np.testing.assert_allclose(service.similarity_index.index[N_PRODUCTS:], vectors, atol=1e-6)
+    # New products are searchable and find their own content
+    result = service.recommend_query(' '.join(products['content_processed'].iloc[0]), nums=3)
+    assert 900001 in set(result['product_id'])
+    assert len(service.recommend_product(900002, nums=4)) == 4
+
+
+def test_deleted_products_never_come_back(served_tree):
+    df = served_tree
+    deleted_ids = [int(pid) for pid in df['product_id'].iloc[::10]]
+
+    report = ingest(deletions=deleted_ids + [123456789])
+
+    assert (report['deleted'], report['unknown_deletions']) == (len(deleted_ids), 1)
+    service = RecommendationService.load()
+    assert not search_everything(service, df) & set(deleted_ids)
+    with pytest.raises(KeyError):
+        service.recommend_product(deleted_ids[0])
+
+    # Deletions survive a later upsert
+    ingest(upserts=upserts_from(df, [3], [900003]))
+    service = RecommendationService.load()
+    assert not search_everything(service, df) & set(deleted_ids)
+
+
+def test_interrupted_ingest_is_repaired_on_the_next_run(served_tree, monkeypatch):
+    df = served_tree
+    products = upserts_from(df, [0, 1, 2], [900001, 900002, 900003])
+
+    def crash(*args, **kwargs):
+        raise RuntimeError("killed before the catalog commit")
+
+    # Vectors and cosine rows are appended, then the process dies before the catalog commit
+    with monkeypatch.context() as patched, pytest.raises(RuntimeError):
+        patched.setattr(ingest_module, 'append_columnar_catalog', crash)
+        ingest(upserts=products)
+
+    index_file = np.load(f'{MMAP_MODELS_DIR}/similarity_index.npy', mmap_mode='r')
+    assert index_file.shape[0] == N_PRODUCTS + 3
+    # Nothing uncommitted is served: the manifests still cover the old rows only
+    assert len(load_mmap_models()[3]) == len(ColumnarCatalog(CATALOG_DIR)) == N_PRODUCTS
+    assert load_cosine_models()[1].shape[0] == N_PRODUCTS
+    service = RecommendationService.load()
+    assert 900001 not in service.catalog
+
+    # The next run writes over the uncommitted tail instead of appending after it
+    products = upserts_from(df, [0, 1], [900001, 900002])
+    report = ingest(upserts=products)
+
+    assert report['rows'] == N_PRODUCTS + 2
+    assert np.load(f'{MMAP_MODELS_DIR}/similarity_index.npy', mmap_mode='r').shape[0] == N_PRODUCTS + 2
+    service = RecommendationService.load()
+    assert len(service.similarity_index) == len(service.catalog) == service.tfidf_matrix.shape[0] == N_PRODUCTS + 2
+    assert 900003 not in service.catalog
+    vectors, _, _ = fold_in(list(products['content_processed']), service.dictionary, service.tfidf, service.lsi_model)
+    np.testing.assert_allclose(service.similarity_index.index[N_PRODUCTS:], vectors, atol=1e-6)
+    assert list(service.catalog.df['product_id'].iloc[N_PRODUCTS:]) == [900001, 900002]
+    assert set(service.recommend_product(900001, nums=5)['product_id']).isdisjoint({900003})
@@ -0,0 +1,34 @@
+import threading
+
+from metrics import STAGE_METRIC, Tracer
+
+
+def test_reset_clears_the_registry_and_the_rolling_windows():
+    tracer = Tracer(enabled=True)
+    with tracer.stage('lsi.score'):
+        pass
+    assert tracer.snapshot()[0]['count'] == 1
+    assert f'{STAGE_METRIC}_count{{stage="lsi.score"}} 1' in tracer.registry.prometheus_text()
+
+    tracer.reset()
+    assert tracer.snapshot() == [] and tracer.registry.snapshot() == []
+
+
+def test_reset_while_observing():
+    tracer = Tracer(enabled=True)
+    stop = threading.Event()
+
+    def observe():
+        while not stop.is_set():
+            tracer.observe('ui.render', 1.0)
+
+    threads = [threading.Thread(target=observe) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for _ in range(200):
+        tracer.reset()
+    stop.set()
+    for thread in threads:
+        thread.join()
+    tracer.observe('ui.render', 1.0)
+    assert tracer.registry.snapshot()[0]['count'] >= 1
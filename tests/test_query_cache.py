@@ -0,0 +1,52 @@
+import numpy as np
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from utils import (
+    CatalogIndex, QueryResultCache, build_neighbor_table, get_recommendations_cosine, get_recommendations_gensim,
+)
+
+
+def make_cache():
+    return QueryResultCache(max_entries=64, watch_paths=())
+
+
+def test_neighbor_table_answers_without_touching_the_cache(catalog_df, gensim_models):
+    dictionary, tfidf, lsi_model, similarity_index = gensim_models
+    catalog = CatalogIndex(catalog_df)
+    neighbors = build_neighbor_table(similarity_index, catalog_df['product_id'].to_numpy(), k=20)
+    cache = make_cache()
+    product_id = catalog_df['product_id'].iloc[3]
+
+    result = get_recommendations_gensim(
+        similarity_index, catalog_df, tfidf, lsi_model, dictionary, product_id=product_id, nums=4,
+        catalog=catalog, neighbors=neighbors, cache=cache,
+    )
+
+    assert len(result) == 4
+    assert (cache.hits, cache.misses, len(cache)) == (0, 0, 0)
+
+
+class CountingVectorizer:
+    def __init__(self, vectorizer):
+        self.vectorizer = vectorizer
+        self.calls = 0
+
+    def transform(self, documents):
+        self.calls += 1
+        return self.vectorizer.transform(documents)
+
+
+def test_cosine_cache_hit_skips_the_vectorizer(catalog_df):
+    fitted = TfidfVectorizer(analyzer='word')
+    tfidf_matrix = fitted.fit_transform([' '.join(tokens) for tokens in catalog_df['content_processed']])
+    vectorizer = CountingVectorizer(fitted)
+    catalog = CatalogIndex(catalog_df)
+    cache = make_cache()
+    query = catalog_df['product_name'].iloc[5]
+
+    first = get_recommendations_cosine(tfidf_matrix, catalog_df, query=query, nums=4, vectorizer=vectorizer, catalog=catalog, cache=cache)
+    second = get_recommendations_cosine(tfidf_matrix, catalog_df, query=query, nums=4, vectorizer=vectorizer, catalog=catalog, cache=cache)
+
+    assert vectorizer.calls == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert np.array_equal(first['product_id'], second['product_id'])
@@ -0,0 +1,93 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from artifacts import ColumnarCatalog, save_columnar_catalog
+from utils import (
+    CatalogIndex, RankingKey, column_key, default_ranking_keys, price_band_key, rerank_candidates, score_key,
+)
+
+
+def sort_values_rerank(df, positions, scores, nums, selected_sub_category=None, by_query=False, exclude_product_id=None):
+    """The DataFrame ordering the recommenders used before the ranking keys"""
+    result = df.iloc[positions].copy()
+    result['similarity_score'] = scores
+    if exclude_product_id is not None:
+        result = result[result['product_id'] != exclude_product_id]
+    if selected_sub_category is not None:
+        result['same_category'] = (result['sub_category'] == selected_sub_category).astype(int)
+        result = result.sort_values(['similarity_score', 'same_category', 'rating'], ascending=[False, False, False])
+        result = result.drop('same_category', axis=1)
+    elif by_query:
+        result = result.sort_values(['similarity_score', 'rating'], ascending=[False, False])
+    return result[['product_id', 'product_name', 'sub_category', 'rating', 'similarity_score']].head(nums)
+
+
+@pytest.fixture(scope='module')
+def ranked_catalog(catalog_df):
+    """The synthetic catalog with tied and missing ratings"""
+    rng = np.random.default_rng(11)
+    df = catalog_df.copy()
+    df['rating'] = rng.choice([5.0, 4.5, 4.0, np.nan], len(df))
+    return df
+
+
+def tied_candidates(rng, n_products, size=60):
+    positions = rng.choice(n_products, size, replace=False)
+    scores = np.sort(rng.choice([0.9, 0.8, 0.8, 0.7], size).astype(np.float32))[::-1]
+    return positions, scores
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_default_keys_reproduce_sort_values(ranked_catalog, seed):
+    rng = np.random.default_rng(seed)
+    catalog = CatalogIndex(ranked_catalog)
+    positions, scores = tied_candidates(rng, len(ranked_catalog))
+    product_id = ranked_catalog['product_id'].iloc[positions[3]]
+    sub_category = ranked_catalog['sub_category'].iloc[positions[3]]
+
+    cases = [
+        (default_ranking_keys(catalog, sub_category), dict(selected_sub_category=sub_category, exclude_product_id=product_id)),
+        (default_ranking_keys(catalog, by_query=True), dict(by_query=True)),
+    ]
+    for keys, old_kwargs in cases:
+        result = rerank_candidates(catalog, positions, scores, keys, 20, exclude_product_id=old_kwargs.get('exclude_product_id'))
+        expected = sort_values_rerank(ranked_catalog, positions, scores, 20, **old_kwargs)
+        pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+
+
+def test_lazy_store_columns_are_ranked_and_returned(ranked_catalog, tmp_path):
+    save_columnar_catalog(ranked_catalog.drop(columns=['content_processed']), out_dir=str(tmp_path))
+    store = ColumnarCatalog(str(tmp_path))
+    lazy = CatalogIndex(store.frame(['product_id', 'product_name']), store=store)
+    eager = CatalogIndex(ranked_catalog)
+    positions, scores = tied_candidates(np.random.default_rng(3), len(ranked_catalog))
+    sub_category = ranked_catalog['sub_category'].iloc[positions[0]]
+
+    keys = default_ranking_keys(lazy, sub_category)
+    assert [key.name for key in keys] == ['similarity_score', 'same_category', 'rating']
+    assert [key.name for key in default_ranking_keys(lazy, by_query=True)] == ['similarity_score', 'rating']
+
+    result = rerank_candidates(lazy, positions, scores, keys, 20)
+    expected = rerank_candidates(eager, positions, scores, default_ranking_keys(eager, sub_category), 20)
+    assert list(result.columns) == ['product_id', 'product_name', 'sub_category', 'rating', 'similarity_score']
+    pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+
+
+def test_custom_keys_plug_in(ranked_catalog):
+    catalog = CatalogIndex(ranked_catalog)
+    positions, scores = tied_candidates(np.random.default_rng(5), len(ranked_catalog))
+    cheapest_first = RankingKey('cheap', lambda c: -c['price'], columns=['price'])
+    candidates = ranked_catalog.iloc[positions].assign(similarity_score=scores)
+
+    result = rerank_candidates(catalog, positions, scores, [cheapest_first], 15)
+    expected = candidates.sort_values('price', ascending=True, kind='stable').head(15)
+    assert result['product_id'].tolist() == expected['product_id'].tolist()
+
+    # A filter-like key first, then the usual score and rating order inside each group
+    median = float(candidates['price'].median())
+    keys = [price_band_key(high=median), score_key(), column_key('rating')]
+    result = rerank_candidates(catalog, positions, scores, keys, 60)
+    candidates['in_band'] = candidates['price'] <= median
+    expected = candidates.sort_values(['in_band', 'similarity_score', 'rating'], ascending=False)
+    assert result['product_id'].tolist() == expected['product_id'].tolist()
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+from utils import select_top_k, select_top_k_rows
+
+
+def reference_top_k(scores, k, exclude=()):
+    """The original ranking: a stable sort of (position, score) pairs, then the exclusions"""
+    ranked = sorted(enumerate(scores), key=lambda x: x[1], reverse=True)
+    ranked = [(i, score) for i, score in ranked if i not in set(exclude)][:k]
+    return [i for i, _ in ranked], [score for _, score in ranked]
+
+
+def tied_scores(rng, n, levels, dtype):
+    """Scores drawn from a few distinct values, so most of them are tied"""
+    return (rng.integers(0, levels, n) / levels).astype(dtype)
+
+
+@pytest.mark.parametrize('dtype', [np.float32, np.float64])
+@pytest.mark.parametrize('levels', [1, 3, 50])
+def test_select_top_k_matches_the_stable_sort(dtype, levels):
+    rng = np.random.default_rng(levels)
+    for _ in range(200):
+        n = int(rng.integers(1, 60))
+        scores = tied_scores(rng, n, levels, dtype)
+        k = int(rng.integers(0, n + 3))
+        self_idx = int(rng.integers(0, n))
+
+        for exclude, excluded in [(None, ()), (self_idx, (self_idx,))]:
+            indices, values = select_top_k(scores, k, exclude=exclude)
+            expected_indices, expected_values = reference_top_k(scores, k, excluded)
+            assert indices.tolist() == expected_indices
+            assert values.tolist() == expected_values
+
+
+def test_select_top_k_exclusion_forms_agree():
+    rng = np.random.default_rng(7)
+    scores = tied_scores(rng, 200, 4, np.float32)
+    positions = rng.choice(200, 30, replace=False)
+    mask = np.zeros(200, dtype=bool)
+    mask[positions] = True
+
+    expected_indices, _ = reference_top_k(scores, 50, positions.tolist())
+    assert select_top_k(scores, 50, exclude=positions)[0].tolist() == expected_indices
+    assert select_top_k(scores, 50, exclude=mask)[0].tolist() == expected_indices
+
+
+@pytest.mark.parametrize('levels', [1, 3, 50])
+def test_select_top_k_rows_matches_the_stable_sort(levels):
+    rng = np.random.default_rng(100 + levels)
+    for _ in range(50):
+        n_rows, n_cols = int(rng.integers(1, 8)), int(rng.integers(1, 60))
+        scores = tied_scores(rng, n_rows * n_cols, levels, np.float32).reshape(n_rows, n_cols)
+        # Self-exclusion as the batch search does it: the own column is set to -inf
+        own = rng.integers(0, n_cols, n_rows)
+        scores[np.arange(n_rows), own] = -np.inf
+        k = int(rng.integers(0, n_cols + 3))
+
+        indices, values = select_top_k_rows(scores, k)
+        for row in range(n_rows):
+            expected_indices, expected_values = reference_top_k(scores[row], k)
+            assert indices[row].tolist() == expected_indices
+            assert values[row].tolist() == expected_values
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from benchmarks.synthetic_catalog import make_ratings
+from utils import SVDScorer, get_recommendations_surprise
+
+UNKNOWN_USER = 10**6
+UNKNOWN_PRODUCTS = [-1, 10**9]
+
+
+@pytest.fixture(scope='module', params=[True, False], ids=['biased', 'unbiased'])
+def fitted_svd(request, catalog_df):
+    from surprise import SVD, Dataset, Reader
+    ratings = make_ratings(catalog_df['product_id'], n_users=60, n_ratings=3000, seed=3)
+    data = Dataset.load_from_df(ratings[['user_id', 'product_id', 'rating']], Reader(rating_scale=(1, 5)))
+    algo = SVD(n_factors=12, n_epochs=10, biased=request.param, random_state=0)
+    algo.fit(data.build_full_trainset())
+    return algo, ratings
+
+
+@pytest.mark.parametrize('user_id', ['known', UNKNOWN_USER])
+def test_predictions_match_surprise(catalog_df, fitted_svd, user_id):
+    algo, ratings = fitted_svd
+    if user_id == 'known':
+        user_id = int(ratings['user_id'].iloc[0])
+    product_ids = list(catalog_df['product_id']) + UNKNOWN_PRODUCTS
+
+    predictions = SVDScorer.from_algo(algo).predict_many(user_id, product_ids)
+
+    expected = [algo.predict(user_id, product_id).est for product_id in product_ids]
+    np.testing.assert_allclose(predictions, expected, rtol=0, atol=1e-12)
+
+
+@pytest.mark.parametrize('user_index', [0, 7, 25, None])
+def test_top_n_matches_the_predict_loop(catalog_df, fitted_svd, user_index):
+    algo, ratings = fitted_svd
+    user_id = UNKNOWN_USER if user_index is None else int(ratings['user_id'].unique()[user_index])
+    df_productid = catalog_df[['product_id']]
+
+    result = get_recommendations_surprise(df_productid, catalog_df, algo, user_id, nums=10)
+
+    # The per-product algo.predict loop of the notebook
+    expected = df_productid.copy()
+    expected['Score_Prediction'] = expected['product_id'].apply(lambda x: algo.predict(user_id, x).est)
+    expected = expected.sort_values(by=['Score_Prediction'], ascending=False).drop_duplicates().head(10)
+    assert result['product_id'].tolist() == expected['product_id'].tolist()
+    np.testing.assert_allclose(result['Score_Prediction'], expected['Score_Prediction'], rtol=0, atol=1e-12)
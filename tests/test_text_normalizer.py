@@ -0,0 +1,17 @@
+from utils import _normalizer_for, preprocess_text
+
+STOP_WORDS = frozenset(['thun', 'cho'])
+
+
+def test_stop_words_are_removed():
+    assert preprocess_text('Áo thun nam 2024, cho bé!', stop_words=STOP_WORDS) == ['áo', 'nam', 'bé']
+    assert preprocess_text('Áo thun nam', stop_words=['thun']) == ['áo', 'nam']
+    assert preprocess_text('Áo thun nam') == ['áo', 'thun', 'nam']
+
+
+def test_normalizer_is_built_once_per_stop_word_set():
+    _normalizer_for.cache_clear()
+    for _ in range(5):
+        preprocess_text('áo thun', stop_words=STOP_WORDS)
+    info = _normalizer_for.cache_info()
+    assert (info.misses, info.hits) == (1, 4)
@@ -0,0 +1,18 @@
+import pytest
+
+from benchmarks.synthetic_catalog import make_catalog
+from train_content import train
+
+
+def test_resume_checks_the_stop_words_not_their_count(tmp_path):
+    source = str(tmp_path / 'catalog.pkl')
+    df = make_catalog(120, doc_length=20, seed=2)
+    df.to_pickle(source)
+    work_dir = str(tmp_path / 'work')
+    stop_words = ['áo', 'quần', 'giày']
+
+    train(source, work_dir=work_dir, chunk_size=50, workers=1, stop_words=stop_words, num_topics=4)
+    # The same set in another order resumes from the stages on disk
+    train(source, work_dir=work_dir, chunk_size=50, workers=1, stop_words=stop_words[::-1], num_topics=4)
+    with pytest.raises(ValueError, match='--restart'):
+        train(source, work_dir=work_dir, chunk_size=50, workers=1, stop_words=['túi', 'ví', 'mũ'], num_topics=4)
@@ -0,0 +1,358 @@
+"""
+Streaming, multi-core, resumable training of the Gensim content models
+
+Scripted replacement for the training part of ContentBased.ipynb. The
+catalog is read in chunks and tokenized on a process pool (underthesea is
+imported inside the workers, like the notebook's `tokenize_text`); every
+later stage streams from disk:
+
+    1. tokens/chunk-*.pkl   tokenized chunks (catalog columns + content_processed)
+    2. dictionary.pkl       corpora.Dictionary fed chunk by chunk
+    3. corpus.mm            bag-of-words corpus serialized as a Matrix Market file
+    4. tfidf_model.pkl      TfidfModel over the streamed corpus
+    5. lsi_model.pkl        LsiModel (300 topics) over the streamed TF-IDF corpus
+    6. similarity_index.npy unit-length LSI vectors written block by block
+
+Each stage writes to a temporary name and renames it when complete, so an
+interrupted build resumes from the last finished stage (or chunk) on the next
+run. Peak memory depends on the chunk size, the vocabulary and the number of
+topics, not on the number of products.
+
+The results are published as the memory-mapped models (models/mmap, when the
+SVD model exists), the columnar catalog (data/catalog) and the dictionary,
+TF-IDF and LSI pickles. An exported TF-IDF cosine engine (models/cosine) is
+refitted with its previous vectorizer settings. --pickles also writes the in-memory
+similarity_index.pkl and processed_data.pkl of the notebook; those need the
+whole catalog in memory.
+
+    python train_content.py --source Products_ThoiTrangNam_cleaned.csv --stop-words vietnamese-stopwords.txt
+    python train_content.py --source products.jsonl --workers 8 --chunk-size 5000 --pickles
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+import pickle
+import resource
+import shutil
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+from gensim import corpora, models, similarities
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from artifacts import (
+    CATALOG_DIR, COSINE_MODELS_DIR, MMAP_MODELS_DIR, ColumnarCatalog, append_columnar_catalog, export_cosine_models, export_mmap_models,
+    has_cosine_models, load_cosine_models, save_columnar_catalog,
+)
+from indexes import (
+    IVF_INDEX_DIR, PARTITIONED_INDEX_DIR, QUANTIZED_INDEX_DIR, SHARDED_INDEX_DIR,
+    IVFIndex, PartitionedIndex, QuantizedIndex, ShardedIndex,
+    has_ivf_index, has_partitioned_index, has_quantized_index, has_sharded_index,
+)
+from ingest import INGEST_STATE_PATH, IngestState, _save_replacing, fold_in, load_stop_words, tokenize_products
+
+WORK_DIR = 'build/content'
+NEIGHBOR_TABLE_PATH = 'models/neighbors.npz'
+NUM_TOPICS = 300
+# Columns of the catalog kept next to the tokens (the notebook's df minus its intermediate text columns)
+CATALOG_COLUMNS = ['product_id', 'product_name', 'category', 'sub_category', 'link', 'image', 'price', 'rating', 'description']
+
+
+def save_pickle(obj, path):
+    """Pickle to a temporary file and rename it, so a crash never leaves a partial file"""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(obj, f)
+    os.replace(tmp_path, path)
+
+
+def load_pickle(path):
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+# Đọc danh mục sản phẩm theo từng phần (csv/jsonl đọc dần, pickle đọc một lần)
+def read_chunks(source, chunk_size):
+    if source.endswith('.csv'):
+        yield from pd.read_csv(source, chunksize=chunk_size)
+    elif source.endswith('.jsonl'):
+        yield from pd.read_json(source, lines=True, chunksize=chunk_size)
+    else:
+        data = pd.read_pickle(source)
+        df = data['df'] if isinstance(data, dict) else data
+        for start in range(0, len(df), chunk_size):
+            yield df.iloc[start:start + chunk_size]
+
+
+def _tokenize_chunk(chunk, stop_words):
+    """Worker: tokenize one chunk and keep only the catalog columns"""
+    chunk = tokenize_products(chunk, stop_words=stop_words)
+    return chunk[[c for c in CATALOG_COLUMNS if c in chunk.columns] + ['content_processed']].reset_index(drop=True)
+
+
+# Giai đoạn 1: tách từ song song trên nhiều tiến trình
+def tokenize_stage(source, token_dir, chunk_size, workers, stop_words):
+    """
+    Tokenize the catalog chunk by chunk on a process pool
+
+    At most two chunks per worker are in flight, so memory does not grow with
+    the catalog; chunks already on disk from an interrupted run are skipped.
+
+    Returns:
+        Sorted list of the chunk files
+    """
+    os.makedirs(token_dir, exist_ok=True)
+    done_marker = os.path.join(token_dir, 'DONE')
+    if not os.path.exists(done_marker):
+        pending = deque()
+
+        def finish(future, path):
+            save_pickle(future.result(), path)
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for chunk_id, chunk in enumerate(read_chunks(source, chunk_size)):
+                path = os.path.join(token_dir, f'chunk-{chunk_id:06d}.pkl')
+                if os.path.exists(path):
+                    continue
+                pending.append((executor.submit(_tokenize_chunk, chunk, stop_words), path))
+                if len(pending) >= 2 * workers:
+                    finish(*pending.popleft())
+            while pending:
+                finish(*pending.popleft())
+        open(done_marker, 'w').close()
+    return sorted(glob.glob(os.path.join(token_dir, 'chunk-*.pkl')))
+
+
+def iter_documents(chunk_paths):
+    """Stream the token lists of every product, one chunk in memory at a time"""
+    for path in chunk_paths:
+        yield from load_pickle(path)['content_processed']
+
+
+# Huấn luyện toàn bộ mô hình nội dung theo từng giai đoạn có thể tiếp tục
+def train(source, work_dir=WORK_DIR, chunk_size=10000, workers=None, stop_words=None, num_topics=NUM_TOPICS, lsi_chunksize=20000):
+    """
+    Run (or resume) the staged training pipeline
+
+    Args:
+        source: Catalog file (.csv, .jsonl or pickled DataFrame / {'df': ...})
+        work_dir: Directory of the intermediate stages
+        chunk_size: Products per tokenization chunk
+        workers: Tokenization processes (default: CPU count)
+        stop_words: Stop words removed during tokenization
+        num_topics: LSI topics
+        lsi_chunksize: Documents per LSI update
+
+    Returns:
+        Tuple (chunk_paths, dictionary, tfidf, lsi_model, similarity_index_path)
+    """
+    os.makedirs(work_dir, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+    timings = {}
+
+    # Resuming is only valid with the settings the stages on disk were built with
+    # The stop words are compared by content: another list of the same size changes the tokens too
+    stop_words_hash = hashlib.sha1('\n'.join(sorted(set(stop_words or ()))).encode('utf-8')).hexdigest()
+    params = {'source': os.path.abspath(source), 'chunk_size': chunk_size, 'num_topics': num_topics, 'stop_words': stop_words_hash}
+    params_path = os.path.join(work_dir, 'params.json')
+    if os.path.exists(params_path):
+        with open(params_path, encoding='utf-8') as f:
+            previous = json.load(f)
+        if previous != params:
+            raise ValueError(f"{work_dir} was built with {previous}; pass --restart to start over")
+    else:
+        with open(params_path, 'w', encoding='utf-8') as f:
+            json.dump(params, f, indent=2)
+
+    start = time.perf_counter()
+    chunk_paths = tokenize_stage(source, os.path.join(work_dir, 'tokens'), chunk_size, workers, stop_words)
+    timings['tokenize'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    dictionary_path = os.path.join(work_dir, 'dictionary.pkl')
+    if not os.path.exists(dictionary_path):
+        save_pickle(corpora.Dictionary(iter_documents(chunk_paths)), dictionary_path)
+    dictionary = load_pickle(dictionary_path)
+    timings['dictionary'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    corpus_path = os.path.join(work_dir, 'corpus.mm')
+    if not os.path.exists(corpus_path):
+        tmp_path = os.path.join(work_dir, 'corpus.tmp.mm')
+        corpora.MmCorpus.serialize(tmp_path, (dictionary.doc2bow(doc) for doc in iter_documents(chunk_paths)), id2word=dictionary)
+        os.replace(tmp_path + '.index', corpus_path + '.index')
+        os.replace(tmp_path, corpus_path)
+    corpus = corpora.MmCorpus(corpus_path)
+    timings['corpus'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    tfidf_path = os.path.join(work_dir, 'tfidf_model.pkl')
+    if not os.path.exists(tfidf_path):
+        save_pickle(models.TfidfModel(corpus), tfidf_path)
+    tfidf = load_pickle(tfidf_path)
+    timings['tfidf'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    lsi_path = os.path.join(work_dir, 'lsi_model.pkl')
+    if not os.path.exists(lsi_path):
+        lsi_model = models.LsiModel(tfidf[corpus], id2word=dictionary, num_topics=num_topics, chunksize=lsi_chunksize)
+        save_pickle(lsi_model, lsi_path)
+    lsi_model = load_pickle(lsi_path)
+    timings['lsi'] = time.perf_counter() - start
+
+    # The LSI vectors of every product, i.e. MatrixSimilarity.index, block by block
+    start = time.perf_counter()
+    index_path = os.path.join(work_dir, 'similarity_index.npy')
+    if not os.path.exists(index_path):
+        tmp_path = os.path.join(work_dir, 'similarity_index.tmp.npy')
+        index = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32, shape=(len(corpus), lsi_model.num_topics))
+        row = 0
+        for path in chunk_paths:
+            vectors, _, _ = fold_in(list(load_pickle(path)['content_processed']), dictionary, tfidf, lsi_model)
+            index[row:row + len(vectors)] = vectors
+            row += len(vectors)
+        index.flush()
+        del index
+        os.replace(tmp_path, index_path)
+    timings['similarity_index'] = time.perf_counter() - start
+
+    for stage, seconds in timings.items():
+        print(f"{stage:<18} {seconds:>8.1f}s", flush=True)
+    return chunk_paths, dictionary, tfidf, lsi_model, index_path
+
+
+# Dựng lại các chỉ mục phụ đang có trên đĩa từ vector mới
+def rebuild_indexes(vectors, store):
+    """
+    Rebuild the derived indexes found on disk with their previous settings
+
+    The precomputed neighbor table is removed instead (build_artifacts.py
+    neighbors recreates it).
+
+    Returns:
+        List of the rebuilt index directories
+    """
+    rebuilt = []
+    if has_sharded_index():
+        old = ShardedIndex.load()
+        grouped = any(shard.group is not None for shard in old.shards)
+        groups = np.asarray(store.column('category')) if grouped else None
+        _save_replacing(ShardedIndex.build(vectors, shard_size=max(len(shard) for shard in old.shards), groups=groups), SHARDED_INDEX_DIR)
+        rebuilt.append(SHARDED_INDEX_DIR)
+    if has_ivf_index():
+        old = IVFIndex.load()
+        _save_replacing(IVFIndex.build(vectors, n_lists=old.n_lists, nprobe=old.nprobe), IVF_INDEX_DIR)
+        rebuilt.append(IVF_INDEX_DIR)
+    if has_quantized_index():
+        old = QuantizedIndex.load()
+        dtype = 'int8' if old.scales is not None else 'float32'
+        _save_replacing(QuantizedIndex.build(vectors, dtype=dtype, rerank=old.rerank), QUANTIZED_INDEX_DIR)
+        rebuilt.append(QUANTIZED_INDEX_DIR)
+    if has_partitioned_index():
+        index = PartitionedIndex.build(
+            vectors,
+            np.asarray(store.column('sub_category')),
+            prices=store.column('price') if 'price' in store.columns else None,
+            ratings=store.column('rating') if 'rating' in store.columns else None,
+        )
+        _save_replacing(index, PARTITIONED_INDEX_DIR)
+        rebuilt.append(PARTITIONED_INDEX_DIR)
+    if os.path.exists(NEIGHBOR_TABLE_PATH):
+        os.remove(NEIGHBOR_TABLE_PATH)
+    return rebuilt
+
+
+def refit_cosine_models(chunk_paths):
+    """Fit the exported cosine engine again on the new catalog, with the same vectorizer settings"""
+    old, _ = load_cosine_models()
+    vectorizer = TfidfVectorizer(
+        analyzer='word',
+        token_pattern=old.token_pattern,
+        lowercase=old.lowercase,
+        stop_words=sorted(old.stop_words) if old.stop_words else None,
+        ngram_range=old.ngram_range,
+        binary=old.binary,
+        sublinear_tf=old.sublinear_tf,
+        norm=old.norm,
+        use_idf=old.idf_ is not None,
+    )
+    tfidf_matrix = vectorizer.fit_transform(' '.join(tokens) for tokens in iter_documents(chunk_paths))
+    export_cosine_models(vectorizer, tfidf_matrix)
+
+
+# Xuất kết quả huấn luyện sang các định dạng được Streamlit/service sử dụng
+def publish(chunk_paths, dictionary, tfidf, lsi_model, index_path, write_pickles=False):
+    """Write the models and the catalog where Streamlit.py and service.py load them"""
+    os.makedirs('models', exist_ok=True)
+    save_pickle(dictionary, 'models/dictionary.pkl')
+    save_pickle(tfidf, 'models/tfidf_model.pkl')
+    save_pickle(lsi_model, 'models/lsi_model.pkl')
+    vectors = np.load(index_path, mmap_mode='r')
+
+    if os.path.exists('models/surprise_svd_model.pkl'):
+        surprise = load_pickle('models/surprise_svd_model.pkl')
+        export_mmap_models(dictionary, tfidf, lsi_model, SimpleNamespace(index=vectors), surprise, out_dir=MMAP_MODELS_DIR)
+    elif os.path.exists(MMAP_MODELS_DIR):
+        # Without the SVD model there is nothing to export; an old export would shadow the new models
+        shutil.rmtree(MMAP_MODELS_DIR)
+
+    # Columnar catalog: the first chunk creates it, the others are appended
+    tmp_dir = CATALOG_DIR.rstrip('/') + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    for chunk_id, path in enumerate(chunk_paths):
+        chunk = load_pickle(path)
+        if chunk_id == 0:
+            save_columnar_catalog(chunk, out_dir=tmp_dir)
+        else:
+            append_columnar_catalog(chunk, catalog_dir=tmp_dir)
+    shutil.rmtree(CATALOG_DIR, ignore_errors=True)
+    os.replace(tmp_dir, CATALOG_DIR)
+    IngestState(len(vectors)).save(INGEST_STATE_PATH)
+    rebuilt = rebuild_indexes(vectors, ColumnarCatalog(CATALOG_DIR))
+    if has_cosine_models():
+        refit_cosine_models(chunk_paths)
+        rebuilt.append(COSINE_MODELS_DIR)
+
+    if write_pickles:
+        similarity_index = similarities.MatrixSimilarity(None, num_features=vectors.shape[1], corpus_len=0)
+        similarity_index.index = np.asarray(vectors)
+        save_pickle(similarity_index, 'models/similarity_index.pkl')
+        df = pd.concat([load_pickle(path) for path in chunk_paths], ignore_index=True)
+        save_pickle({'df': df, 'content_processed': df['content_processed'].tolist()}, 'data/processed_data.pkl')
+    return rebuilt
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--source', required=True, help='Cleaned catalog (.csv, .jsonl or .pkl)')
+    parser.add_argument('--stop-words', default=None)
+    parser.add_argument('--work-dir', default=WORK_DIR)
+    parser.add_argument('--chunk-size', type=int, default=10000)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--topics', type=int, default=NUM_TOPICS)
+    parser.add_argument('--lsi-chunksize', type=int, default=20000)
+    parser.add_argument('--pickles', action='store_true', help='Also write similarity_index.pkl and processed_data.pkl')
+    parser.add_argument('--restart', action='store_true', help='Discard the stages of a previous run')
+    args = parser.parse_args()
+
+    if args.restart:
+        shutil.rmtree(args.work_dir, ignore_errors=True)
+    stop_words = load_stop_words(args.stop_words) if args.stop_words else None
+    results = train(
+        args.source, work_dir=args.work_dir, chunk_size=args.chunk_size, workers=args.workers,
+        stop_words=stop_words, num_topics=args.topics, lsi_chunksize=args.lsi_chunksize,
+    )
+    rebuilt = publish(*results, write_pickles=args.pickles)
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"Published {len(np.load(results[4], mmap_mode='r'))} products, {len(results[1])} terms, "
+          f"rebuilt {', '.join(rebuilt) or 'no derived indexes'}; peak RSS {peak_mb:.0f} MB", flush=True)
+
+
+if __name__ == '__main__':
+    main()
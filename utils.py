@@ -1,27 +1,47 @@
+import functools
+import hashlib
+import os
 import re
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
 import pandas as pd
+from scipy import sparse
+
+from metrics import TRACER
+
+VIETNAMESE_CHARS = (
+    "a-zA-Z0-9_"
+    "àáạảãâầấậẩẫăằắặẳẵ"
+    "èéẹẻẽêềếệểễ"
+    "ìíịỉĩ"
+    "òóọỏõôồốộổỗơờớợởỡ"
+    "ùúụủũưừứựửữ"
+    "ỳýỵỷỹ"
+    "đ"
+    "ÀÁẠẢÃÂẦẤẬẨẪĂẰẮẶẲẴ"
+    "ÈÉẸẺẼÊỀẾỆỂỄ"
+    "ÌÍỊỈĨ"
+    "ÒÓỌỎÕÔỒỐỘỔỖƠỜỚỢỞỠ"
+    "ÙÚỤỦŨƯỪỨỰỬỮ"
+    "ỲÝỴỶỸ"
+    "Đ"
+)
+
+# Compiled once at import instead of on every call
+_VALID_VIETNAMESE_RE = re.compile(f'^[{VIETNAMESE_CHARS}]+$')
+_NON_TEXT_RE = re.compile(r'[^\w\s,.!?;:()[\]{}\'\"\/\\-]')
+_VIETNAMESE_LETTER_RE = re.compile(r'[àáảãạăắằẳẵặâấầẩẫậèéẻẽẹêếềểễệìíỉĩịòóỏõọôốồổỗộơớờởỡợùúủũụưứừửữựỳýỷỹỵđ]')
+_ALPHANUMERIC_RE = re.compile(r'^[a-zA-Z0-9]+$')
+_NUMBER_RE = re.compile('[0-9]+')
+_QUERY_STRIP_RE = re.compile(r'[^\w\s]|[0-9]+')
+
+SPECIAL_CHARS = frozenset(['', ' ', ',', '.', '...', '-',':', ';', '?', '%', '(', ')', '+', '/', "'", '&','⭐','💢','🏘','☎','📖','🌱','❤','📞','🎯','💥','⛔'])
 
 # Hàm kiểm tra từ có phải là từ tiếng Việt "sạch"
 def is_valid_vietnamese(word):
-    vietnamese_chars = (
-        "a-zA-Z0-9_"
-        "àáạảãâầấậẩẫăằắặẳẵ"
-        "èéẹẻẽêềếệểễ"
-        "ìíịỉĩ"
-        "òóọỏõôồốộổỗơờớợởỡ"
-        "ùúụủũưừứựửữ"
-        "ỳýỵỷỹ"
-        "đ"
-        "ÀÁẠẢÃÂẦẤẬẨẪĂẰẮẶẲẴ"
-        "ÈÉẸẺẼÊỀẾỆỂỄ"
-        "ÌÍỊỈĨ"
-        "ÒÓỌỎÕÔỒỐỘỔỖƠỜỚỢỞỠ"
-        "ÙÚỤỦŨƯỪỨỰỬỮ"
-        "ỲÝỴỶỸ"
-        "Đ"
-    )
-    pattern = f'^[{vietnamese_chars}]+$'
-    return re.match(pattern, word) is not None
+    return _VALID_VIETNAMESE_RE.match(word) is not None
 
 
 # Hàm xử lý một mô tả
@@ -32,7 +52,7 @@ def filter_vietnamese_words(text):
     
     # Remove emojis and other non-text characters
     # This regex pattern matches emoji and other special characters
-    text = re.sub(r'[^\w\s,.!?;:()[\]{}\'\"\/\\-]', '', text)
+    text = _NON_TEXT_RE.sub('', text)
     
     # Original Vietnamese word filtering logic
     words = text.split()
@@ -40,7 +60,7 @@ def filter_vietnamese_words(text):
     
     for word in words:
         # Keep only words with Vietnamese characters or basic alphanumeric
-        if re.search(r'[àáảãạăắằẳẵặâấầẩẫậèéẻẽẹêếềểễệìíỉĩịòóỏõọôốồổỗộơớờởỡợùúủũụưứừửữựỳýỷỹỵđ]', word.lower()) or re.match(r'^[a-zA-Z0-9]+$', word):
+        if _VIETNAMESE_LETTER_RE.search(word.lower()) or _ALPHANUMERIC_RE.match(word):
             vietnamese_words.append(word)
     
     return ' '.join(vietnamese_words)
@@ -49,15 +69,207 @@ def filter_vietnamese_words(text):
 from typing import Optional
 def data_preprocessing_for_gensim(text, stop_words = None, remove_number: Optional[bool] = None, remove_special_chars: Optional[bool] = None):
     if remove_number:
-        text_re = [[re.sub('[0-9]+','', e) for e in text] for text in text]
+        text_re = [[_NUMBER_RE.sub('', e) for e in text] for text in text]
     if remove_special_chars:
-        text_re = [[t.lower() for t in text if not t in ['', ' ', ',', '.', '...', '-',':', ';', '?', '%', '(', ')', '+', '/', "'", '&','⭐','💢','🏘','☎','📖','🌱','❤','📞','🎯','💥','⛔']] for text in  text_re] 
+        text_re = [[t.lower() for t in text if not t in SPECIAL_CHARS] for text in  text_re] 
     if stop_words:
+        stop_words = stop_words if isinstance(stop_words, (set, frozenset)) else frozenset(stop_words)
         text_re = [[t for t in text if not t in stop_words] for text in text_re] # stopword
     return text_re
 
+# Bộ chuẩn hóa truy vấn một lượt (thay cho preprocess_text + data_preprocessing_for_gensim)
+class TextNormalizer:
+    """
+    Precompiled, single-pass query normalizer
+
+    Produces exactly the tokens of the original `preprocess_text` pipeline
+    (lowercase, strip punctuation and digits, drop special tokens and stop
+    words) with one regex substitution, one split and one frozenset filter.
+
+    Args:
+        stop_words: Iterable of stop words to remove (optional)
+    """
+
+    def __init__(self, stop_words=None):
+        stop_words = stop_words if isinstance(stop_words, frozenset) else frozenset(stop_words or ())
+        self.stop_words = stop_words
+        self._dropped = SPECIAL_CHARS | stop_words
+
+    def __call__(self, text):
+        dropped = self._dropped
+        return [t for t in _QUERY_STRIP_RE.sub('', text.lower()).split() if t not in dropped]
+
+
+_DEFAULT_NORMALIZER = TextNormalizer()
+
+
+@functools.lru_cache(maxsize=16)
+def _normalizer_for(stop_words):
+    """One TextNormalizer per stop-word frozenset (frozensets cache their hash)"""
+    return TextNormalizer(stop_words)
+
+# Chỉ mục danh mục sản phẩm: product_id -> vị trí dòng
+class CatalogIndex:
+    """
+    Product catalog with a precomputed product_id -> row position index
+
+    Replaces boolean-mask scans such as `df[df['product_id'] == x]` with O(1)
+    lookups and vectorized gathers. When a product_id appears more than once
+    the first row wins, like the `[0]` / `.iloc[0]` the scans used to take.
+
+    Args:
+        df: DataFrame containing product information (the in-memory columns)
+        store: Optional lazy column store (e.g. artifacts.ColumnarCatalog) with the
+            same rows, serving the columns that are not in df row by row
+        deleted: Optional boolean mask of tombstoned rows (see ingest.py); they keep
+            their position but are no longer found by product_id or recommended
+    """
+
+    def __init__(self, df, store=None, deleted=None):
+        self.df = df
+        self.store = store
+        self.deleted = np.asarray(deleted, dtype=bool) if deleted is not None and np.any(deleted) else None
+        ids = df['product_id'].to_numpy()
+        first = ~pd.Series(ids).duplicated(keep='first').to_numpy()
+        if self.deleted is not None:
+            # A changed product is tombstoned and re-appended: the live row must win
+            live = np.flatnonzero(~self.deleted)
+            first = np.zeros(len(ids), dtype=bool)
+            first[live[~pd.Series(ids[live]).duplicated(keep='first').to_numpy()]] = True
+        self._ids = pd.Index(ids[first])
+        self._rows = np.flatnonzero(first)
+        self._arrays = {}
+
+    def __len__(self):
+        return len(self.df)
+
+    def __contains__(self, product_id):
+        return product_id in self._ids
+
+    @property
+    def columns(self):
+        if self.store is None:
+            return self.df.columns
+        return self.df.columns.append(pd.Index([c for c in self.store.columns if c not in self.df.columns]))
+
+    def _is_lazy(self, column):
+        return self.store is not None and column not in self.df.columns
+
+    @property
+    def deleted_positions(self):
+        """Row positions of the tombstoned products (None when nothing was deleted)"""
+        return None if self.deleted is None else np.flatnonzero(self.deleted)
+
+    def live_frame(self):
+        """The in-memory columns without the tombstoned rows"""
+        return self.df if self.deleted is None else self.df[~self.deleted]
+
+    def positions(self, product_ids):
+        """Return the row positions of product ids, -1 for unknown products"""
+        locs = self._ids.get_indexer(pd.Index(np.asarray(product_ids).ravel()))
+        return np.where(locs >= 0, self._rows[locs], -1)
+
+    def position(self, product_id):
+        """Return the row position of a product id (KeyError if unknown)"""
+        pos = self.positions([product_id])[0]
+        if pos < 0:
+            raise KeyError(f"Product {product_id} not found in the catalog")
+        return int(pos)
+
+    def column(self, name):
+        """Return a column as a NumPy array (cached for O(1) element access)"""
+        if name not in self._arrays:
+            self._arrays[name] = np.asarray(self.store.column(name)) if self._is_lazy(name) else self.df[name].to_numpy()
+        return self._arrays[name]
+
+    def value_at(self, position, column):
+        """Return one attribute of the product at a row position"""
+        if self._is_lazy(column):
+            return self.store.take(column, [position])[0]
+        return self.column(column)[position]
+
+    def get(self, product_id, column):
+        """Return one attribute of a product"""
+        return self.value_at(self.position(product_id), column)
+
+    def row(self, product_id):
+        """Return all attributes of a product as a Series"""
+        if self.store is None:
+            return self.df.iloc[self.position(product_id)]
+        return self.take([self.position(product_id)], list(self.columns)).iloc[0]
+
+    def take(self, positions, columns=None):
+        """
+        Gather the rows at the given positions
+
+        Args:
+            positions: Row positions
+            columns: Columns to return; None returns the in-memory columns only,
+                lazy store columns are decoded only when asked for explicitly
+        """
+        positions = np.asarray(positions, dtype=np.int64)
+        if columns is None:
+            return self.df.iloc[positions]
+        in_memory = [c for c in columns if not self._is_lazy(c)]
+        result = self.df.iloc[positions][in_memory]
+        lazy = [c for c in columns if self._is_lazy(c)]
+        if lazy:
+            result = result.copy()
+            for column in lazy:
+                result[column] = self.store.take(column, positions)
+        return result[columns]
+
+    def lookup(self, product_ids, columns):
+        """
+        Gather attributes for a list of product ids in one vectorized step
+
+        Returns:
+            DataFrame aligned with product_ids (NaN rows for unknown products)
+        """
+        positions = self.positions(product_ids)
+        known = positions >= 0
+        result = pd.DataFrame(index=range(len(positions)), columns=columns, dtype=object)
+        if known.all():
+            return self.take(positions, columns).reset_index(drop=True)
+        if known.any():
+            result.loc[known, columns] = self.take(positions[known], columns).to_numpy()
+        return result
+
+
+# Lọc sản phẩm theo sub_category, khoảng giá và khoảng đánh giá
+def catalog_filter_mask(catalog, sub_categories=None, price_range=None, rating_range=None):
+    """
+    Boolean mask (in catalog row order) of the products matching the filters
+
+    Args:
+        catalog: CatalogIndex
+        sub_categories: Allowed sub_categories (all when None)
+        price_range: Inclusive (min, max) price, None for an open side
+        rating_range: Inclusive (min, max) rating, None for an open side
+
+    Returns:
+        NumPy bool array of length len(catalog)
+    """
+    mask = np.ones(len(catalog), dtype=bool)
+    if sub_categories is not None:
+        allowed = {str(value) for value in sub_categories}
+        mask &= np.fromiter((str(value) in allowed for value in catalog.column('sub_category')), dtype=bool, count=len(catalog))
+    for column, value_range in (('price', price_range), ('rating', rating_range)):
+        if value_range is None or column not in catalog.columns:
+            continue
+        values = pd.to_numeric(pd.Series(catalog.column(column)), errors='coerce').to_numpy(dtype=np.float64)
+        low, high = value_range
+        column_mask = ~np.isnan(values)
+        if low is not None:
+            column_mask &= values >= low
+        if high is not None:
+            column_mask &= values <= high
+        mask &= column_mask
+    return mask
+
+
 # Hàm lấy sản phẩm đề xuất dựa trên Gensim
-def get_recommendations_gensim(similarity_index, df, tfidf, lsi_model, dictionary, query=None, product_id=None, nums=10, stop_words=None):
+def get_recommendations_gensim(similarity_index, df, tfidf, lsi_model, dictionary, query=None, product_id=None, nums=10, stop_words=None, catalog=None, neighbors=None, cache=None, ann_index=None, approximate=False, sub_categories=None, price_range=None, rating_range=None, partitions=None, ranking_keys=None):
     
     """
     Get product recommendations using Gensim's similarity index
@@ -71,35 +283,89 @@ def get_recommendations_gensim(similarity_index, df, tfidf, lsi_model, dictionar
         query: Text query for search-based recommendations (for use case 2)
         product_id: ID of the product to get recommendations for (for use case 1)
         nums: Number of recommendations to return
+        catalog: Prebuilt CatalogIndex over df (built on the fly if None)
+        neighbors: Precomputed NeighborTable for product_id queries (optional)
+        cache: QueryResultCache for the selected (ids, scores) (optional)
+        ann_index: Approximate index with a `top_k` method, e.g. indexes.IVFIndex (optional)
+        approximate: Search ann_index instead of the exact similarity_index for this call
+        sub_categories: Only recommend products of these sub_categories (optional)
+        price_range: Inclusive (min, max) price filter, None for an open side (optional)
+        rating_range: Inclusive (min, max) rating filter, None for an open side (optional)
+        partitions: indexes.PartitionedIndex used to score only the filtered rows (optional)
+        ranking_keys: List of RankingKey ordering the candidates (default: score, same
+            sub_category and rating for products, score and rating for queries); with an
+            empty list exactly nums products are selected, in similarity order
         
     Returns:
         DataFrame with recommended products
     """
+    if catalog is None:
+        catalog = CatalogIndex(df)
+
+    # Twice the products are selected so the ranking keys can reorder them; without keys nums is enough
+    selection = nums if ranking_keys == [] else nums*2
+
+    filters = {}
+    if sub_categories is not None:
+        filters['sub_categories'] = tuple(sub_categories)
+    if price_range is not None:
+        filters['price_range'] = tuple(price_range)
+    if rating_range is not None:
+        filters['rating_range'] = tuple(rating_range)
+
+    # Exact and approximate results are cached under different keys
+    search_index = ann_index if approximate and ann_index is not None else similarity_index
+    cache_kind = 'gensim' if search_index is similarity_index else 'gensim-ann'
+    product_indices = None
+    cache_key = None
+    cached = None
+
     # Use case 1: User selects a product ID
     if product_id is not None:
         # Get the index of the product
-        idx = df.index[df['product_id'] == product_id][0]
-        
-        # Get the document vector for the product
-        doc_vector = df['content_processed'][idx]
+        idx = catalog.position(product_id)
         
         # Get the sub_category of the selected product
-        selected_sub_category = df.iloc[idx]['sub_category'] if 'sub_category' in df.columns else None
-        
-        # Convert to bag of words
-        bow_vector = dictionary.doc2bow(doc_vector)
+        selected_sub_category = catalog.value_at(idx, 'sub_category') if 'sub_category' in catalog.columns else None
         
         # For use case 1, we'll exclude the selected product from results
         exclude_idx = idx
         exclude_product_id = product_id
         
+        # The precomputed neighbor table answers when it is fresh enough; the cache is only consulted otherwise
+        use_neighbors = neighbors is not None and not filters and catalog.deleted is None and neighbors.covers(idx, selection, len(catalog))
+        if cache is not None and not use_neighbors:
+            cache_key = cache.make_key(cache_kind + '-product', [product_id], selection, filters=filters)
+            cached = cache.get(cache_key)
+        
+        if use_neighbors:
+            with TRACER.stage('gensim.neighbors'):
+                product_indices, similarity_scores = neighbors.lookup(idx, selection)
+        elif cached is not None:
+            product_indices, similarity_scores = cached
+        else:
+            # Get the document vector for the product
+            doc_vector = catalog.value_at(idx, 'content_processed')
+            
+            # Convert to bag of words
+            with TRACER.stage('gensim.doc2bow'):
+                bow_vector = dictionary.doc2bow(doc_vector)
+        
     # Use case 2: User searches with a text query
     elif query is not None:
         # Process the query text (assuming same preprocessing as content_processed)
         processed_query = preprocess_text(query,stop_words=stop_words)  
         
-        # Convert to bag of words
-        bow_vector = dictionary.doc2bow(processed_query)
+        if cache is not None:
+            cache_key = cache.make_key(cache_kind, processed_query, selection, filters=filters)
+            cached = cache.get(cache_key)
+        
+        if cached is not None:
+            product_indices, similarity_scores = cached
+        else:
+            # Convert to bag of words
+            with TRACER.stage('gensim.doc2bow'):
+                bow_vector = dictionary.doc2bow(processed_query)
         
         # For use case 2, we don't need to exclude any specific product
         exclude_idx = None
@@ -109,133 +375,153 @@ def get_recommendations_gensim(similarity_index, df, tfidf, lsi_model, dictionar
     else:
         raise ValueError("Either product_id or query must be provided")
     
-    # Transform to TF-IDF and LSI space
-    tfidf_vector = tfidf[bow_vector]
-    lsi_vector = lsi_model[tfidf_vector]
-    
-    # Get similarities
-    sims = similarity_index[lsi_vector]
-    
-    # Sort the similarities
-    sim_scores = list(enumerate(sims))
-    sim_scores = sorted(sim_scores, key=lambda x: x[1], reverse=True)
-    
-    # Get the top N*2 similar products (excluding the product itself if needed)
-    # We get more than needed to allow for filtering and prioritization
-    if exclude_idx is not None:
-        sim_scores = [s for s in sim_scores if s[0] != exclude_idx][:nums*2]
-    else:
-        sim_scores = sim_scores[:nums*2]
-    
-    # Get the indices of the similar products
-    product_indices = [i[0] for i in sim_scores]
-    similarity_scores = [i[1] for i in sim_scores]
-    
-    # Create a DataFrame with the similar products
-    result = df.iloc[product_indices].copy()
-    result['similarity_score'] = similarity_scores
-    
-    # Double-check to ensure the input product_id is not in the results
-    if exclude_product_id is not None:
-        result = result[result['product_id'] != exclude_product_id]
-    
-    # For use case 1 (product_id), prioritize same sub_category and higher rating
-    if product_id is not None and selected_sub_category is not None and 'sub_category' in result.columns:
-        # Sort by similarity score first, then by sub_category, then by rating (if available)
-        sort_columns = ['similarity_score']
-        sort_ascending = [False]
-        
-        # Add sub_category as a secondary sort criterion
-        # Create a temporary column to prioritize same sub_category
-        result['same_category'] = (result['sub_category'] == selected_sub_category).astype(int)
-        sort_columns.append('same_category')
-        sort_ascending.append(False)  # Same category first
+    if product_indices is None:
+        # Transform to TF-IDF and LSI space
+        with TRACER.stage('gensim.tfidf'):
+            tfidf_vector = tfidf[bow_vector]
+        with TRACER.stage('gensim.lsi'):
+            lsi_vector = lsi_model[tfidf_vector]
         
-        # Add rating as a tertiary sort criterion if available
-        if 'rating' in result.columns:
-            sort_columns.append('rating')
-            sort_ascending.append(False)  # Higher ratings first
+        # Tombstoned products are never recommended
+        exclude = exclude_idx
+        if catalog.deleted is not None:
+            exclude = catalog.deleted_positions if exclude_idx is None else np.append(catalog.deleted_positions, exclude_idx)
         
-        # Sort by the specified columns
-        result = result.sort_values(sort_columns, ascending=sort_ascending)
+        # Get the top `selection` similar products (excluding the product itself if needed)
+        if filters and partitions is not None:
+            # Only the rows of the requested partitions that pass the filters are scored
+            with TRACER.stage('gensim.similarity'):
+                product_indices, similarity_scores = partitions.top_k(lsi_vector, selection, exclude=exclude, **filters)
+        elif filters:
+            with TRACER.stage('gensim.similarity'):
+                sims = search_index[lsi_vector]
+            excluded = ~catalog_filter_mask(catalog, **filters)
+            if exclude is not None:
+                excluded[exclude] = True
+            product_indices, similarity_scores = select_top_k(sims, selection, exclude=excluded)
+        elif hasattr(search_index, 'top_k'):
+            # Sharded and approximate indexes select their top-k without scoring into one array
+            with TRACER.stage('gensim.similarity'):
+                product_indices, similarity_scores = search_index.top_k(lsi_vector, selection, exclude=exclude)
+        else:
+            # Get similarities
+            with TRACER.stage('gensim.similarity'):
+                sims = search_index[lsi_vector]
+            product_indices, similarity_scores = select_top_k(sims, selection, exclude=exclude)
         
-        # Drop the temporary same_category column
-        result = result.drop('same_category', axis=1)
-    # For use case 2 (query-based search), prioritize higher rating
-    elif query is not None and 'rating' in result.columns:
-        # Sort by similarity score first, then by rating
-        result = result.sort_values(['similarity_score', 'rating'], ascending=[False, False])
+        if cache_key is not None:
+            cache.put(cache_key, product_indices, similarity_scores)
     
-    # Select the columns to return
-    columns_to_return = ['product_id', 'product_name', 'similarity_score']
-    if 'rating' in result.columns:
-        columns_to_return.insert(2, 'rating')
-    if 'sub_category' in result.columns:
-        columns_to_return.insert(2, 'sub_category')
-    
-    return result[columns_to_return].head(nums)
+    # Order the candidates on NumPy arrays and build the output DataFrame once
+    if ranking_keys is None:
+        ranking_keys = default_ranking_keys(catalog, selected_sub_category if product_id is not None else None, by_query=query is not None)
+    return rerank_candidates(catalog, product_indices, similarity_scores, ranking_keys, nums, exclude_product_id=exclude_product_id)
 
 # Helper function to preprocess text queries
+@TRACER.traced('text.preprocess')
 def preprocess_text(text, stop_words=None):
     """
     Preprocess text query using the same steps as for content_processed
     
     Args:
         text: Raw text query
-        stop_words: List of stop words to remove
+        stop_words: List of stop words to remove (pass a frozenset to avoid rebuilding it)
         
     Returns:
         List of processed tokens
     """
-    # Use the same preprocessing as the training data
-    # First convert the text to a list of tokens
-    tokens = re.sub(r'[^\w\s]', '', text.lower()).split()
-    
-    # Then apply the same data_preprocessing_for_gensim function
-    # Note: data_preprocessing_for_gensim expects a list of lists
-    processed_tokens = data_preprocessing_for_gensim(
-        [tokens], 
-        stop_words=stop_words,
-        remove_number=True,
-        remove_special_chars=True
-    )
-    
-    # The function returns a list of lists, so we take the first element
-    return processed_tokens[0] if processed_tokens else []
+    # Same steps as the training data, done in one pass by TextNormalizer
+    if not stop_words:
+        normalizer = _DEFAULT_NORMALIZER
+    else:
+        normalizer = _normalizer_for(stop_words if isinstance(stop_words, frozenset) else frozenset(stop_words))
+    return normalizer(text)
 
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
 
-def get_recommendations_cosine(tfidf_matrix, df, query=None, product_id=None, nums=10, vectorizer=None):
+# Độ tương đồng cosine bằng một phép nhân ma trận thưa với vector
+def sparse_cosine_scores(tfidf_matrix, vector):
+    """
+    Cosine similarity of one TF-IDF vector with every row of an L2-normalized matrix
+
+    TfidfVectorizer rows are unit length (norm='l2', also enforced by
+    artifacts.export_cosine_models), so the cosine is a dot product: one sparse
+    matrix-vector product over the stored nonzeros, instead of
+    `cosine_similarity`, which copies and re-normalizes the whole matrix on
+    every call.
+
+    Args:
+        tfidf_matrix: scipy.sparse CSR matrix with L2-normalized rows
+        vector: 1 x n_terms sparse TF-IDF vector (a matrix row or vectorizer.transform output)
+
+    Returns:
+        1-D array of similarity scores, one per matrix row
+    """
+    vector = sparse.csr_matrix(vector)
+    query = np.zeros(tfidf_matrix.shape[1], dtype=tfidf_matrix.dtype)
+    query[vector.indices] = vector.data
+    norm = np.sqrt(np.dot(query, query))
+    if norm > 0:
+        query /= norm
+    return tfidf_matrix @ query
+
+def get_recommendations_cosine(tfidf_matrix, df, query=None, product_id=None, nums=10, vectorizer=None, catalog=None, cache=None, ranking_keys=None, sub_categories=None, price_range=None, rating_range=None):
     """
     Get product recommendations using cosine similarity
     
     Args:
-        tfidf_matrix: TF-IDF matrix of product descriptions
+        tfidf_matrix: TF-IDF matrix of product descriptions (rows L2-normalized, as
+            TfidfVectorizer returns them or artifacts.load_cosine_models maps them)
         df: DataFrame containing product information
         query: Text query for search-based recommendations (for use case 2)
         product_id: ID of the product to get recommendations for (for use case 1)
         nums: Number of recommendations to return
         vectorizer: The TfidfVectorizer used to create the tfidf_matrix (needed for query-based search)
+        catalog: Prebuilt CatalogIndex over df (built on the fly if None)
+        cache: QueryResultCache for the selected (ids, scores) (optional)
+        ranking_keys: List of RankingKey ordering the candidates (optional)
+        sub_categories: Only recommend products of these sub_categories (optional)
+        price_range: Inclusive (min, max) price filter, None for an open side (optional)
+        rating_range: Inclusive (min, max) rating filter, None for an open side (optional)
         
     Returns:
         DataFrame with recommended products
     """
+    if catalog is None:
+        catalog = CatalogIndex(df)
+
+    filters = {}
+    if sub_categories is not None:
+        filters['sub_categories'] = tuple(sub_categories)
+    if price_range is not None:
+        filters['price_range'] = tuple(price_range)
+    if rating_range is not None:
+        filters['rating_range'] = tuple(rating_range)
+
+    cache_key = None
+    cached = None
+
     # Use case 1: User selects a product ID
     if product_id is not None:
         # Find the index of the product with the given ID
-        idx = df.index[df['product_id'] == product_id][0]
+        idx = catalog.position(product_id)
+        if idx >= tfidf_matrix.shape[0]:
+            raise KeyError(f"Product {product_id} has no TF-IDF vector (re-run build_artifacts.py export-cosine)")
         
         # Get the TF-IDF vector for this product
         product_vector = tfidf_matrix[idx:idx+1]
         
         # Get the sub_category of the selected product
-        selected_sub_category = df.iloc[idx]['sub_category'] if 'sub_category' in df.columns else None
+        selected_sub_category = catalog.value_at(idx, 'sub_category') if 'sub_category' in catalog.columns else None
         
         # For use case 1, we'll exclude the selected product from results
         exclude_idx = idx
         exclude_product_id = product_id
         
+        if cache is not None:
+            cache_key = cache.make_key('cosine-product', [product_id], nums, filters=filters)
+            cached = cache.get(cache_key)
+        
     # Use case 2: User searches with a text query
     elif query is not None:
         if vectorizer is None:
@@ -245,12 +531,19 @@ def get_recommendations_cosine(tfidf_matrix, df, query=None, product_id=None, nu
         # We need to preprocess the query the same way as the original data
         processed_query = preprocess_text(query)
         
-        # Join the processed tokens back into a string for the vectorizer
-        query_text = ' '.join(processed_query)
+        if cache is not None:
+            cache_key = cache.make_key('cosine', processed_query, nums, filters=filters)
+            cached = cache.get(cache_key)
         
-        # Transform the query to a TF-IDF vector
-        # We need to use transform (not fit_transform) to use the same vocabulary
-        product_vector = vectorizer.transform([query_text])
+        # Cache hits skip the vectorizer as well as the matrix product
+        if cached is None:
+            # Join the processed tokens back into a string for the vectorizer
+            query_text = ' '.join(processed_query)
+            
+            # Transform the query to a TF-IDF vector
+            # We need to use transform (not fit_transform) to use the same vocabulary
+            with TRACER.stage('cosine.vectorize'):
+                product_vector = vectorizer.transform([query_text])
         
         # For use case 2, we don't need to exclude any specific product
         exclude_idx = None
@@ -260,77 +553,200 @@ def get_recommendations_cosine(tfidf_matrix, df, query=None, product_id=None, nu
     else:
         raise ValueError("Either product_id or query must be provided")
     
-    # Calculate similarity with all products
-    sim_scores = cosine_similarity(product_vector, tfidf_matrix).flatten()
-    
-    # Create list of (index, similarity score) tuples
-    sim_scores_with_indices = list(enumerate(sim_scores))
-    
-    # Sort by similarity score
-    sim_scores_with_indices = sorted(sim_scores_with_indices, key=lambda x: x[1], reverse=True)
-    
-    # Get the top N*2 similar products (excluding the product itself if needed)
-    # We get more than needed to allow for filtering and prioritization
-    if exclude_idx is not None:
-        sim_scores_with_indices = [s for s in sim_scores_with_indices if s[0] != exclude_idx][:nums*2]
+    if cached is not None:
+        product_indices, similarity_scores = cached
     else:
-        sim_scores_with_indices = sim_scores_with_indices[:nums*2]
-    
-    # Get indices of similar products and their similarity scores
-    product_indices = [i[0] for i in sim_scores_with_indices]
-    similarity_scores = [i[1] for i in sim_scores_with_indices]
-    
-    # Create a DataFrame with the similar products
-    result = df.iloc[product_indices].copy()
-    result['similarity_score'] = similarity_scores
-    
-    # Double-check to ensure the input product_id is not in the results
-    if exclude_product_id is not None:
-        result = result[result['product_id'] != exclude_product_id]
-    
-    # For use case 1 (product_id), prioritize same sub_category and higher rating
-    if product_id is not None and selected_sub_category is not None and 'sub_category' in result.columns:
-        # Sort by similarity score first, then by sub_category, then by rating (if available)
-        sort_columns = ['similarity_score']
-        sort_ascending = [False]
-        
-        # Add sub_category as a secondary sort criterion
-        # Create a temporary column to prioritize same sub_category
-        result['same_category'] = (result['sub_category'] == selected_sub_category).astype(int)
-        sort_columns.append('same_category')
-        sort_ascending.append(False)  # Same category first
+        # Calculate similarity with all products
+        with TRACER.stage('cosine.similarity'):
+            sim_scores = sparse_cosine_scores(tfidf_matrix, product_vector)
         
-        # Add rating as a tertiary sort criterion if available
-        if 'rating' in result.columns:
-            sort_columns.append('rating')
-            sort_ascending.append(False)  # Higher ratings first
+        # Tombstoned and filtered-out products are never recommended
+        excluded = np.zeros(len(sim_scores), dtype=bool)
+        if filters:
+            excluded |= ~catalog_filter_mask(catalog, **filters)[:len(sim_scores)]
+        if catalog.deleted is not None:
+            excluded |= catalog.deleted[:len(sim_scores)]
+        if exclude_idx is not None:
+            excluded[exclude_idx] = True
         
-        # Sort by the specified columns
-        result = result.sort_values(sort_columns, ascending=sort_ascending)
+        # Get the top `selection` similar products (excluding the product itself if needed)
+        product_indices, similarity_scores = select_top_k(sim_scores, nums*2, exclude=excluded)
         
-        # Drop the temporary same_category column
-        result = result.drop('same_category', axis=1)
-    # For use case 2 (query-based search), prioritize higher rating
-    elif query is not None and 'rating' in result.columns:
-        # Sort by similarity score first, then by rating
-        result = result.sort_values(['similarity_score', 'rating'], ascending=[False, False])
+        if cache_key is not None:
+            cache.put(cache_key, product_indices, similarity_scores)
     
-    # Select the columns to return
-    columns_to_return = ['product_id', 'product_name', 'similarity_score']
-    if 'rating' in result.columns:
-        columns_to_return.insert(2, 'rating')
-    if 'sub_category' in result.columns:
-        columns_to_return.insert(2, 'sub_category')
-    
-    return result[columns_to_return].head(nums)
+    # Order the candidates on NumPy arrays and build the output DataFrame once
+    if ranking_keys is None:
+        ranking_keys = default_ranking_keys(catalog, selected_sub_category if product_id is not None else None, by_query=query is not None)
+    return rerank_candidates(catalog, product_indices, similarity_scores, ranking_keys, nums, exclude_product_id=exclude_product_id)
+
+# Bộ chấm điểm SVD dạng vector hóa (thay cho surprise.predict từng sản phẩm)
+class SVDScorer:
+    """
+    Vectorized scoring engine for a trained Surprise SVD model
+
+    The latent factors (pu, qi), the biases (bu, bi) and the global mean are
+    pulled out of the model once, so scoring all items for a user is a single
+    matrix-vector product instead of one `predict` call per product.
+    Unknown users and items are handled the same way as `SVD.predict`.
+
+    Args:
+        pu: User factors (n_users x n_factors)
+        qi: Item factors (n_items x n_factors)
+        bu: User biases (n_users,)
+        bi: Item biases (n_items,)
+        global_mean: Mean of all ratings in the trainset
+        rating_scale: (lower, higher) bounds used to clip the estimates
+        raw_user_ids: Raw user ids ordered by inner id
+        raw_item_ids: Raw item ids ordered by inner id
+        biased: Whether the model was trained with baselines
+    """
+
+    def __init__(self, pu, qi, bu, bi, global_mean, rating_scale, raw_user_ids, raw_item_ids, biased=True):
+        self.pu = pu
+        self.qi = qi
+        self.bu = bu
+        self.bi = bi
+        self.global_mean = float(global_mean)
+        self.rating_scale = tuple(rating_scale)
+        self.biased = biased
+        self.raw_user_ids = raw_user_ids
+        self.raw_item_ids = raw_item_ids
+        self._user_index = pd.Index(raw_user_ids)
+        self._item_index = pd.Index(raw_item_ids)
+
+    @classmethod
+    def from_algo(cls, algo):
+        """Build a scorer from a fitted `surprise.SVD` instance"""
+        trainset = algo.trainset
+        raw_user_ids = [trainset.to_raw_uid(u) for u in range(trainset.n_users)]
+        raw_item_ids = [trainset.to_raw_iid(i) for i in range(trainset.n_items)]
+        return cls(
+            pu=np.asarray(algo.pu),
+            qi=np.asarray(algo.qi),
+            bu=np.asarray(algo.bu),
+            bi=np.asarray(algo.bi),
+            global_mean=trainset.global_mean,
+            rating_scale=trainset.rating_scale,
+            raw_user_ids=raw_user_ids,
+            raw_item_ids=raw_item_ids,
+            biased=algo.biased,
+        )
+
+    def inner_user_id(self, user_id):
+        """Return the inner id of a raw user id, or -1 if the user is unknown"""
+        try:
+            loc = self._user_index.get_loc(user_id)
+        except (KeyError, TypeError):
+            return -1
+        return loc if isinstance(loc, (int, np.integer)) else -1
+
+    def inner_item_ids(self, product_ids):
+        """Return the inner ids of raw product ids, -1 for unknown products"""
+        return self._item_index.get_indexer(pd.Index(product_ids))
+
+    def score_items(self, user_id, inner_items):
+        """
+        Estimate the ratings of one user for a set of items
+
+        Args:
+            user_id: Raw user id
+            inner_items: Inner item ids as returned by `inner_item_ids` (-1 = unknown)
+
+        Returns:
+            NumPy array of clipped rating estimates, aligned with inner_items
+        """
+        inner_items = np.asarray(inner_items)
+        known_items = inner_items >= 0
+        u = self.inner_user_id(user_id)
+        items = inner_items[known_items]
+
+        if self.biased:
+            user_part = self.global_mean + (self.bu[u] if u >= 0 else 0.0)
+            est = np.full(len(inner_items), user_part, dtype=np.float64)
+            est[known_items] += self.bi[items]
+            if u >= 0:
+                est[known_items] += self._item_factor_scores(u, items)
+        else:
+            # Surprise falls back to the global mean when the prediction is impossible
+            est = np.full(len(inner_items), self.global_mean, dtype=np.float64)
+            if u >= 0:
+                est[known_items] = self._item_factor_scores(u, items)
+
+        lower_bound, higher_bound = self.rating_scale
+        return np.clip(est, lower_bound, higher_bound)
+
+    def _item_factor_scores(self, u, items):
+        """Dot products qi . pu[u] of the given inner items"""
+        if 2 * len(items) < len(self.qi):
+            # Few items (e.g. hybrid candidates): only their factor rows are touched
+            return self.qi[items] @ self.pu[u]
+        # One matrix-vector product for the whole catalog
+        return (self.qi @ self.pu[u])[items]
+
+    def catalog_factors(self, product_ids):
+        """
+        Align the item factors and biases with a list of raw product ids
+
+        Unknown products get zero factors and a zero bias, which reproduces the
+        baseline-only estimate Surprise uses for items missing from the trainset.
+
+        Returns:
+            Tuple (item_factors, item_biases, known_items)
+        """
+        inner_items = self.inner_item_ids(product_ids)
+        known_items = inner_items >= 0
+        item_factors = np.zeros((len(inner_items), self.qi.shape[1]), dtype=self.qi.dtype)
+        item_factors[known_items] = self.qi[inner_items[known_items]]
+        item_biases = np.zeros(len(inner_items), dtype=np.float64)
+        item_biases[known_items] = self.bi[inner_items[known_items]]
+        return item_factors, item_biases, known_items
+
+    def score_users(self, user_ids, catalog_factors):
+        """
+        Estimate a dense (users x items) rating matrix for a block of users
+
+        Args:
+            user_ids: Raw user ids of the block
+            catalog_factors: Output of `catalog_factors` for the scored products
+
+        Returns:
+            NumPy array of shape (len(user_ids), n_products) with clipped estimates
+        """
+        item_factors, item_biases, known_items = catalog_factors
+        inner_users = self._user_index.get_indexer(pd.Index(user_ids))
+        known_users = inner_users >= 0
+
+        user_factors = np.zeros((len(inner_users), self.pu.shape[1]), dtype=self.pu.dtype)
+        user_factors[known_users] = self.pu[inner_users[known_users]]
+
+        # Dense user-by-item matrix product for the whole block
+        est = user_factors @ item_factors.T
+        if self.biased:
+            user_biases = np.zeros(len(inner_users), dtype=np.float64)
+            user_biases[known_users] = self.bu[inner_users[known_users]]
+            est += self.global_mean + user_biases[:, None]
+            est += item_biases[None, :]
+        else:
+            est = np.where(known_users[:, None] & known_items[None, :], est, self.global_mean)
+
+        lower_bound, higher_bound = self.rating_scale
+        return np.clip(est, lower_bound, higher_bound, out=est)
+
+    def predict_many(self, user_id, product_ids):
+        """Estimate the ratings of one user for raw product ids"""
+        return self.score_items(user_id, self.inner_item_ids(product_ids))
+
+
+def get_recommendations_surprise(df_productid,full_product_df, surprise, user_id, nums=10, catalog=None):
+    # Accept either a fitted surprise.SVD or a prebuilt SVDScorer
+    scorer = surprise if isinstance(surprise, SVDScorer) else SVDScorer.from_algo(surprise)
 
-def get_recommendations_surprise(df_productid,full_product_df, surprise, user_id, nums=10):
     # Create predictions for all products for this user
     #copy the df first
     df_copy = df_productid.copy()
-    df_copy['Score_Prediction'] = df_copy['product_id'].apply(
-        lambda x: surprise.predict(int(user_id), x).est
-    )
+    with TRACER.stage('surprise.score'):
+        df_copy['Score_Prediction'] = scorer.predict_many(int(user_id), df_copy['product_id'])
     
     # Sort by prediction score and get top N
     recommendations = df_copy.sort_values(
@@ -338,12 +754,738 @@ def get_recommendations_surprise(df_productid,full_product_df, surprise, user_id
         ascending=False
     ).drop_duplicates().head(nums)
 
-    recommendations['product_name'] = recommendations['product_id'].apply(lambda x: full_product_df[full_product_df['product_id'] == x]['product_name'].values[0])
-    recommendations['sub_category'] = recommendations['product_id'].apply(lambda x: full_product_df[full_product_df['product_id'] == x]['sub_category'].values[0])
-    recommendations['rating'] = recommendations['product_id'].apply(lambda x: full_product_df[full_product_df['product_id'] == x]['rating'].values[0])
+    # Gather the product attributes through the catalog index instead of one scan per item
+    if catalog is None:
+        catalog = CatalogIndex(full_product_df)
+    details = catalog.lookup(recommendations['product_id'], ['product_name', 'sub_category', 'rating'])
+    for column in ['product_name', 'sub_category', 'rating']:
+        recommendations[column] = details[column].to_numpy()
     
     return recommendations
 
 
-    
-    
\ No newline at end of file
+# Số ứng viên LSI và trọng số mặc định của gợi ý lai
+HYBRID_CANDIDATES = 300
+HYBRID_CONTENT_WEIGHT = 0.5
+HYBRID_RATING_WEIGHT = 0.5
+
+
+# Gợi ý lai: sinh ứng viên bằng LSI, chấm điểm lại bằng hệ số SVD của người dùng
+def get_recommendations_hybrid(similarity_index, df, tfidf, lsi_model, dictionary, surprise, user_id, query=None, product_id=None, nums=10,
+                               candidates=HYBRID_CANDIDATES, content_weight=HYBRID_CONTENT_WEIGHT, rating_weight=HYBRID_RATING_WEIGHT,
+                               catalog=None, **gensim_kwargs):
+    """
+    Personalized recommendations around a seed product or text query
+
+    The LSI index (get_recommendations_gensim) generates the `candidates`
+    products most similar to the seed, then only those are scored with the
+    user's SVD factors, so a request costs O(candidates) instead of
+    O(catalog). The final score blends both signals on a 0-1 scale:
+
+        hybrid_score = (content_weight * similarity + rating_weight * rating) / (content_weight + rating_weight)
+
+    where similarity is clipped to [0, 1] and the predicted rating is scaled
+    by the rating scale of the model. Without a seed the plain SVD ranking
+    over the catalog (get_recommendations_surprise) is returned.
+
+    Args:
+        similarity_index, df, tfidf, lsi_model, dictionary: Gensim models, as for get_recommendations_gensim
+        surprise: Fitted surprise.SVD or SVDScorer
+        user_id: Raw user id (unknown users get the baseline estimates)
+        query: Seed text query (optional)
+        product_id: Seed product (optional, excluded from the results)
+        nums: Number of recommendations to return
+        candidates: Number of LSI candidates scored with the SVD factors
+        content_weight: Weight of the LSI similarity
+        rating_weight: Weight of the predicted rating
+        catalog: Prebuilt CatalogIndex for df (optional)
+        **gensim_kwargs: Passed on to get_recommendations_gensim (stop_words, cache, neighbors, filters, ...)
+
+    Returns:
+        DataFrame with product_id, product_name, [sub_category], [rating],
+        similarity_score, Score_Prediction and hybrid_score, best first
+    """
+    if content_weight < 0 or rating_weight < 0 or content_weight + rating_weight <= 0:
+        raise ValueError("Hybrid weights must be non-negative and not both zero")
+    if catalog is None:
+        catalog = CatalogIndex(df)
+    scorer = surprise if isinstance(surprise, SVDScorer) else SVDScorer.from_algo(surprise)
+
+    if query is None and product_id is None:
+        return get_recommendations_surprise(catalog.live_frame()[['product_id']], df, scorer, user_id, nums=nums, catalog=catalog)
+
+    # Candidate generation: the closest products to the seed, in similarity order
+    pool = get_recommendations_gensim(
+        similarity_index, df, tfidf, lsi_model, dictionary, query=query, product_id=product_id,
+        nums=max(candidates, nums), catalog=catalog, ranking_keys=[], **gensim_kwargs,
+    )
+
+    # Only the candidates are scored with the SVD factors
+    with TRACER.stage('hybrid.score'):
+        predictions = scorer.predict_many(int(user_id), pool['product_id'])
+    with TRACER.stage('hybrid.blend'):
+        lower_bound, higher_bound = scorer.rating_scale
+        rating = (predictions - lower_bound) / max(higher_bound - lower_bound, 1e-12)
+        similarity = np.clip(pool['similarity_score'].to_numpy(dtype=np.float64), 0.0, 1.0)
+        blended = (content_weight * similarity + rating_weight * rating) / (content_weight + rating_weight)
+        order = np.argsort(-blended, kind='stable')[:nums]
+
+    recommendations = pool.iloc[order].copy()
+    recommendations['Score_Prediction'] = predictions[order]
+    recommendations['hybrid_score'] = blended[order]
+    return recommendations
+
+
+# Bảng láng giềng LSI tính trước (offline) cho từng sản phẩm
+class NeighborTable:
+    """
+    Precomputed top-K LSI neighbors of every product in the catalog
+
+    Built offline by `build_neighbor_table` and saved next to
+    `models/similarity_index.pkl`, so "Product Selection" answers with a row
+    lookup instead of scoring the whole catalog on every rerun.
+
+    Args:
+        neighbors: int32 array (n_products x K) of neighbor row positions
+        scores: float32 array (n_products x K) of similarity scores
+        product_ids: product_id of every row when the table was built
+        source_signature: (size, mtime_ns) of the similarity index file it was built from
+    """
+
+    def __init__(self, neighbors, scores, product_ids, source_signature=None):
+        self.neighbors = neighbors
+        self.scores = scores
+        self.product_ids = product_ids
+        self.source_signature = tuple(source_signature) if source_signature is not None else None
+
+    def __len__(self):
+        return len(self.neighbors)
+
+    @property
+    def k(self):
+        return self.neighbors.shape[1]
+
+    def save(self, path):
+        np.savez(
+            path,
+            neighbors=self.neighbors,
+            scores=self.scores,
+            product_ids=self.product_ids,
+            source_signature=np.asarray(self.source_signature if self.source_signature else (-1, -1), dtype=np.int64),
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            signature = tuple(int(v) for v in data['source_signature'])
+            return cls(
+                neighbors=data['neighbors'],
+                scores=data['scores'],
+                product_ids=data['product_ids'],
+                source_signature=None if signature == (-1, -1) else signature,
+            )
+
+    def is_fresh(self, catalog, similarity_index_path=None):
+        """
+        Check that the table still matches the catalog and the similarity index
+
+        Args:
+            catalog: CatalogIndex the recommendations are served from
+            similarity_index_path: Path of the index file the table was built from
+
+        Returns:
+            False if the catalog rows changed or the index was retrained since the build
+        """
+        if len(self) != len(catalog) or not np.array_equal(self.product_ids, catalog.column('product_id')):
+            return False
+        if similarity_index_path is not None and self.source_signature is not None:
+            return file_signature(similarity_index_path) == self.source_signature
+        return True
+
+    def covers(self, position, k, n_products):
+        """Whether the table can answer a top-k query for a row position"""
+        return len(self) == n_products and 0 <= position < len(self) and (k <= self.k or self.k == n_products - 1)
+
+    def lookup(self, position, k):
+        """Return (indices, scores) of the k nearest neighbors of a row"""
+        return self.neighbors[position, :k].astype(np.int64), self.scores[position, :k]
+
+
+def file_signature(path):
+    """Return (size, mtime_ns) of a file, used to detect retrained artifacts"""
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+# Các file/thư mục mô hình dùng để xác định phiên bản kết quả tìm kiếm
+MODEL_WATCH_PATHS = ('models', 'data/processed_data.pkl', 'data/catalog')
+
+
+def artifact_version(paths=MODEL_WATCH_PATHS):
+    """
+    Fingerprint the model and catalog files from their paths, sizes and mtimes
+
+    Args:
+        paths: Files or directories to fingerprint (missing paths are skipped)
+
+    Returns:
+        Short hex digest that changes whenever any of the files is rewritten
+    """
+    hasher = hashlib.sha1()
+    for root in paths:
+        if os.path.isdir(root):
+            files = sorted(os.path.join(d, f) for d, _, names in os.walk(root) for f in names)
+        elif os.path.exists(root):
+            files = [root]
+        else:
+            continue
+        for path in files:
+            size, mtime_ns = file_signature(path)
+            hasher.update(f"{path}:{size}:{mtime_ns}\n".encode('utf-8'))
+    return hasher.hexdigest()[:16]
+
+
+# Bộ nhớ đệm LRU/TTL cho kết quả tìm kiếm (chỉ số + điểm tương đồng)
+class QueryResultCache:
+    """
+    Thread-safe LRU cache of selected (indices, scores) per normalized query
+
+    Keys combine the search kind, the normalized tokens (or product_id), the
+    number of results and the current model version, so a retrained model or
+    a re-exported catalog never serves stale neighbors: the cache is cleared
+    as soon as `artifact_version` changes. Entries also expire after `ttl`
+    seconds. Only the small top-k arrays are stored (read-only), the result
+    DataFrame is still built per request.
+
+    Args:
+        max_entries: Maximum number of cached queries (least recently used are evicted)
+        ttl: Seconds an entry stays valid (None keeps entries until evicted)
+        watch_paths: Files/directories fingerprinted into the model version
+        check_interval: Seconds between two fingerprints of watch_paths
+        clock: Monotonic time function (overridable for tests)
+    """
+
+    def __init__(self, max_entries=1024, ttl=3600, watch_paths=MODEL_WATCH_PATHS, check_interval=30, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.watch_paths = tuple(watch_paths)
+        self.check_interval = check_interval
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = artifact_version(self.watch_paths)
+        self._checked_at = clock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def version(self):
+        """Current model version, re-fingerprinted at most every check_interval seconds"""
+        now = self.clock()
+        if now - self._checked_at >= self.check_interval:
+            version = artifact_version(self.watch_paths)
+            with self._lock:
+                self._checked_at = now
+                if version != self._version:
+                    self._version = version
+                    self._entries.clear()
+        return self._version
+
+    def make_key(self, kind, tokens, nums, filters=None):
+        """Build the cache key of a query from its normalized tokens, selection size and search filters"""
+        return kind, tuple(tokens), nums, tuple(sorted(filters.items())) if filters else (), self.version
+
+    def get(self, key):
+        """Return the cached (indices, scores) of a key, or None"""
+        now = self.clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or key[-1] != self._version:
+                self.misses += 1
+                return None
+            expires_at, indices, scores = entry
+            if expires_at is not None and now >= expires_at:
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return indices, scores
+
+    def put(self, key, indices, scores):
+        """Store the selected (indices, scores) of a key"""
+        indices = np.array(indices)
+        scores = np.array(scores)
+        indices.flags.writeable = False
+        scores.flags.writeable = False
+        expires_at = self.clock() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            if key[-1] != self._version:
+                return
+            self._entries[key] = (expires_at, indices, scores)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Return hit/miss/eviction counters and the current size"""
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'size': len(self._entries),
+            'hit_rate': self.hits / total if total else 0.0,
+            'version': self._version,
+        }
+
+
+# Hàm tính bảng láng giềng theo từng khối (chạy offline)
+def build_neighbor_table(similarity_index, product_ids, k=50, chunk_size=1024, source_path=None):
+    """
+    Compute the top-K LSI neighbors of every product, chunk by chunk
+
+    Args:
+        similarity_index: Gensim MatrixSimilarity (its normalized `index` matrix is used)
+        product_ids: product_id of every row of the index
+        k: Number of neighbors to keep per product
+        chunk_size: Number of products scored per matrix product
+        source_path: Similarity index file, recorded to detect stale tables
+
+    Returns:
+        NeighborTable
+    """
+    vectors = np.asarray(similarity_index.index, dtype=np.float32)
+    n_products = len(vectors)
+    k = min(k, n_products - 1)
+    neighbors = np.empty((n_products, k), dtype=np.int32)
+    scores = np.empty((n_products, k), dtype=np.float32)
+
+    for start in range(0, n_products, chunk_size):
+        stop = min(start + chunk_size, n_products)
+        sims = vectors[start:stop] @ vectors.T
+        # Exclude each product from its own neighbor list
+        sims[np.arange(stop - start), np.arange(start, stop)] = -np.inf
+        top_indices, top_scores = select_top_k_rows(sims, k)
+        neighbors[start:stop] = top_indices
+        scores[start:stop] = top_scores
+
+    return NeighborTable(
+        neighbors=neighbors,
+        scores=scores,
+        product_ids=np.asarray(product_ids),
+        source_signature=file_signature(source_path) if source_path else None,
+    )
+
+
+# Một tiêu chí xếp hạng lại các ứng viên (giá trị lớn hơn xếp trước)
+class RankingKey:
+    """
+    One criterion of the re-ranking stage
+
+    Keys are applied in order: the first key decides, the next ones only break
+    its ties, and rows still tied keep their selection order (like a stable
+    multi-column `sort_values(..., ascending=False)`).
+
+    Args:
+        name: Label of the key
+        func: Callable(candidates) returning one sort value per candidate, higher
+            first (NaN last). `candidates` maps 'similarity_score', 'position' and
+            the requested catalog columns to arrays aligned with the candidates
+        columns: Catalog columns the key reads
+    """
+
+    def __init__(self, name, func, columns=()):
+        self.name = name
+        self.func = func
+        self.columns = tuple(columns)
+
+    def __repr__(self):
+        return f"RankingKey({self.name!r})"
+
+    def values(self, candidates):
+        return np.asarray(self.func(candidates), dtype=np.float64)
+
+
+def score_key():
+    """Similarity score"""
+    return RankingKey('similarity_score', lambda c: c['similarity_score'])
+
+
+def same_category_key(sub_category):
+    """Products of the given sub_category first"""
+    return RankingKey('same_category', lambda c: c['sub_category'] == sub_category, columns=['sub_category'])
+
+
+def column_key(column):
+    """Higher values of a numeric catalog column first (e.g. rating)"""
+    return RankingKey(column, lambda c: pd.to_numeric(pd.Series(c[column]), errors='coerce').to_numpy(dtype=np.float64), columns=[column])
+
+
+def price_band_key(low=None, high=None):
+    """Products priced inside [low, high] first"""
+    def in_band(candidates):
+        prices = pd.to_numeric(pd.Series(candidates['price']), errors='coerce').to_numpy(dtype=np.float64)
+        mask = ~np.isnan(prices)
+        if low is not None:
+            mask &= prices >= low
+        if high is not None:
+            mask &= prices <= high
+        return mask
+    return RankingKey('price_band', in_band, columns=['price'])
+
+
+def popularity_boost_key(popularity, weight=0.05):
+    """
+    Similarity score plus a log-scaled popularity boost (use instead of score_key)
+
+    Args:
+        popularity: Array of popularity counts per catalog row (e.g. number of ratings)
+        weight: Boost per unit of log1p(popularity)
+    """
+    popularity = np.log1p(np.asarray(popularity, dtype=np.float64))
+    return RankingKey('popularity_boost', lambda c: c['similarity_score'] + weight * popularity[c['position']])
+
+
+def default_ranking_keys(catalog, selected_sub_category=None, by_query=False):
+    """
+    Ranking keys of the original recommenders
+
+    Product queries: score, then same sub_category, then rating. Text queries:
+    score, then rating. Otherwise the selection order (score) is kept.
+    """
+    # catalog.columns includes the columns a lazy columnar store has not loaded into df
+    columns = catalog.columns
+    if selected_sub_category is not None and 'sub_category' in columns:
+        keys = [score_key(), same_category_key(selected_sub_category)]
+        if 'rating' in columns:
+            keys.append(column_key('rating'))
+        return keys
+    if by_query and 'rating' in columns:
+        return [score_key(), column_key('rating')]
+    return []
+
+
+# Xếp hạng lại ứng viên bằng np.lexsort và tạo DataFrame kết quả một lần
+@TRACER.traced('rerank')
+def rerank_candidates(catalog, positions, scores, ranking_keys, nums, exclude_product_id=None):
+    """
+    Order the selected candidates by the ranking keys and build the result
+
+    Args:
+        catalog: CatalogIndex the candidates come from
+        positions: Catalog row positions of the candidates (selection order)
+        scores: Similarity score of every candidate
+        ranking_keys: List of RankingKey, most important first
+        nums: Number of recommendations to return
+        exclude_product_id: product_id that must not appear in the results
+
+    Returns:
+        DataFrame with product_id, product_name, [sub_category], [rating], similarity_score
+    """
+    positions = np.asarray(positions, dtype=np.int64)
+    scores = np.asarray(scores)
+    if exclude_product_id is not None:
+        keep = catalog.column('product_id')[positions] != exclude_product_id
+        positions, scores = positions[keep], scores[keep]
+
+    if ranking_keys:
+        candidates = {'similarity_score': scores, 'position': positions}
+        for key in ranking_keys:
+            for column in key.columns:
+                if column not in candidates:
+                    candidates[column] = catalog.column(column)[positions]
+        # np.lexsort sorts by the last key first and is stable, so ties keep the selection order
+        order = np.lexsort([-key.values(candidates) for key in reversed(ranking_keys)])
+        positions, scores = positions[order], scores[order]
+
+    positions, scores = positions[:nums], scores[:nums]
+    columns = ['product_id', 'product_name']
+    columns += [c for c in ('sub_category', 'rating') if c in catalog.columns]
+    result = {column: catalog.column(column)[positions] for column in columns}
+    result['similarity_score'] = scores
+    return pd.DataFrame(result, index=catalog.df.index[positions])
+
+
+# Chọn top-k từ mảng độ tương đồng (thay cho sắp xếp toàn bộ bằng Python)
+@TRACER.traced('select_top_k')
+def select_top_k(scores, k, exclude=None):
+    """
+    Select the k highest scores of a 1-D similarity array
+
+    Equivalent to `sorted(enumerate(scores), key=lambda x: x[1], reverse=True)`
+    followed by dropping the excluded positions and keeping the first k, but
+    runs in O(n) with `argpartition`. Ties are broken by position, exactly like
+    Python's stable sort.
+
+    Args:
+        scores: 1-D array of similarity scores, one per catalog row
+        k: Number of results to keep
+        exclude: Row position(s) or boolean mask of rows to leave out
+
+    Returns:
+        Tuple (indices, values) sorted by descending score
+    """
+    scores = np.asarray(scores).ravel()
+    candidates = None
+    if exclude is not None:
+        exclude = np.asarray(exclude)
+        if exclude.dtype == bool:
+            keep = ~exclude
+        else:
+            keep = np.ones(len(scores), dtype=bool)
+            keep[exclude] = False
+        candidates = np.flatnonzero(keep)
+        scores = scores[candidates]
+
+    n = len(scores)
+    k = min(k, n)
+    if k <= 0:
+        return np.empty(0, dtype=np.int64), scores[:0]
+
+    if k < n:
+        kth_value = scores[np.argpartition(-scores, k - 1)[k - 1]]
+        above = np.flatnonzero(scores > kth_value)
+        # Fill the remaining slots with the lowest positions tied at the k-th value
+        ties = np.flatnonzero(scores == kth_value)[:k - len(above)]
+        top = np.concatenate([above, ties])
+    else:
+        top = np.arange(n)
+    top = top[np.lexsort((top, -scores[top]))]
+
+    values = scores[top]
+    if candidates is not None:
+        top = candidates[top]
+    return top, values
+
+
+# Chọn top-k theo từng dòng của ma trận điểm
+def select_top_k_rows(scores, k):
+    """
+    Select the top-k columns of every row of a 2-D score matrix
+
+    Uses `argpartition` so each row costs O(n) instead of a full sort; only the
+    k selected entries are sorted (by score, then by column position). Ties at
+    the k-th score keep the lowest columns, like `select_top_k`.
+
+    Args:
+        scores: 2-D NumPy array (rows x candidates)
+        k: Number of columns to keep per row
+
+    Returns:
+        Tuple (indices, values), both of shape (rows, min(k, candidates))
+    """
+    n_rows, n_cols = scores.shape
+    k = min(k, n_cols)
+    if k <= 0:
+        empty = np.empty((n_rows, 0), dtype=np.int64)
+        return empty, np.empty((n_rows, 0), dtype=scores.dtype)
+    if k < n_cols:
+        partitioned = np.argpartition(-scores, k - 1, axis=1)[:, k - 1]
+        kth_values = scores[np.arange(n_rows), partitioned][:, None]
+        above = scores > kth_values
+        # Fill the remaining slots of every row with the lowest columns tied at the k-th value
+        ties = scores == kth_values
+        slots = k - above.sum(axis=1, keepdims=True)
+        selected = above | (ties & (np.cumsum(ties, axis=1) <= slots))
+        indices = np.nonzero(selected)[1].reshape(n_rows, k)
+    else:
+        indices = np.broadcast_to(np.arange(n_cols), (n_rows, n_cols))
+    values = np.take_along_axis(scores, indices, axis=1)
+    order = np.lexsort((indices, -values), axis=-1)
+    return np.take_along_axis(indices, order, axis=1), np.take_along_axis(values, order, axis=1)
+
+
+# Hàm đề xuất hàng loạt cho nhiều người dùng dựa trên Surprise SVD
+def recommend_surprise_batch(surprise, product_ids, user_ids, nums=10, block_size=None, max_block_mb=64):
+    """
+    Stream top-N SVD recommendations for many users, block by block
+
+    Each block of users is scored against all products as one dense matrix
+    product and the top-N per user is selected with `argpartition`, so memory
+    stays bounded by the block size whatever the number of users.
+
+    Args:
+        surprise: Fitted surprise.SVD or SVDScorer
+        product_ids: Raw product ids to recommend from (duplicates are ignored)
+        user_ids: Iterable of raw user ids
+        nums: Number of recommendations per user
+        block_size: Users scored per block (derived from max_block_mb if None)
+        max_block_mb: Memory budget of one dense score block in megabytes
+
+    Yields:
+        Tuple (user_ids, product_ids, scores) for each block, where product_ids
+        and scores have shape (len(user_ids), nums)
+    """
+    scorer = surprise if isinstance(surprise, SVDScorer) else SVDScorer.from_algo(surprise)
+    product_ids = pd.unique(np.asarray(product_ids))
+    factors = scorer.catalog_factors(product_ids)
+
+    if block_size is None:
+        block_size = max(1, int(max_block_mb * 2**20) // (8 * max(len(product_ids), 1)))
+
+    block = []
+    for user_id in user_ids:
+        block.append(user_id)
+        if len(block) == block_size:
+            yield _recommend_surprise_block(scorer, factors, product_ids, block, nums)
+            block = []
+    if block:
+        yield _recommend_surprise_block(scorer, factors, product_ids, block, nums)
+
+
+def _recommend_surprise_block(scorer, factors, product_ids, block, nums):
+    scores = scorer.score_users(block, factors)
+    top_indices, top_scores = select_top_k_rows(scores, nums)
+    return np.asarray(block), product_ids[top_indices], top_scores
+
+
+# Hàm chuyển một lô bag-of-words thành ma trận TF-IDF thưa
+def tfidf_batch(tfidf, bows, num_terms):
+    """
+    Weight many bag-of-words vectors with the TF-IDF model into one CSR matrix
+
+    Args:
+        tfidf: Gensim TfidfModel (or MmapTfidf)
+        bows: List of bag-of-words vectors from `dictionary.doc2bow`
+        num_terms: Number of columns (vocabulary size of the LSI projection)
+
+    Returns:
+        scipy.sparse CSR matrix (len(bows) x num_terms)
+    """
+    indptr = [0]
+    indices = []
+    data = []
+    for bow in bows:
+        for termid, weight in tfidf[bow]:
+            if termid < num_terms:
+                indices.append(termid)
+                data.append(weight)
+        indptr.append(len(indices))
+    return sparse.csr_matrix(
+        (np.asarray(data, dtype=np.float64), np.asarray(indices, dtype=np.int64), np.asarray(indptr, dtype=np.int64)),
+        shape=(len(bows), num_terms),
+    )
+
+
+# Tìm kiếm theo lô: nhiều truy vấn/sản phẩm trong một phép nhân ma trận
+def search_gensim_batch(similarity_index, df, tfidf, lsi_model, dictionary, queries=None, product_ids=None, nums=10, stop_words=None, catalog=None, chunk_size=256):
+    """
+    Top-N LSI neighbors of many text queries or products at once
+
+    The whole batch is weighted into a sparse TF-IDF matrix, projected into
+    LSI space with a single multiply by the projection matrix and scored
+    against the similarity index as (chunk x catalog) matrix products, instead
+    of one Python round trip per query. Used for offline evaluation, to
+    pre-warm the query cache (see `warm_query_cache`) and by the micro-batcher.
+
+    Indexes with their own `top_k` (sharded, int8) are not expanded into a
+    dense matrix: the batch is still projected at once, then every query is
+    scored through `similarity_index.top_k`. With either kind of index, rows
+    with fewer than `nums` live results (tombstoned or excluded rows are never
+    returned) are padded with position -1 and score -inf.
+
+    Args:
+        similarity_index: Gensim MatrixSimilarity or MmapSimilarity exposing `index`, or an index with `top_k`
+        df: DataFrame containing product information
+        tfidf: Gensim TfidfModel
+        lsi_model: Gensim LsiModel (or MmapLsi) exposing `projection.u`
+        dictionary: Gensim Dictionary
+        queries: List of text queries
+        product_ids: List of product ids (each product is excluded from its own results)
+        nums: Number of neighbors per query
+        stop_words: List of stop words to remove from the queries
+        catalog: Prebuilt CatalogIndex over df (built on the fly if None)
+        chunk_size: Number of queries scored per matrix product
+
+    Returns:
+        Tuple (indices, scores) of (n_queries x nums) arrays of catalog row positions and similarities
+    """
+    if catalog is None:
+        catalog = CatalogIndex(df)
+
+    exclude = None
+    if product_ids is not None:
+        exclude = np.fromiter((catalog.position(pid) for pid in product_ids), dtype=np.int64, count=len(product_ids))
+        documents = [catalog.value_at(idx, 'content_processed') for idx in exclude]
+    elif queries is not None:
+        documents = [preprocess_text(query, stop_words=stop_words) for query in queries]
+    else:
+        raise ValueError("Either product_ids or queries must be provided")
+
+    # ShardedIndex.index would materialize the whole catalog on every call, QuantizedIndex has none
+    scored_by_index = hasattr(similarity_index, 'top_k')
+    index = None if scored_by_index else similarity_index.index
+    n_products = len(similarity_index) if scored_by_index else index.shape[0]
+    k = min(nums, n_products - 1 if exclude is not None else n_products)
+    indices = np.empty((len(documents), k), dtype=np.int64)
+    scores = np.empty((len(documents), k), dtype=np.float32)
+
+    # One sparse TF-IDF matrix and one projection for the whole batch
+    projection = lsi_model.projection.u[:, :lsi_model.num_topics]
+    weights = tfidf_batch(tfidf, [dictionary.doc2bow(doc) for doc in documents], projection.shape[0])
+    topics = np.asarray(weights @ projection).astype(np.float32 if scored_by_index else index.dtype)
+    norms = np.sqrt(np.einsum('ij,ij->i', topics, topics))
+    topics /= np.where(norms > 0, norms, 1)[:, None]
+
+    if scored_by_index:
+        indices.fill(-1)
+        scores.fill(-np.inf)
+        deleted = catalog.deleted_positions if catalog.deleted is not None else np.empty(0, dtype=np.int64)
+        for row, topic_vector in enumerate(topics):
+            excluded = deleted if exclude is None else np.append(deleted, exclude[row])
+            top, values = similarity_index.top_k(topic_vector, k, exclude=excluded if len(excluded) else None)
+            indices[row, :len(top)], scores[row, :len(top)] = top, values
+        return indices, scores
+
+    for start in range(0, len(documents), chunk_size):
+        stop = min(start + chunk_size, len(documents))
+        sims = topics[start:stop] @ index.T
+        if catalog.deleted is not None:
+            sims[:, catalog.deleted_positions] = -np.inf
+        if exclude is not None:
+            sims[np.arange(stop - start), exclude[start:stop]] = -np.inf
+        indices[start:stop], scores[start:stop] = select_top_k_rows(sims, k)
+
+    # Past the live rows the selection reaches the -inf (deleted or excluded) ones
+    indices[np.isneginf(scores)] = -1
+    return indices, scores
+
+
+# Nạp trước kết quả của các truy vấn phổ biến vào bộ nhớ đệm
+def warm_query_cache(cache, similarity_index, df, tfidf, lsi_model, dictionary, queries=None, product_ids=None, nums=10, stop_words=None, catalog=None):
+    """
+    Fill a QueryResultCache with the batch results of known queries or products
+
+    Entries are stored under the same keys `get_recommendations_gensim` looks
+    up, so the next interactive request for any of them is a cache hit.
+
+    Returns:
+        Number of entries written
+    """
+    if catalog is None:
+        catalog = CatalogIndex(df)
+    # The selection of the default ranking: nums*2 candidates
+    selection = nums*2
+    indices, scores = search_gensim_batch(
+        similarity_index, df, tfidf, lsi_model, dictionary,
+        queries=queries, product_ids=product_ids, nums=selection, stop_words=stop_words, catalog=catalog,
+    )
+    if product_ids is not None:
+        keys = [cache.make_key('gensim-product', [pid], selection) for pid in product_ids]
+    else:
+        keys = [cache.make_key('gensim', preprocess_text(query, stop_words=stop_words), selection) for query in queries]
+    for key, row_indices, row_scores in zip(keys, indices, scores):
+        # Padding slots are not results
+        found = row_indices >= 0
+        cache.put(key, row_indices[found], row_scores[found])
+    return len(keys)